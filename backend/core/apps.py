@@ -51,6 +51,7 @@ class CoreConfig(AppConfig):
             from core.musiq import musiq
             from core.musiq import playback
             from core.settings import basic
+            from core.settings import library
             from core.settings import platforms
             from core.lights import worker
 
@@ -63,6 +64,7 @@ class CoreConfig(AppConfig):
             musiq.start()
             basic.start()
             platforms.start()
+            library.start()
 
             def stop_workers() -> None:
                 # wake up the playback thread and stop it
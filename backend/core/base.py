@@ -17,7 +17,7 @@ from core.lights import controller
 from core.musiq import musiq
 from core.settings import storage
 from core.settings import system
-from core.state_handler import send_state
+from core.state_handler import request_update
 
 
 def _get_random_hashtag() -> str:
@@ -137,5 +137,6 @@ def upgrade_available(_request: WSGIRequest) -> HttpResponse:
 
 
 def update_state() -> None:
-    """Sends an update event to all connected clients."""
-    send_state(state_dict())
+    """Sends an update event to all connected clients.
+    Updates requested in quick succession are sent only once."""
+    request_update("base", state_dict)
@@ -10,7 +10,7 @@ from django.core.handlers.wsgi import WSGIRequest
 from django.http import HttpResponse, HttpResponseForbidden, HttpResponseBadRequest
 
 from core import user_manager, redis
-from core.lights import lights
+from core.lights import lights, wled
 from core.settings import storage
 from core.settings.storage import DeviceBrightness, DeviceMonochrome, DeviceProgram
 from core.util import extract_value, strtobool
@@ -95,6 +95,18 @@ def set_ups(request: WSGIRequest) -> HttpResponse:
     return response
 
 
+@control
+def set_max_overrun_rate(request: WSGIRequest) -> HttpResponse:
+    """Updates the fraction of frames that may overrun before the ups are lowered."""
+    value, response = extract_value(request.POST)
+    rate = float(value)
+    if not 0 <= rate <= 1:
+        return HttpResponseBadRequest("rate must be between 0 and 1")
+    storage.put("max_overrun_rate", rate)
+    _notify_settings_changed("base")
+    return response
+
+
 @control
 def set_program_speed(request: WSGIRequest) -> HttpResponse:
     """Updates the global speed of programs supporting it."""
@@ -168,8 +180,9 @@ def set_ring_monochrome(request: WSGIRequest) -> HttpResponse:
 def set_wled_led_count(request: WSGIRequest) -> HttpResponse:
     """Updates the wled led_count."""
     value, response = extract_value(request.POST)
-    if not 2 <= int(value) <= 490:
-        return HttpResponseBadRequest("must be between 2 and 490")
+    # the realtime protocol addresses leds with 16 bits
+    if not 2 <= int(value) <= 65535:
+        return HttpResponseBadRequest("must be between 2 and 65535")
     storage.put("wled_led_count", int(value))
     _notify_settings_changed("wled")
     return response
@@ -199,6 +212,31 @@ def set_wled_port(request: WSGIRequest) -> HttpResponse:
     return response
 
 
+@control
+def set_wled_protocol(request: WSGIRequest) -> HttpResponse:
+    """Updates the protocol used to send frames to wled."""
+    value, response = extract_value(request.POST)
+    if value not in wled.PROTOCOLS:
+        return HttpResponseBadRequest("unknown protocol")
+    storage.put("wled_protocol", value)
+    _notify_settings_changed("wled")
+    return response
+
+
+@control
+def set_wled_targets(request: WSGIRequest) -> HttpResponse:
+    """Updates the wled instances that receive frames and their leds.
+    If no targets are given, all leds are sent to the wled ip."""
+    value, response = extract_value(request.POST)
+    try:
+        wled.parse_targets(value, storage.get("wled_port"))
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    storage.put("wled_targets", value)
+    _notify_settings_changed("wled")
+    return response
+
+
 @control
 def set_wled_program(request: WSGIRequest) -> HttpResponse:
     """Updates the wled program."""
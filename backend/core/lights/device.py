@@ -1,10 +1,11 @@
 """This module contains the device superclass."""
-from typing import cast
+from typing import Any, cast
 
 from core import redis
 from core.redis import DeviceInitialized
 from core.settings import storage
 from core.settings.storage import DeviceBrightness, DeviceMonochrome
+from core.lights.output import Output
 from core.lights.programs import LightProgram, Disabled
 
 
@@ -20,6 +21,8 @@ class Device:
         self.initialized = False
         redis.put(cast(DeviceInitialized, f"{self.name}_initialized"), False)
         self.program: LightProgram = Disabled(manager)
+        # frames are sent from their own thread, see send()
+        self.output = Output(self)
 
     def load_program(self) -> None:
         """Load and activate this device's program from the database."""
@@ -34,6 +37,10 @@ class Device:
 
         self.program.use()
 
+    def send(self, frame: Any) -> None:
+        """Shows the given frame on this device. Called from the thread of its output."""
+        raise NotImplementedError()
+
     def clear(self) -> None:
         """Resets this device, clearing all visualization."""
         raise NotImplementedError()
@@ -1,7 +1,9 @@
 """This module contains all programs that use leds."""
 import colorsys
 import math
-from typing import List, Tuple, cast, TYPE_CHECKING
+from typing import Dict, Tuple, TYPE_CHECKING
+
+import numpy as np
 
 from core.lights.programs import LedProgram
 
@@ -9,7 +11,15 @@ if TYPE_CHECKING:
     from core.lights.worker import DeviceManager
 
 
-def stretched_hues(led_count: int, offset: float = 0):
+def hsv_to_rgb(hues: np.ndarray) -> np.ndarray:
+    """Converts the given hues to fully saturated, full brightness rgb colors.
+    Like colorsys.hsv_to_rgb for every hue, returns an array of shape (len(hues), 3)."""
+    # https://en.wikipedia.org/wiki/HSL_and_HSV#HSV_to_RGB_alternative
+    k = (np.array([5, 3, 1]) + hues[:, np.newaxis] * 6) % 6
+    return 1 - np.clip(np.minimum(k, 4 - k), 0, 1)
+
+
+def stretched_hues(led_count: int, offset: float = 0) -> np.ndarray:
     """Stretches red and blue, compresses green and pink."""
     # Uses the logistic curve to make colors more prominent and compress the others
     #
@@ -32,29 +42,30 @@ def stretched_hues(led_count: int, offset: float = 0):
     max1 = 2 / 3
     max2 = 1 / 3
 
-    def logistic(fraction: float) -> float:
-        # First curve, compresses green (hue = ⅓)
-        def logistic1(val: float) -> float:
-            return max1 / (1 + math.e ** (-16 * (val - 1 / 3)))
+    # First curve, compresses green (hue = ⅓)
+    def logistic1(val):
+        return max1 / (1 + np.exp(-16 * (val - 1 / 3)))
 
-        # First curve, compresses pink (hue = ⅚)
-        def logistic2(val: float) -> float:
-            return max2 / (1 + math.e ** (-16 * (val - 5 / 6)))
+    # Second curve, compresses pink (hue = ⅚)
+    def logistic2(val):
+        return max2 / (1 + np.exp(-16 * (val - 5 / 6)))
 
-        if fraction < 2 / 3:
-            # Vertically stretch and move the curve so it starts at y=0 and ends at y=M
-            yoffset = logistic1(0)
-            scale = max1 / (max1 - 2 * yoffset)
-            return scale * (logistic1(fraction) - yoffset)
+    # Vertically stretch and move the curves so they start at y=0 and end at y=M
+    yoffset1 = logistic1(0)
+    scale1 = max1 / (max1 - 2 * yoffset1)
+    yoffset2 = logistic2(2 / 3)
+    scale2 = max2 / (max2 - 2 * yoffset2)
 
-        yoffset = logistic2(2 / 3)
-        scale = max2 / (max2 - 2 * yoffset)
-        return scale * (logistic2(fraction) - yoffset) + max1
+    fractions = (offset + np.arange(led_count) / led_count) % 1
+    hues = np.where(
+        fractions < 2 / 3,
+        scale1 * (logistic1(fractions) - yoffset1),
+        scale2 * (logistic2(fractions) - yoffset2) + max1,
+    )
+    return hues % 1
 
-    return [logistic((offset + led / led_count) % 1) % 1 for led in range(0, led_count)]
 
-
-def stretched_hues_spectrum(led_count: int):
+def stretched_hues_spectrum(led_count: int) -> np.ndarray:
     """Stretches red and blue, compressing green, but removes pink.
     Adds a short red section, because red is chronically underrepresented.
     Doesn't take an offset, because the ends do not match up,
@@ -72,17 +83,25 @@ def stretched_hues_spectrum(led_count: int):
     #   R  G  B  R
     max_value = 2 / 3
 
-    def scaled_logistic(fraction: float) -> float:
-        def logistic(val: float) -> float:
-            return max_value / (1 + math.e ** (-12 * (val - 9 / 16)))
+    def logistic(val):
+        return max_value / (1 + np.exp(-12 * (val - 9 / 16)))
+
+    yoffset = logistic(1 / 8)
+    scale = max_value / (max_value - 2 * yoffset)
+
+    fractions = np.arange(led_count) / led_count
+    hues = np.where(fractions < 1 / 8, 0, scale * logistic(fractions) - yoffset)
+    return hues % 1
 
-        if fraction < 1 / 8:
-            return 0
-        yoffset = logistic(1 / 8)
-        scale = max_value / (max_value - 2 * yoffset)
-        return scale * logistic(fraction) - yoffset
 
-    return [scaled_logistic(led / led_count) % 1 for led in range(0, led_count)]
+def _bins(value_count: int, led_count: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Divides the given number of values into one contiguous bin per led.
+    # Returns the start and end index of every bin.
+    # If there are more leds than values, neighboring leds share a value.
+    leds = np.arange(led_count)
+    starts = leds * value_count // led_count
+    ends = np.maximum((leds + 1) * value_count // led_count, starts + 1)
+    return starts, ends
 
 
 class Fixed(LedProgram):
@@ -97,17 +116,19 @@ class Fixed(LedProgram):
         if alarm_factor != -1.0:
             self.manager.settings["fixed_color"] = (alarm_factor, 0, 0)
 
-    def ring_colors(self) -> List[Tuple[float, float, float]]:
-        return [
-            self.manager.settings["fixed_color"]
-            for _ in range(self.manager.devices.ring.LED_COUNT)
-        ]
+    def ring_colors(self) -> np.ndarray:
+        return np.full(
+            (self.manager.devices.ring.LED_COUNT, 3),
+            self.manager.settings["fixed_color"],
+            dtype=float,
+        )
 
-    def wled_colors(self) -> List[Tuple[float, float, float]]:
-        return [
-            self.manager.settings["fixed_color"]
-            for _ in range(self.manager.devices.wled.led_count)
-        ]
+    def wled_colors(self) -> np.ndarray:
+        return np.full(
+            (self.manager.devices.wled.led_count, 3),
+            self.manager.settings["fixed_color"],
+            dtype=float,
+        )
 
     def strip_color(self) -> Tuple[float, float, float]:
         return self.manager.settings["fixed_color"]
@@ -127,21 +148,19 @@ class Rainbow(LedProgram):
 
     def compute(self) -> None:
         self.time_passed += (
-            1 / self.manager.settings["ups"] * self.manager.settings["program_speed"]
+            self.manager.scheduler.frame_duration
+            * self.manager.settings["program_speed"]
         )
         self.time_passed %= self.program_duration
         self.current_fraction = self.time_passed / self.program_duration
 
-    def _colors(self, led_count) -> List[Tuple[float, float, float]]:
-        return [
-            colorsys.hsv_to_rgb(hue, 1, 1)
-            for hue in stretched_hues(led_count, self.current_fraction)
-        ]
+    def _colors(self, led_count) -> np.ndarray:
+        return hsv_to_rgb(stretched_hues(led_count, self.current_fraction))
 
-    def ring_colors(self) -> List[Tuple[float, float, float]]:
+    def ring_colors(self) -> np.ndarray:
         return self._colors(self.manager.devices.ring.LED_COUNT)
 
-    def wled_colors(self) -> List[Tuple[float, float, float]]:
+    def wled_colors(self) -> np.ndarray:
         return self._colors(self.manager.devices.wled.led_count)
 
     def strip_color(self) -> Tuple[float, float, float]:
@@ -156,44 +175,29 @@ class Adaptive(LedProgram):
         super().__init__(manager, "Rave")
         self.cava = self.manager.utilities.cava
 
-        # RING
+        # RING and WLED
         # The spectrum needs to have a color for low frequencies (red)
         # and a color for high frequencies (blue)
         # In order to show a clean separation between the spectrum ends,
         # the color between the two (pink) is removed from the pool of possible colors.
-        ring_hues = stretched_hues_spectrum(self.manager.devices.ring.LED_COUNT)
-        self.ring_base_colors = [colorsys.hsv_to_rgb(hue, 1, 1) for hue in ring_hues]
-
-        # WLED
-        # identical to ring, but with a different number of leds
-        wled_hues = stretched_hues_spectrum(self.manager.devices.wled.led_count)
-        self.wled_base_colors = [colorsys.hsv_to_rgb(hue, 1, 1) for hue in wled_hues]
+        # The colors and bins are computed once for every number of leds.
+        self.spectra: Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
 
         # STRIP
         # distribute frequencies over the three leds. Don't use hard cuts, but smooth functions
         # the functions add up to one at every point and each functions integral is a third
         self.strip_granularity = 16
-        self.red_coeffs = [
-            -1
-            / (
-                1
-                + math.e ** (-6 * math.e * (led / (self.strip_granularity - 1) - 1 / 3))
-            )
-            + 1
-            for led in range(0, self.strip_granularity)
-        ]
-        self.blue_coeffs = [
-            1
-            / (
-                1
-                + math.e ** (-6 * math.e * (led / (self.strip_granularity - 1) - 2 / 3))
-            )
-            for led in range(0, self.strip_granularity)
-        ]
-        self.green_coeffs = [
-            1 - self.red_coeffs[led] - self.blue_coeffs[led]
-            for led in range(0, self.strip_granularity)
-        ]
+        self.strip_bins = _bins(self.cava.BARS, self.strip_granularity)
+        positions = np.arange(self.strip_granularity) / (self.strip_granularity - 1)
+        red_coeffs = -1 / (1 + np.exp(-6 * math.e * (positions - 1 / 3))) + 1
+        blue_coeffs = 1 / (1 + np.exp(-6 * math.e * (positions - 2 / 3)))
+        green_coeffs = 1 - red_coeffs - blue_coeffs
+        # one row per color channel, scaled so that the average over all bins is used
+        self.strip_coeffs = (
+            np.stack([red_coeffs, green_coeffs, blue_coeffs])
+            * 3
+            / self.strip_granularity
+        )
 
     def start(self) -> None:
         self.cava.use()
@@ -201,65 +205,35 @@ class Adaptive(LedProgram):
     def compute(self) -> None:
         pass
 
-    def _aggregate_frame(self, led_count) -> List[float]:
-        # aggregate the length of cavas frame into a list the length of the number of leds we have.
-        # This reduces computation time.
-        values_per_led = len(self.cava.current_frame) // led_count
-        left = len(self.cava.current_frame) - values_per_led * led_count
-
-        start = 0
-
-        aggregated = []
-        for _ in range(led_count):
-            end = start + values_per_led
-            bin_size = values_per_led
-            if left > 0:
-                end += 1
-                left -= 1
-                bin_size += 1
-
-            aggregated.append(sum(self.cava.current_frame[start:end]) / bin_size)
-            start += values_per_led
-        return aggregated
-
-    def ring_colors(self) -> List[Tuple[float, float, float]]:
-        aggregated = self._aggregate_frame(self.manager.devices.ring.LED_COUNT)
-        colors = [
-            tuple(factor * val for val in color)
-            for factor, color in zip(aggregated, self.ring_base_colors)
-        ]
-        # https://github.com/python/mypy/issues/5068
-        return cast(List[Tuple[float, float, float]], colors)
-
-    def wled_colors(self) -> List[Tuple[float, float, float]]:
-        aggregated = self._aggregate_frame(self.manager.devices.wled.led_count)
-        colors = [
-            tuple(factor * val for val in color)
-            for factor, color in zip(aggregated, self.wled_base_colors)
-        ]
-        # https://github.com/python/mypy/issues/5068
-        return cast(List[Tuple[float, float, float]], colors)
+    def _spectrum(self, led_count: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # returns the bins of the frame and the base color of every led
+        if led_count not in self.spectra:
+            starts, ends = _bins(self.cava.BARS, led_count)
+            colors = hsv_to_rgb(stretched_hues_spectrum(led_count))
+            self.spectra[led_count] = (starts, ends, colors)
+        return self.spectra[led_count]
+
+    def _aggregate_frame(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        # aggregate the length of cavas frame into an array the length of the number of leds we have.
+        # The sum of every bin is the difference of the cumulative sums at its ends.
+        cumulative = np.zeros(self.cava.BARS + 1)
+        np.cumsum(self.cava.current_frame, out=cumulative[1:])
+        # cava's values are between 0 and 255
+        return (cumulative[ends] - cumulative[starts]) / ((ends - starts) * 255)
+
+    def _colors(self, led_count: int) -> np.ndarray:
+        starts, ends, base_colors = self._spectrum(led_count)
+        return self._aggregate_frame(starts, ends)[:, np.newaxis] * base_colors
+
+    def ring_colors(self) -> np.ndarray:
+        return self._colors(self.manager.devices.ring.LED_COUNT)
+
+    def wled_colors(self) -> np.ndarray:
+        return self._colors(self.manager.devices.wled.led_count)
 
     def strip_color(self) -> Tuple[float, float, float]:
-        aggregated = self._aggregate_frame(self.strip_granularity)
-        red = (
-            sum(coeff * val for coeff, val in zip(self.red_coeffs, aggregated))
-            * 3
-            / self.strip_granularity
-        )
-        green = (
-            sum(coeff * val for coeff, val in zip(self.green_coeffs, aggregated))
-            * 3
-            / self.strip_granularity
-        )
-        blue = (
-            sum(coeff * val for coeff, val in zip(self.blue_coeffs, aggregated))
-            * 3
-            / self.strip_granularity
-        )
-        red = min(1.0, red)
-        green = min(1.0, green)
-        blue = min(1.0, blue)
+        aggregated = self._aggregate_frame(*self.strip_bins)
+        red, green, blue = np.minimum(self.strip_coeffs @ aggregated, 1.0).tolist()
         return red, green, blue
 
     def stop(self) -> None:
@@ -11,41 +11,85 @@ from django.shortcuts import render
 
 from core import user_manager, base, redis, util
 from core.settings import storage
-from core.state_handler import send_state
+from core.state_handler import request_update
 
 
 def state_dict() -> Dict[str, Any]:
     """Extends the base state with lights-specific information and returns it."""
     state = base.state_dict()
 
-    lights_state: Dict[str, Any] = {}
-    lights_state["ringConnected"] = redis.get("ring_initialized")
-    lights_state["ringProgram"] = storage.get("ring_program")
-    lights_state["ringBrightness"] = storage.get("ring_brightness")
-    lights_state["ringMonochrome"] = storage.get("ring_monochrome")
-    lights_state["wledLedCount"] = storage.get("wled_led_count")
-    lights_state["wledIp"] = storage.get("wled_ip")
-    lights_state["wledPort"] = storage.get("wled_port")
-    lights_state["wledConnected"] = redis.get("wled_initialized")
-    lights_state["wledProgram"] = storage.get("wled_program")
-    lights_state["wledBrightness"] = storage.get("wled_brightness")
-    lights_state["wledMonochrome"] = storage.get("wled_monochrome")
-    lights_state["stripConnected"] = redis.get("strip_initialized")
-    lights_state["stripProgram"] = storage.get("strip_program")
-    lights_state["stripBrightness"] = storage.get("strip_brightness")
-    lights_state["screenConnected"] = redis.get("screen_initialized")
-    lights_state["screenProgram"] = storage.get("screen_program")
+    # settings are fetched at once, their names in the state are camelized
+    settings = storage.get_many(
+        [
+            "ring_program",
+            "ring_brightness",
+            "ring_monochrome",
+            "wled_led_count",
+            "wled_ip",
+            "wled_port",
+            "wled_protocol",
+            "wled_targets",
+            "wled_program",
+            "wled_brightness",
+            "wled_monochrome",
+            "strip_program",
+            "strip_brightness",
+            "screen_program",
+            "dynamic_resolution",
+            "ups",
+            "max_overrun_rate",
+            "program_speed",
+            "initial_resolution",
+            "fixed_color",
+        ]
+    )
+    lights_state: Dict[str, Any] = util.camelize(settings)
+    values = redis.get_many(
+        [
+            "ring_initialized",
+            "wled_initialized",
+            "strip_initialized",
+            "screen_initialized",
+            "current_resolution",
+            "current_fps",
+            "cava_dropped_frames",
+            "cava_late_frames",
+            "lights_timings",
+        ]
+    )
+    lights_state["ringConnected"] = values["ring_initialized"]
+    lights_state["wledConnected"] = values["wled_initialized"]
+    lights_state["stripConnected"] = values["strip_initialized"]
+    lights_state["screenConnected"] = values["screen_initialized"]
     lights_state["initialResolution"] = util.format_resolution(
-        storage.get("initial_resolution")
+        settings["initial_resolution"]
     )
-    lights_state["dynamicResolution"] = storage.get("dynamic_resolution")
     lights_state["currentResolution"] = util.format_resolution(
-        redis.get("current_resolution")
+        values["current_resolution"]
+    )
+    lights_state["currentFps"] = f"{values['current_fps']:.2f}"
+    lights_state["cavaDroppedFrames"] = values["cava_dropped_frames"]
+    lights_state["cavaLateFrames"] = values["cava_late_frames"]
+    timings = values["lights_timings"]
+    lights_state["frameTimings"] = timings.get("timings", {})
+    frame = lights_state["frameTimings"].get("frame")
+    lights_state["frameTime"] = (
+        f"{frame['p50']:.1f} / {frame['p95']:.1f} / {frame['max']:.1f} ms"
+        if frame
+        else "-"
+    )
+    lights_state["currentUps"] = f"{timings.get('ups', settings['ups']):.1f}"
+    lights_state["frameOverruns"] = timings.get("overruns", 0)
+    outputs = timings.get("outputs", {})
+    lights_state["outputTimings"] = outputs
+    lights_state["sendTime"] = (
+        ", ".join(f"{name} {output['p95']:.1f} ms" for name, output in outputs.items())
+        or "-"
+    )
+    lights_state["droppedOutputFrames"] = sum(
+        output["dropped"] for output in outputs.values()
     )
-    lights_state["currentFps"] = f"{redis.get('current_fps'):.2f}"
-    lights_state["ups"] = storage.get("ups")
-    lights_state["programSpeed"] = storage.get("program_speed")
-    red, green, blue = (int(val * 255) for val in storage.get("fixed_color"))
+    red, green, blue = (int(val * 255) for val in settings["fixed_color"])
     lights_state["fixedColor"] = f"#{red:02x}{green:02x}{blue:02x}"
 
     state["lights"] = lights_state
@@ -69,5 +113,6 @@ def index(request: WSGIRequest) -> HttpResponse:
 
 
 def update_state() -> None:
-    """Sends an update event to all connected clients."""
-    send_state(state_dict())
+    """Sends an update event to all connected clients.
+    Updates requested in quick succession are sent only once."""
+    request_update("lights", state_dict)
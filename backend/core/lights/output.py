@@ -0,0 +1,83 @@
+"""This module contains the output stage that sends frames to a device in its own thread,
+so a slow bus does not delay the computation of frames or the other devices."""
+import logging
+import time
+from collections import deque
+from threading import Condition, Lock, Thread
+from typing import Any, Deque, Dict, Optional
+
+from core.lights.scheduler import WINDOW, summarize
+
+
+class Output:
+    """A mailbox holding the newest frame of a device and the thread sending it.
+    Frames that were not sent before the next one arrived are dropped."""
+
+    def __init__(self, device) -> None:
+        self.device = device
+        self.condition = Condition()
+        # held while the device is written to, so it can be cleared in between frames
+        self.send_lock = Lock()
+        self.frame: Any = None
+        self.pending = False
+        self.active = False
+        self.thread: Optional[Thread] = None
+        self.dropped = 0
+        self.latencies: Deque[float] = deque(maxlen=WINDOW)
+
+    def publish(self, frame: Any) -> None:
+        """Replaces the frame waiting to be sent with the given one."""
+        with self.condition:
+            if self.thread is None:
+                # devices that never show a frame do not need a thread
+                self.active = True
+                self.thread = Thread(
+                    target=self._send_frames, name=f"{self.device.name}-output"
+                )
+                self.thread.daemon = True
+                self.thread.start()
+            if self.pending:
+                self.dropped += 1
+            self.frame = frame
+            self.pending = True
+            self.condition.notify()
+
+    def _send_frames(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or not self.active)
+                if not self.active:
+                    return
+                frame = self.frame
+                self.frame = None
+                self.pending = False
+            with self.send_lock:
+                start = time.monotonic()
+                try:
+                    self.device.send(frame)
+                except Exception:  # pylint: disable=broad-except
+                    # a failing device must not stop the output
+                    logging.exception("could not send frame to %s", self.device.name)
+                self.latencies.append(time.monotonic() - start)
+
+    def clear(self) -> None:
+        """Drops the waiting frame and clears the device after the current frame was sent."""
+        with self.condition:
+            self.frame = None
+            self.pending = False
+        with self.send_lock:
+            self.device.clear()
+
+    def stop(self) -> None:
+        """Stops the thread sending the frames."""
+        with self.condition:
+            self.active = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+            self.thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the median, 95th percentile and maximum send latency in milliseconds
+        together with the number of dropped frames."""
+        return {**summarize(sorted(self.latencies)), "dropped": self.dropped}
@@ -2,14 +2,17 @@
 
 from __future__ import annotations
 
-import errno
+import io
 import logging
 import os
 import subprocess
-from typing import Tuple, List, Optional, TYPE_CHECKING
+import time
+from typing import Tuple, Optional, TYPE_CHECKING
 
+import numpy as np
 from django.conf import settings as conf
 
+from core import redis
 from core.lights import leds
 
 if TYPE_CHECKING:
@@ -52,12 +55,14 @@ class LightProgram:
 class LedProgram(LightProgram):
     """The base class for all led visualization programs."""
 
-    def ring_colors(self) -> List[Tuple[float, float, float]]:
-        """Returns the colors for the ring, one rgb tuple for each led."""
+    def ring_colors(self) -> np.ndarray:
+        """Returns the colors for the ring, an array of shape (led count, 3)
+        containing rgb values between 0 and 1."""
         raise NotImplementedError()
 
-    def wled_colors(self) -> List[Tuple[float, float, float]]:
-        """Returns the colors for WLED, one rgb tuple for each led."""
+    def wled_colors(self) -> np.ndarray:
+        """Returns the colors for WLED, an array of shape (led count, 3)
+        containing rgb values between 0 and 1."""
         raise NotImplementedError()
 
     def strip_color(self) -> Tuple[float, float, float]:
@@ -75,10 +80,10 @@ class Disabled(LedProgram, ScreenProgram):
     def __init__(self, manager: "DeviceManager") -> None:
         super().__init__(manager, "Disabled")
 
-    def ring_colors(self) -> List[Tuple[float, float, float]]:
+    def ring_colors(self) -> np.ndarray:
         raise NotImplementedError()
 
-    def wled_colors(self) -> List[Tuple[float, float, float]]:
+    def wled_colors(self) -> np.ndarray:
         raise NotImplementedError()
 
     def strip_color(self) -> Tuple[float, float, float]:
@@ -113,7 +118,7 @@ class Alarm(LightProgram):
         # do not compute if the alarm is not active
         if self.consumers == 0:
             return
-        self.time_passed += 1 / self.manager.settings["ups"]
+        self.time_passed += self.manager.scheduler.frame_duration
         if self.time_passed >= Alarm.SOUND_REPETITION:
             self.sound_count += 1
             self.time_passed %= Alarm.SOUND_REPETITION
@@ -157,6 +162,11 @@ class Cava(LightProgram):
     # Keep these configurations in sync with config/cava.config
     BARS = 256
     BIT_FORMAT = 8
+    # the number of frames the ring buffer can hold,
+    # large enough to drain the whole pipe (64 KiB) with one read
+    RING_FRAMES = 256
+    # the frame counters are published in this interval (seconds)
+    REPORT_INTERVAL = 1.0
 
     def __init__(self, manager: "DeviceManager") -> None:
         super().__init__(manager, "Cava")
@@ -165,14 +175,37 @@ class Cava(LightProgram):
 
         self.frame_length = Cava.BARS * (Cava.BIT_FORMAT // 8)
 
-        self.current_frame: List[float] = []
-        self.growing_frame = b""
+        # cava's output is read into this buffer, frames never wrap around its end
+        self.ring = bytearray(self.frame_length * Cava.RING_FRAMES)
+        self.ring_view = memoryview(self.ring)
+        # where the next read continues
+        self.ring_position = 0
+        # silence until the first frame was read, separate from the ring
+        self.empty_frame = np.zeros(self.frame_length, dtype=np.uint8)
+        self.empty_frame.flags.writeable = False
+        # the newest complete frame, one value between 0 and 255 per bar.
+        # A read-only view into the ring, valid until the next compute.
+        self.current_frame = self.empty_frame
+        # frames that were skipped because a newer one was available
+        self.dropped_frames = 0
+        # updates in which no new frame was available
+        self.late_frames = 0
+        self.last_report = 0.0
         self.cava_process: Optional[subprocess.Popen] = None
-        self.cava_fifo = -1
+        self.cava_fifo: Optional[io.FileIO] = None
+
+    def _frame_at(self, offset: int) -> np.ndarray:
+        frame = np.frombuffer(
+            self.ring, dtype=np.uint8, count=self.frame_length, offset=offset
+        )
+        frame.flags.writeable = False
+        return frame
 
     def start(self) -> None:
-        self.current_frame = [0 for _ in range(Cava.BARS)]
-        self.growing_frame = b""
+        self.ring_position = 0
+        self.current_frame = self.empty_frame
+        self.dropped_frames = 0
+        self.late_frames = 0
         try:
             # delete old contents of the pipe
             os.remove(self.cava_fifo_path)
@@ -194,41 +227,60 @@ class Cava(LightProgram):
             cwd=conf.BASE_DIR,
             env={"PULSE_SERVER": conf.PULSE_SERVER, **os.environ},
         )
-        self.cava_fifo = os.open(self.cava_fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+        self.cava_fifo = io.FileIO(
+            os.open(self.cava_fifo_path, os.O_RDONLY | os.O_NONBLOCK), "rb"
+        )
+
+    def _read(self) -> int:
+        # reads all available bytes into the ring, returns the number of completed frames
+        assert self.cava_fifo
+        completed = 0
+        newest = -1
+        while True:
+            try:
+                read = self.cava_fifo.readinto(self.ring_view[self.ring_position :])
+            except OSError as error:
+                logging.info("could not read from cava: %s", error)
+                break
+            # None if no bytes are available, 0 if cava closed the pipe
+            if not read:
+                break
+            frame_start = self.ring_position - self.ring_position % self.frame_length
+            self.ring_position += read
+            # cava writes whole frames, so frames start at multiples of the frame length
+            frames = (self.ring_position - frame_start) // self.frame_length
+            if frames:
+                completed += frames
+                newest = frame_start + (frames - 1) * self.frame_length
+            if self.ring_position == len(self.ring):
+                self.ring_position = 0
+        if completed:
+            self.current_frame = self._frame_at(newest)
+        return completed
 
     def compute(self) -> None:
         """If active, read output from the cava program.
-        Make sure that the most recent frame is always fully available,
+        Only the most recent complete frame is used, older ones are dropped.
         Stores incomplete frames for the next update."""
         # do not compute if no program uses cava
         if self.consumers == 0:
             return
-        # read the fifo until we get to the current frame
-        while True:
-            try:
-                read = os.read(
-                    self.cava_fifo, self.frame_length - len(self.growing_frame)
-                )
-                if read == b"":
-                    return
-                self.growing_frame += read
-            except OSError as error:
-                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
-                    # there were not enough bytes for a whole frame, keep the old frame
-                    return
+        completed = self._read()
+        if completed:
+            self.dropped_frames += completed - 1
+        else:
+            self.late_frames += 1
 
-            # we read a whole frame, update the factors
-            if len(self.growing_frame) == self.frame_length:
-                self.current_frame = [int(b) / 255 for b in self.growing_frame]
-                self.growing_frame = b""
+        now = time.monotonic()
+        if now - self.last_report > Cava.REPORT_INTERVAL:
+            self.last_report = now
+            redis.put("cava_dropped_frames", self.dropped_frames)
+            redis.put("cava_late_frames", self.late_frames)
 
     def stop(self) -> None:
-        try:
-            os.close(self.cava_fifo)
-        except OSError as error:
-            logging.info("fifo already closed: %s", error)
-        except TypeError as error:
-            logging.info("fifo does not exist: %s", error)
+        if self.cava_fifo:
+            self.cava_fifo.close()
+            self.cava_fifo = None
 
         if self.cava_process:
             self.cava_process.terminate()
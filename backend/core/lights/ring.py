@@ -1,5 +1,5 @@
 """This module handles the Neopixel led ring."""
-from typing import List, Tuple
+import numpy as np
 
 from core import redis
 from core.lights.device import Device
@@ -43,18 +43,20 @@ class Ring(Device):
             # could not connect to led ring
             return
 
-    def set_colors(self, colors: List[Tuple[float, float, float]]) -> None:
-        """Sets the colors of the ring to the given list of triples."""
+    def set_colors(self, colors: np.ndarray) -> None:
+        """Sets the colors of the ring to the given array of rgb triples."""
         if not self.initialized:
             return
-        for led in range(self.LED_COUNT):
-            dimmed_color = (self.brightness * val for val in colors[led])
-            scaled_color = tuple(int(val * 255) for val in dimmed_color)
+        scaled_colors = (colors * (self.brightness * 255)).astype(int).tolist()
+        for led, scaled_color in enumerate(scaled_colors):
             self.controller.setPixelColorRGB(
                 (self.LED_COUNT - led + self.LED_OFFSET) % self.LED_COUNT, *scaled_color
             )
         self.controller.show()
 
+    def send(self, frame: np.ndarray) -> None:
+        self.set_colors(frame)
+
     def clear(self) -> None:
         """Turns of all pixels by setting their color to black."""
         if not self.initialized:
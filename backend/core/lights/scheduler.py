@@ -0,0 +1,138 @@
+"""This module contains the scheduler that paces the frames of the lights loop."""
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List
+
+# the statistics are computed over this many frames
+WINDOW = 256
+# the effective ups are never lowered below this
+MIN_UPS = 10.0
+# factor by which the effective ups are lowered or raised
+UPS_STEP = 0.8
+
+
+def _percentile(values: list, fraction: float) -> float:
+    # the value below which the given fraction of the sorted values lies
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Returns the median, 95th percentile and maximum of the given sorted durations
+    in milliseconds. Empty if there are no durations."""
+    if not values:
+        return {}
+    return {
+        "p50": _percentile(values, 0.5) * 1000,
+        "p95": _percentile(values, 0.95) * 1000,
+        "max": values[-1] * 1000,
+    }
+
+
+class FrameScheduler:
+    """Starts a frame every 1/ups seconds of the monotonic clock
+    and measures how long every stage of a frame takes.
+    If too many frames take longer than that, the ups are lowered until they fit."""
+
+    def __init__(self, ups: float, max_overrun_rate: float) -> None:
+        self.target_ups = ups
+        self.ups = ups
+        self.max_overrun_rate = max_overrun_rate
+        # whether the ups were lowered because frames overran
+        self.degraded = False
+        self.overruns = 0
+        self.timings: Dict[str, Deque[float]] = {}
+        self.recent_overruns: Deque[bool] = deque(maxlen=WINDOW)
+        self.frame_start = 0.0
+        # the time the current frame has to be finished
+        self.deadline = float("-inf")
+
+    @property
+    def frame_duration(self) -> float:
+        """The seconds between the start of two frames."""
+        return 1 / self.ups
+
+    def set_ups(self, ups: float, max_overrun_rate: float) -> None:
+        """Changes the configured ups and the rate of overruns that lowers them."""
+        self.target_ups = ups
+        self.ups = ups
+        self.max_overrun_rate = max_overrun_rate
+        self.degraded = False
+        self.recent_overruns.clear()
+
+    def record(self, stage: str, duration: float) -> None:
+        """Records that the given stage of the current frame took :param duration: seconds."""
+        if stage not in self.timings:
+            self.timings[stage] = deque(maxlen=WINDOW)
+        self.timings[stage].append(duration)
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        """Measures the time the enclosed code takes as the given stage."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, time.monotonic() - start)
+
+    def start_frame(self) -> None:
+        """Starts a new frame."""
+        now = time.monotonic()
+        self.frame_start = now
+        if now - self.deadline < self.frame_duration:
+            # keep the cadence of the previous frames
+            self.deadline += self.frame_duration
+        else:
+            # the loop was paused or fell behind by more than a frame,
+            # do not try to catch up on the missed frames
+            self.deadline = now + self.frame_duration
+
+    def wait(self) -> None:
+        """Ends the current frame and sleeps until the next one is due."""
+        now = time.monotonic()
+        self.record("frame", now - self.frame_start)
+        overrun = now > self.deadline
+        self.recent_overruns.append(overrun)
+        if overrun:
+            self.overruns += 1
+        else:
+            time.sleep(self.deadline - now)
+
+    def adapt(self) -> None:
+        """Lowers the ups if too many of the recent frames overran.
+        Raises them again once frames comfortably fit into a shorter duration."""
+        if len(self.recent_overruns) < WINDOW // 4:
+            # not enough frames since the last change
+            return
+        overrun_rate = sum(self.recent_overruns) / len(self.recent_overruns)
+        if overrun_rate > self.max_overrun_rate and self.ups > MIN_UPS:
+            self.ups = max(MIN_UPS, self.ups * UPS_STEP)
+            self.degraded = True
+            self.recent_overruns.clear()
+        elif self.degraded:
+            frame_times = sorted(self.timings["frame"])
+            higher_ups = min(self.target_ups, self.ups / UPS_STEP)
+            if _percentile(frame_times, 0.95) < UPS_STEP / higher_ups:
+                self.ups = higher_ups
+                self.degraded = self.ups < self.target_ups
+                self.recent_overruns.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the median, 95th percentile and maximum of every stage in milliseconds,
+        together with the overruns and the current ups."""
+        timings = {}
+        for stage, durations in self.timings.items():
+            if durations:
+                timings[stage] = summarize(sorted(durations))
+        overrun_rate = (
+            sum(self.recent_overruns) / len(self.recent_overruns)
+            if self.recent_overruns
+            else 0.0
+        )
+        return {
+            "timings": timings,
+            "overruns": self.overruns,
+            "overrun_rate": overrun_rate,
+            "ups": self.ups,
+            "degraded": self.degraded,
+        }
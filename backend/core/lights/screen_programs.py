@@ -134,9 +134,10 @@ class Visualization(ScreenProgram):
                 lights.update_state()
         if not self.controller.is_active():
             raise ScreenProgramStopped
+        # the visualization expects a list of values between 0 and 1
         self.controller.set_parameters(
             self.manager.utilities.alarm.factor,
-            self.manager.utilities.cava.current_frame,
+            (self.manager.utilities.cava.current_frame / 255).tolist(),
         )
 
     def stop(self) -> None:
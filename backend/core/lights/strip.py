@@ -41,6 +41,9 @@ class Strip(Device):
             scaled_val = round(dimmed_val * 4095)
             self.controller.channels[channel].duty_cycle = scaled_val
 
+    def send(self, frame: Tuple[float, float, float]) -> None:
+        self.set_color(frame)
+
     def clear(self) -> None:
         """Turns off the strip by setting its color to black."""
         if not self.initialized:
@@ -1,12 +1,83 @@
 """This module handles WLED."""
-from typing import List, Tuple
-
+import logging
 import socket
+import time
+from typing import Iterator, List, NamedTuple
+
+import numpy as np
 
 from core import util, redis
 from core.lights.device import Device
 from core.settings import storage
 
+# the udp realtime protocol that sends the index of the first led in every packet
+# https://kno.wled.ge/interfaces/udp-realtime/
+DNRGB = 4
+# wait 1 second after the last packet until resuming normally
+DNRGB_TIMEOUT = 1
+DNRGB_LEDS_PER_PACKET = 489
+
+# the distributed display protocol http://www.3waylabs.com/ddp/
+# the port WLED listens on for DDP, the wled port is used by the udp realtime protocols
+DDP_PORT = 4048
+DDP_VERSION = 0x40
+DDP_PUSH = 0x01
+DDP_TYPE_RGB24 = 0x0B
+DDP_ID_DISPLAY = 1
+DDP_LEDS_PER_PACKET = 480
+
+PROTOCOLS = ["DNRGB", "DDP"]
+
+# unchanged frames are sent again after this many seconds,
+# so WLED does not return to its own effects
+KEEPALIVE = 0.5
+
+
+def color_bytes(colors: np.ndarray, brightness: float) -> bytes:
+    """Returns the given array of rgb triples scaled by the brightness, one byte per value."""
+    scaled = np.rint(colors * (brightness * 255))
+    return np.clip(scaled, 0, 255).astype(np.uint8).tobytes()
+
+
+class Target(NamedTuple):
+    """A WLED instance showing the leds from first to last (inclusive)."""
+
+    ip: str
+    port: int
+    first: int
+    last: int
+
+
+def parse_targets(value: str, port: int) -> List[Target]:
+    """Parses a comma separated list of targets, e.g. "192.168.1.2:21324@0-299, 192.168.1.3".
+    :param port: the port of targets without a port.
+    Targets without a range show all leds.
+    Raises ValueError if the value is malformed."""
+    targets = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        address, _, leds = entry.partition("@")
+        ip, _, target_port = address.partition(":")
+        try:
+            socket.inet_aton(ip)
+        except OSError as error:
+            raise ValueError(f"invalid ip: {ip}") from error
+        if target_port:
+            target = Target(ip, int(target_port), 0, 65535)
+        else:
+            target = Target(ip, port, 0, 65535)
+        if not 1 <= target.port <= 65535:
+            raise ValueError(f"invalid port: {target.port}")
+        if leds:
+            first, _, last = leds.partition("-")
+            target = target._replace(first=int(first), last=int(last or first))
+        if not 0 <= target.first <= target.last:
+            raise ValueError(f"invalid leds: {leds}")
+        targets.append(target)
+    return targets
+
 
 class WLED(Device):
     """This class provides an interface to control WLED."""
@@ -14,46 +85,107 @@ class WLED(Device):
     def __init__(self, manager) -> None:
         super().__init__(manager, "wled")
 
-        self.led_count = storage.get("wled_led_count")
-
-        self.ip = storage.get("wled_ip")
-        if not self.ip:
+        if not storage.get("wled_ip"):
             try:
                 device = util.get_devices()[0]
                 broadcast = util.broadcast_of_device(device)
-                self.ip = broadcast
+                ip = broadcast
             except Exception:  # pylint: disable=broad-except
                 # we don't want the startup to fail
                 # just because the broadcast address could not be determined
-                self.ip = "127.0.0.1"
-            storage.put("wled_ip", self.ip)
-        self.port = storage.get("wled_port")
+                ip = "127.0.0.1"
+            storage.put("wled_ip", ip)
+
+        self.led_count = 0
+        self.protocol = ""
+        self.targets: List[Target] = []
+        self.load_settings()
 
-        self.header = bytes(
-            [
-                2,  # DRGB protocol, we update every led every frame
-                1,  # wait 1 second after the last packet until resuming normally
-            ]
-        )
+        # one socket for all packets, broadcasts allow to reach multiple WLED
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.last_frame = b""
+        self.last_sent = 0.0
+        self.sequence = 0
+        # targets that could not be reached, so their errors are only logged once
+        self.failing: List[Target] = []
 
         self.initialized = True
         redis.put("wled_initialized", True)
 
-    def set_colors(self, colors: List[Tuple[float, float, float]]) -> None:
-        """Sets the colors of the WLED to the given list of triples."""
+    def load_settings(self) -> None:
+        """Loads the led count, protocol and targets from the database."""
+        self.led_count = storage.get("wled_led_count")
+        self.protocol = storage.get("wled_protocol")
+        port = DDP_PORT if self.protocol == "DDP" else storage.get("wled_port")
+        try:
+            self.targets = parse_targets(storage.get("wled_targets"), port)
+        except ValueError:
+            # the value is validated when it is set
+            self.targets = []
+        if not self.targets:
+            self.targets = [Target(storage.get("wled_ip"), port, 0, 65535)]
+        # the next frame is sent regardless of the previous one
+        self.last_frame = b""
+
+    def _dnrgb_packets(self, frame: bytes) -> Iterator[bytes]:
+        chunk_size = DNRGB_LEDS_PER_PACKET * 3
+        for offset in range(0, len(frame), chunk_size):
+            start = offset // 3
+            header = bytes([DNRGB, DNRGB_TIMEOUT, start >> 8, start & 0xFF])
+            yield header + frame[offset : offset + chunk_size]
+
+    def _ddp_packets(self, frame: bytes) -> Iterator[bytes]:
+        chunk_size = DDP_LEDS_PER_PACKET * 3
+        for offset in range(0, len(frame), chunk_size):
+            data = frame[offset : offset + chunk_size]
+            flags = DDP_VERSION
+            if offset + chunk_size >= len(frame):
+                # display the frame once its last packet arrived
+                flags |= DDP_PUSH
+            header = bytes([flags, self.sequence, DDP_TYPE_RGB24, DDP_ID_DISPLAY])
+            header += offset.to_bytes(4, "big") + len(data).to_bytes(2, "big")
+            yield header + data
+
+    def _send(self, target: Target, packet: bytes) -> bool:
+        try:
+            self.socket.sendto(packet, (target.ip, target.port))
+        except OSError as error:
+            if target not in self.failing:
+                logging.warning("could not reach WLED at %s: %s", target.ip, error)
+                self.failing.append(target)
+            return False
+        if target in self.failing:
+            self.failing.remove(target)
+        return True
+
+    def set_colors(self, colors: np.ndarray) -> None:
+        """Sets the colors of the WLED to the given array of rgb triples.
+        Every target receives its range of leds, split into as many packets as necessary."""
         if not self.initialized:
             return
-        color_bytes = bytes(
-            [round(val * self.brightness * 255) for color in colors for val in color]
-        )
+        frame = color_bytes(colors, self.brightness)
+        now = time.monotonic()
+        if frame == self.last_frame and now - self.last_sent < KEEPALIVE:
+            return
+        self.last_frame = frame
+        self.last_sent = now
 
-        packet = self.header + color_bytes
+        # DDP sequence numbers are 1 to 15, 0 means that they are not used
+        self.sequence = self.sequence % 15 + 1
+        for target in self.targets:
+            leds = frame[target.first * 3 : (target.last + 1) * 3]
+            if self.protocol == "DDP":
+                packets = self._ddp_packets(leds)
+            else:
+                packets = self._dnrgb_packets(leds)
+            for packet in packets:
+                if not self._send(target, packet):
+                    break
 
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP
-        # allow broadcast to reach multiple WLED
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        sock.sendto(packet, (self.ip, self.port))
+    def send(self, frame: np.ndarray) -> None:
+        self.set_colors(frame)
 
     def clear(self) -> None:
         """Turns of all pixels by setting their color to black."""
-        self.set_colors([(0, 0, 0) for _ in range(self.led_count)])
+        self.set_colors(np.zeros((self.led_count, 3)))
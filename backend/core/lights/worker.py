@@ -9,8 +9,9 @@ import signal
 import subprocess
 from threading import Thread, Event
 import time
-from typing import Dict, Optional, NamedTuple, Tuple, TypedDict, cast
+from typing import Any, Dict, Optional, NamedTuple, Tuple, TypedDict, cast
 
+import numpy as np
 from django.db import connection
 
 from django.conf import settings as conf
@@ -27,6 +28,7 @@ from core.lights.programs import LedProgram, LightProgram, ScreenProgram
 from core.lights.programs import Alarm, Cava, Disabled
 from core.lights.led_programs import Adaptive, Fixed, Rainbow
 from core.lights.exceptions import ScreenProgramStopped
+from core.lights.scheduler import FrameScheduler
 from core.lights.screen_programs import Visualization, Video
 from core.settings import storage
 from core.settings.storage import DeviceBrightness, DeviceMonochrome, DeviceProgram
@@ -34,11 +36,15 @@ from core.util import optional
 
 lights_lock = redis.connection.lock("lights_lock")
 
+# the frame timings are published and the ups adapted in this interval (seconds)
+REPORT_INTERVAL = 1.0
+
 
 class Settings(TypedDict):
     """A type containing all settings affecting multiple programs."""
 
     ups: float
+    max_overrun_rate: float
     dynamic_resolution: bool
     program_speed: float
     fixed_color: Tuple[float, float, float]
@@ -83,12 +89,21 @@ class DeviceManager:
         # because some of them are accessed multiple times per update.
         self.settings: Settings = {
             "ups": storage.get("ups"),
+            "max_overrun_rate": storage.get("max_overrun_rate"),
             "dynamic_resolution": storage.get("dynamic_resolution"),
             "program_speed": storage.get("program_speed"),
             "fixed_color": storage.get("fixed_color"),
             "last_fixed_color": storage.get("fixed_color"),
         }
 
+        # paces the loop, programs use its frame duration to advance their time
+        self.scheduler = FrameScheduler(
+            self.settings["ups"], self.settings["max_overrun_rate"]
+        )
+        self.last_report = 0.0
+        # the colors last sent to each device, to skip unchanged frames when degraded
+        self.last_colors: Dict[str, Any] = {}
+
         self.utilities = Utilities(Disabled(self), Cava(self), Alarm(self))
         cava_installed = shutil.which("cava") is not None
 
@@ -150,7 +165,9 @@ class DeviceManager:
                 continue
 
             # flush the cache before accessing the database so no stale data is read
-            storage.cache.clear()
+            storage.clear_cache()
+            # brightness or other settings might have changed, send the next frame
+            self.last_colors.clear()
 
             if settings_changed == "adjust_screen":
                 self.devices.screen.adjust()
@@ -171,6 +188,10 @@ class DeviceManager:
                     self.settings["ups"] = storage.get("ups")
                     self.set_cava_framerate()
                     self.restart_screen_program(sleep_time=1 / old_ups * 5)
+                self.settings["max_overrun_rate"] = storage.get("max_overrun_rate")
+                self.scheduler.set_ups(
+                    self.settings["ups"], self.settings["max_overrun_rate"]
+                )
                 self.settings["dynamic_resolution"] = storage.get("dynamic_resolution")
                 self.settings["fixed_color"] = storage.get("fixed_color")
                 self.settings["program_speed"] = storage.get("program_speed")
@@ -189,8 +210,7 @@ class DeviceManager:
                 cast(DeviceMonochrome, f"{device_name}_monochrome")
             )
             if device_name == "wled":
-                self.devices.wled.ip = storage.get("wled_ip")
-                self.devices.wled.port = storage.get("wled_port")
+                self.devices.wled.load_settings()
             program = self.programs[
                 storage.get(cast(DeviceProgram, f"{device_name}_program"))
             ]
@@ -223,10 +243,11 @@ class DeviceManager:
                 program.use()
 
             device.program = program
+            self.last_colors.pop(device.name, None)
             self.consumers_changed()
 
             if program.name == "Disabled":
-                device.clear()
+                device.output.clear()
 
         # Disable the pwr led if the ring is active.
         # The pwr led ruins the clean look of a ring spectrum,
@@ -305,33 +326,70 @@ class DeviceManager:
         if self.utilities.cava.cava_process:
             self.utilities.cava.cava_process.send_signal(signal.SIGUSR1)
 
+    def _changed(self, device: Device, colors: Any) -> bool:
+        # Returns whether the given colors differ from the ones last sent to the device.
+        # Only while the loop is degraded, otherwise every frame is sent.
+        if not self.scheduler.degraded:
+            return True
+        last_colors = self.last_colors.get(device.name)
+        if last_colors is not None and np.array_equal(last_colors, colors):
+            return False
+        self.last_colors[device.name] = colors
+        return True
+
     def _set_led_colors(self) -> None:
+        # Computes the colors of every led device and hands them to its output.
+        # The devices are written to by the threads of their outputs,
+        # so a slow bus neither delays this loop nor the other devices.
         assert isinstance(self.devices.ring.program, LedProgram)
         assert isinstance(self.devices.strip.program, LedProgram)
         assert isinstance(self.devices.wled.program, LedProgram)
         if self.devices.ring.program.name != "Disabled":
-            if self.devices.ring.monochrome:
-                ring_colors = [
-                    self.devices.ring.program.strip_color()
-                    for _ in range(self.devices.ring.LED_COUNT)
-                ]
-            else:
-                ring_colors = self.devices.ring.program.ring_colors()
-            self.devices.ring.set_colors(ring_colors)
+            with self.scheduler.measure("ring"):
+                if self.devices.ring.monochrome:
+                    ring_colors = np.full(
+                        (self.devices.ring.LED_COUNT, 3),
+                        self.devices.ring.program.strip_color(),
+                        dtype=float,
+                    )
+                else:
+                    ring_colors = self.devices.ring.program.ring_colors()
+                if self._changed(self.devices.ring, ring_colors):
+                    self.devices.ring.output.publish(ring_colors)
 
         if self.devices.strip.program.name != "Disabled":
-            strip_color = self.devices.strip.program.strip_color()
-            self.devices.strip.set_color(strip_color)
+            with self.scheduler.measure("strip"):
+                strip_color = self.devices.strip.program.strip_color()
+                if self._changed(self.devices.strip, strip_color):
+                    self.devices.strip.output.publish(strip_color)
 
         if self.devices.wled.program.name != "Disabled":
-            if self.devices.wled.monochrome:
-                wled_colors = [
-                    self.devices.wled.program.strip_color()
-                    for _ in range(self.devices.wled.led_count)
-                ]
-            else:
-                wled_colors = self.devices.wled.program.wled_colors()
-            self.devices.wled.set_colors(wled_colors)
+            with self.scheduler.measure("wled"):
+                if self.devices.wled.monochrome:
+                    wled_colors = np.full(
+                        (self.devices.wled.led_count, 3),
+                        self.devices.wled.program.strip_color(),
+                        dtype=float,
+                    )
+                else:
+                    wled_colors = self.devices.wled.program.wled_colors()
+                # WLED skips unchanged frames itself
+                self.devices.wled.output.publish(wled_colors)
+
+    def _report(self) -> None:
+        # adapts the ups to the recent frames and publishes their timings
+        now = time.monotonic()
+        if now - self.last_report < REPORT_INTERVAL:
+            return
+        self.last_report = now
+        self.scheduler.adapt()
+        stats = self.scheduler.stats()
+        stats["outputs"] = {
+            device.name: device.output.stats()
+            for device in self.devices
+            if device.output.latencies
+        }
+        redis.put("lights_timings", stats)
 
     def loop(self) -> None:
         """The main lights loop. When active, compute every active program and set the devices."""
@@ -342,24 +400,30 @@ class DeviceManager:
                 # the lock was deleted by the listener thread in order to stop the main thread
                 # The display must be stopped from this thread, otherwise no new one can be created
                 self.devices.screen.program.stop()
+                for device in self.devices:
+                    device.output.stop()
                 self.listener.join()
                 break
 
-            computation_start = time.time()
+            self.scheduler.start_frame()
 
             with lights_lock:
                 # these programs only actually do work if their respective programs are active
-                self.utilities.cava.compute()
-                self.utilities.alarm.compute()
+                with self.scheduler.measure("cava"):
+                    self.utilities.cava.compute()
+
+                with self.scheduler.measure("programs"):
+                    self.utilities.alarm.compute()
 
-                self.devices.ring.program.compute()
-                if self.devices.wled.program != self.devices.ring.program:
-                    self.devices.wled.program.compute()
-                if self.devices.strip.program != self.devices.ring.program:
-                    self.devices.strip.program.compute()
+                    self.devices.ring.program.compute()
+                    if self.devices.wled.program != self.devices.ring.program:
+                        self.devices.wled.program.compute()
+                    if self.devices.strip.program != self.devices.ring.program:
+                        self.devices.strip.program.compute()
 
                 self._set_led_colors()
 
+                screen_start = time.monotonic()
                 try:
                     self.devices.screen.program.compute()
                 except ScreenProgramStopped:
@@ -390,12 +454,10 @@ class DeviceManager:
                         )
                         controller.persist_program_change("screen", "Disabled")
                         lights.update_state()
+                self.scheduler.record("screen", time.monotonic() - screen_start)
 
-            computation_time = time.time() - computation_start
-            try:
-                time.sleep(1 / self.settings["ups"] - computation_time)
-            except ValueError:
-                pass
+            self.scheduler.wait()
+            self._report()
 
 
 @app.task
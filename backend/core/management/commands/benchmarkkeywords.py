@@ -0,0 +1,85 @@
+"""This module contains the benchmarkkeywords command."""
+import random
+import re
+import string
+import time
+from typing import Callable, List
+
+from django.core.management.base import BaseCommand
+
+from core.musiq.song_utils import KeywordFilter
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9)))
+
+
+def _per_keyword(keywords: str, titles: List[str]) -> List[str]:
+    # the filter before the keywords were compiled:
+    # the keywords were split and searched one after another for every string
+    result = []
+    for title in titles:
+        words = re.split(r"[,\s]+", keywords.strip())
+        words = [word for word in words if word]
+        if not any(re.search(word, title, re.IGNORECASE) for word in words):
+            result.append(title)
+    return result
+
+
+class Command(BaseCommand):
+    """Defines the benchmarkkeywords command."""
+
+    help = (
+        "Measures how long filtering titles by forbidden keywords takes, "
+        "searching every keyword separately compared to a single compiled pattern."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--titles", type=int, default=10000)
+        parser.add_argument("--keywords", type=int, default=200)
+        parser.add_argument("--rounds", type=int, default=3)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        vocabulary = [_word(rng) for _ in range(5000)]
+        titles = [
+            " ".join(rng.choices(vocabulary, k=rng.randint(2, 8))).title()
+            for _ in range(options["titles"])
+        ]
+        keywords = ", ".join(rng.sample(vocabulary, options["keywords"]))
+        keyword_filter = KeywordFilter(keywords)
+
+        def single(titles: List[str]) -> List[str]:
+            return [title for title in titles if not keyword_filter.is_forbidden(title)]
+
+        methods: List[Callable[[List[str]], List[str]]] = [
+            lambda titles: _per_keyword(keywords, titles),
+            single,
+            keyword_filter.filter_many,
+            # includes compiling the pattern, like the first call after a change
+            lambda titles: KeywordFilter(keywords).filter_many(titles),
+        ]
+        names = [
+            "every keyword",
+            "compiled, is_forbidden",
+            "compiled, filter_many",
+            "compile + filter_many",
+        ]
+
+        expected = _per_keyword(keywords, titles)
+        self.stdout.write(
+            f"{len(titles)} titles, {options['keywords']} keywords, "
+            f"{len(titles) - len(expected)} filtered"
+        )
+        self.stdout.write(f"{'method':<24}{'ms':>10}{'µs/title':>10}")
+        for name, method in zip(names, methods):
+            if method(titles) != expected:
+                raise AssertionError(f"{name} filtered different titles")
+            best = float("inf")
+            for _ in range(options["rounds"]):
+                start = time.perf_counter()
+                method(titles)
+                best = min(best, time.perf_counter() - start)
+            self.stdout.write(
+                f"{name:<24}{best * 1000:>10.1f}{best / len(titles) * 1e6:>10.2f}"
+            )
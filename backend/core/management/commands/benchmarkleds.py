@@ -0,0 +1,79 @@
+"""This module contains the benchmarkleds command."""
+import random
+import statistics
+import time
+from types import SimpleNamespace
+from typing import List
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """Defines the benchmarkleds command."""
+
+    help = (
+        "Measures how long computing one frame of every led program takes for different led counts, "
+        "including the conversion into the bytes that are sent to WLED."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--leds", nargs="+", type=int, default=[16, 150, 600, 1500], metavar="N"
+        )
+        parser.add_argument("--frames", type=int, default=600)
+        parser.add_argument("--ups", type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        from core.lights.led_programs import Adaptive, Fixed, Rainbow
+        from core.lights.programs import Cava
+        from core.lights.wled import color_bytes
+
+        rng = random.Random(0)
+        # changing spectra, like cava would produce them
+        frames = [
+            np.array([rng.randrange(256) for _ in range(Cava.BARS)], dtype=np.uint8)
+            for _ in range(64)
+        ]
+        budget = 1 / options["ups"]
+
+        self.stdout.write(
+            f"frame budget at {options['ups']:g} ups: {budget * 1000:.1f} ms"
+        )
+        self.stdout.write(
+            f"{'program':<10}{'leds':>6}{'µs/frame':>10}{'p95 µs':>10}{'budget %':>10}"
+        )
+        for program_class in [Fixed, Rainbow, Adaptive]:
+            for led_count in options["leds"]:
+                cava = SimpleNamespace(BARS=Cava.BARS, current_frame=frames[0])
+                manager = SimpleNamespace(
+                    settings={
+                        "ups": options["ups"],
+                        "program_speed": 1.0,
+                        "fixed_color": (0.2, 0.4, 0.6),
+                    },
+                    scheduler=SimpleNamespace(frame_duration=1 / options["ups"]),
+                    devices=SimpleNamespace(
+                        ring=SimpleNamespace(LED_COUNT=16),
+                        wled=SimpleNamespace(led_count=led_count),
+                    ),
+                    utilities=SimpleNamespace(
+                        cava=cava, alarm=SimpleNamespace(factor=-1.0)
+                    ),
+                )
+                program = program_class(manager)
+
+                durations: List[float] = []
+                for frame in range(options["frames"]):
+                    cava.current_frame = frames[frame % len(frames)]
+                    start = time.perf_counter()
+                    program.compute()
+                    color_bytes(program.wled_colors(), 0.8)
+                    durations.append(time.perf_counter() - start)
+
+                median = statistics.median(durations)
+                p95 = statistics.quantiles(durations, n=20)[-1]
+                self.stdout.write(
+                    f"{program.name:<10}{led_count:>6}{median * 1e6:>10.1f}"
+                    f"{p95 * 1e6:>10.1f}{median / budget * 100:>10.2f}"
+                )
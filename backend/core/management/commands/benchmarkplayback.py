@@ -0,0 +1,281 @@
+"""This module contains the benchmarkplayback command."""
+import logging
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+
+class FakeMopidy:
+    """Imitates the parts of the mopidy api that the playback loop uses.
+    Every track plays for the duration given by its uri and then ends,
+    like it would with consume mode enabled. Afterwards, the next track in the tracklist starts.
+    Counts every rpc call by its method name and measures the silence between tracks."""
+
+    def __init__(self, durations: Dict[str, float], send_end_events: bool) -> None:
+        self.durations = durations
+        self.send_end_events = send_end_events
+        self.logger = logging.getLogger("fakemopidy")
+        self.calls: Counter = Counter()
+        self.callbacks: Dict[str, List[Callable]] = {}
+        self.state = "stopped"
+        self.tracklist_items: List[Any] = []
+        self.next_tlid = 1
+        self.timer: Any = None
+        self.finished_tracks = 0
+        # the time the last track ended, and the sum of the silences between tracks
+        self.ended_at: Any = None
+        self.gaps: List[float] = []
+        self.lock = threading.Lock()
+
+        self.playback = SimpleNamespace(
+            get_state=self._rpc("get_state", lambda: self.state),
+            play=self._rpc("play", self._play),
+            pause=self._rpc("pause", lambda: None),
+            stop=self._rpc("stop", self._stop),
+            next=self._rpc("next", self._next),
+            seek=self._rpc("seek", lambda _position: None),
+            get_time_position=self._rpc("get_time_position", lambda: 0),
+            get_current_tlid=self._rpc("get_current_tlid", self._current_tlid),
+        )
+        self.tracklist = SimpleNamespace(
+            add=self._rpc("add", self._add),
+            clear=self._rpc("clear", self._clear),
+            remove=self._rpc("remove", self._remove),
+            set_consume=self._rpc("set_consume", lambda _consume: None),
+        )
+        self.mixer = SimpleNamespace(
+            get_volume=self._rpc("get_volume", lambda: 100),
+            set_volume=self._rpc("set_volume", lambda _volume: None),
+        )
+
+    def _rpc(self, name: str, function: Callable) -> Callable:
+        def call(*args: Any, **kwargs: Any) -> Any:
+            self.calls[name] += 1
+            with self.lock:
+                return function(*args, **kwargs)
+
+        return call
+
+    def on_event(self, event: str) -> Callable[[Callable], Callable]:
+        """Registers the decorated function as a callback for the given event."""
+
+        def decorator(function: Callable) -> Callable:
+            self.callbacks.setdefault(event, []).append(function)
+            return function
+
+        return decorator
+
+    def _emit(self, event: str, **data: Any) -> None:
+        for callback in self.callbacks.get(event, []):
+            # mopidy delivers events in a separate thread
+            threading.Thread(
+                target=callback, args=(SimpleNamespace(event=event, **data),)
+            ).start()
+
+    def _add(self, uris: List[str]) -> List[Any]:
+        added = []
+        for uri in uris:
+            added.append(
+                SimpleNamespace(tlid=self.next_tlid, track=SimpleNamespace(uri=uri))
+            )
+            self.next_tlid += 1
+        self.tracklist_items.extend(added)
+        return added
+
+    def _play(self) -> None:
+        if self.state == "playing" or not self.tracklist_items:
+            return
+        self._start(self.tracklist_items[0])
+
+    def _start(self, tl_track: Any) -> None:
+        if self.ended_at is not None:
+            self.gaps.append(time.perf_counter() - self.ended_at)
+            self.ended_at = None
+        if self.state != "playing":
+            self._set_state("playing")
+        self._emit("track_playback_started", tl_track=tl_track)
+        self.timer = threading.Timer(
+            self.durations.get(tl_track.track.uri, 0), self._track_ended, (tl_track,)
+        )
+        self.timer.start()
+
+    def _track_ended(self, tl_track: Any) -> None:
+        with self.lock:
+            if not self.tracklist_items or self.tracklist_items[0] is not tl_track:
+                return
+            self.finished_tracks += 1
+            self.ended_at = time.perf_counter()
+            self._end_current()
+
+    def _end_current(self) -> None:
+        """Ends the playing track and continues with the next one, if there is one."""
+        tl_track = self.tracklist_items.pop(0)
+        if self.send_end_events:
+            self._emit("track_playback_ended", tl_track=tl_track)
+        if self.tracklist_items:
+            self._start(self.tracklist_items[0])
+        else:
+            self._set_state("stopped")
+
+    def _next(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.state != "stopped" and self.tracklist_items:
+            self._end_current()
+
+    def _stop(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.state != "stopped" and self.tracklist_items:
+            tl_track = self.tracklist_items.pop(0)
+            self._set_state("stopped")
+            if self.send_end_events:
+                self._emit("track_playback_ended", tl_track=tl_track)
+
+    def _clear(self) -> None:
+        self._stop()
+        self.tracklist_items.clear()
+
+    def _remove(self, criteria: Dict[str, List[int]]) -> List[Any]:
+        removed = [
+            tl_track
+            for tl_track in self.tracklist_items
+            if tl_track.tlid in criteria["tlid"]
+        ]
+        if removed and self.tracklist_items[0] in removed:
+            # removing the playing track stops playback
+            self._stop()
+        self.tracklist_items = [
+            tl_track for tl_track in self.tracklist_items if tl_track not in removed
+        ]
+        return removed
+
+    def _current_tlid(self) -> Any:
+        if self.state == "stopped" or not self.tracklist_items:
+            return None
+        return self.tracklist_items[0].tlid
+
+    def _set_state(self, new_state: str) -> None:
+        old_state, self.state = self.state, new_state
+        if self.send_end_events:
+            self._emit(
+                "playback_state_changed", old_state=old_state, new_state=new_state
+            )
+
+
+class CountingLock:
+    """Wraps a lock and records how often and how long it was held."""
+
+    def __init__(self, lock: Any) -> None:
+        self.lock = lock
+        self.acquisitions = 0
+        self.held = 0.0
+        self.acquired_at = 0.0
+
+    def acquire(self, *args: Any, **kwargs: Any) -> bool:
+        """Acquires the wrapped lock."""
+        acquired = self.lock.acquire(*args, **kwargs)
+        if acquired:
+            self.acquisitions += 1
+            self.acquired_at = time.perf_counter()
+        return acquired
+
+    def release(self) -> None:
+        """Releases the wrapped lock."""
+        self.held += time.perf_counter() - self.acquired_at
+        self.lock.release()
+
+
+class Command(BaseCommand):
+    """Defines the benchmarkplayback command."""
+
+    help = (
+        "Plays songs from a temporary test database with a fake mopidy "
+        "and reports the mopidy calls and player lock holds per song. "
+        "Uses the configured redis, do not run it alongside a running Raveberry."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--songs", type=int, default=5)
+        parser.add_argument("--duration", type=float, default=3.0)
+        parser.add_argument(
+            "--lost-events",
+            action="store_true",
+            help="do not report the end of tracks, as if the event connection was lost",
+        )
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self._benchmark(
+                options["songs"], options["duration"], not options["lost_events"]
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _benchmark(self, songs: int, duration: float, send_end_events: bool) -> None:
+        from core import redis
+        from core.models import CurrentSong, QueuedSong
+        from core.musiq import playback
+
+        durations = {}
+        for index in range(songs):
+            uri = f"fake:{index}"
+            durations[uri] = duration
+            QueuedSong.objects.enqueue(
+                {
+                    "artist": "Artist",
+                    "title": f"Song {index}",
+                    "duration": duration,
+                    "internal_url": uri,
+                    "external_url": uri,
+                    "stream_url": None,
+                },
+                False,
+            )
+
+        fake = FakeMopidy(durations, send_end_events)
+        lock = CountingLock(playback.player_lock)
+        playback.player_lock = lock
+        redis.put("stop_playback_loop", False)
+        player = playback.Playback(player=fake)  # type: ignore[arg-type]
+        # only count the calls of the loop, not the ones during initialization
+        fake.calls.clear()
+        lock.acquisitions = 0
+        lock.held = 0.0
+
+        start = time.perf_counter()
+        thread = threading.Thread(target=player.loop, daemon=True)
+        thread.start()
+        # the loop deletes the current song once it noticed its end
+        while QueuedSong.objects.exists() or CurrentSong.objects.exists():
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        playback.stop()
+        thread.join(timeout=5)
+        redis.put("stop_playback_loop", False)
+
+        self.stdout.write(
+            f"events: {'yes' if send_end_events else 'lost'}, "
+            f"songs: {fake.finished_tracks}, duration: {duration}s, "
+            f"wall time: {elapsed:.2f}s"
+        )
+        played = max(fake.finished_tracks, 1)
+        self.stdout.write(
+            f"mopidy calls per song: {sum(fake.calls.values()) / played:.1f}"
+        )
+        for name, count in fake.calls.most_common():
+            self.stdout.write(f"  {name:<18}{count / played:>8.1f}")
+        self.stdout.write(
+            f"lock holds per song: {lock.acquisitions / played:.1f}, "
+            f"held {lock.held / played * 1000:.1f}ms per song"
+        )
+        if fake.gaps:
+            self.stdout.write(
+                f"silence between songs: {sum(fake.gaps) / len(fake.gaps) * 1000:.1f}ms"
+            )
@@ -0,0 +1,139 @@
+"""This module contains the benchmarkplaylists command."""
+import os
+import tempfile
+import time
+from typing import Any, Callable, List
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+
+def _per_file(library_path: str) -> None:
+    # the playlist creation before the urls were loaded at once:
+    # every file was looked up and every entry was created with its own query
+    from core.models import ArchivedPlaylist, ArchivedSong, PlaylistEntry
+
+    def scan_folder(dirpath: str) -> List[str]:
+        song_urls = []
+        for filename in sorted(os.listdir(dirpath)):
+            path = os.path.join(dirpath, filename)
+            if os.path.isdir(path):
+                song_urls.extend(scan_folder(path))
+                continue
+            external_url = os.path.join("local_library", path[len(library_path) + 1 :])
+            if ArchivedSong.objects.filter(url=external_url).exists():
+                song_urls.append(external_url)
+
+        if not song_urls:
+            return []
+
+        playlist_id = os.path.join("local_library", dirpath[len(library_path) + 1 :])
+        playlist, created = ArchivedPlaylist.objects.get_or_create(
+            list_id=playlist_id, title=os.path.split(dirpath)[1], counter=0
+        )
+        if not created:
+            return song_urls
+        for index, external_url in enumerate(song_urls):
+            PlaylistEntry.objects.create(
+                playlist=playlist, index=index, url=external_url
+            )
+        return song_urls
+
+    scan_folder(library_path)
+
+
+class Command(BaseCommand):
+    """Defines the benchmarkplaylists command."""
+
+    help = (
+        "Measures how long creating the playlists of a synthetic library takes, "
+        "looking up every file separately compared to loading all urls at once. "
+        "Runs on a temporary test database of the configured backend "
+        "(sqlite with DJANGO_DEBUG=1, postgres otherwise)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--artists", type=int, default=100)
+        parser.add_argument("--albums", type=int, default=10)
+        parser.add_argument("--songs", type=int, default=20)
+
+    def _measure(self, name: str, method: Callable[[], Any]) -> None:
+        from core.models import ArchivedPlaylist, PlaylistEntry
+
+        start = time.perf_counter()
+        method()
+        duration = time.perf_counter() - start
+        self.stdout.write(
+            f"{name:<24}{duration:>10.2f}"
+            f"{ArchivedPlaylist.objects.count():>12}{PlaylistEntry.objects.count():>12}"
+        )
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self._benchmark(options["artists"], options["albums"], options["songs"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _benchmark(self, artists: int, albums: int, songs: int) -> None:
+        from core.models import ArchivedPlaylist, ArchivedSong, PlaylistEntry
+        from core.settings import library
+
+        with tempfile.TemporaryDirectory() as library_path:
+            urls = []
+            for artist in range(artists):
+                for album in range(albums):
+                    folder = os.path.join(f"Artist {artist}", f"Album {album}")
+                    os.makedirs(os.path.join(library_path, folder))
+                    for song in range(songs):
+                        path = os.path.join(folder, f"{song:02d} Song.mp3")
+                        open(os.path.join(library_path, path), "w").close()
+                        urls.append(os.path.join("local_library", path))
+            ArchivedSong.objects.bulk_create(
+                [
+                    ArchivedSong(
+                        url=url,
+                        artist="Artist",
+                        title=os.path.basename(url),
+                        duration=1,
+                        counter=0,
+                        cached=True,
+                        platform="local",
+                    )
+                    for url in urls
+                ],
+                batch_size=1000,
+            )
+            self.stdout.write(f"{len(urls)} files")
+            self.stdout.write(
+                f"{'method':<24}{'s':>10}{'playlists':>12}{'entries':>12}"
+            )
+            self._measure("every file", lambda: _per_file(library_path))
+            expected = list(
+                PlaylistEntry.objects.order_by(
+                    "playlist__list_id", "index"
+                ).values_list("playlist__list_id", "url")
+            )
+            ArchivedPlaylist.objects.all().delete()
+            self._measure(
+                "all urls, create",
+                lambda: library.sync_playlists(library_path),
+            )
+            entries = list(
+                PlaylistEntry.objects.order_by(
+                    "playlist__list_id", "index"
+                ).values_list("playlist__list_id", "url")
+            )
+            if entries != expected:
+                raise AssertionError("sync_playlists created different playlists")
+            # no folder changed, nothing is written
+            self._measure(
+                "all urls, unchanged",
+                lambda: library.sync_playlists(library_path),
+            )
+            # one song was added to every album
+            PlaylistEntry.objects.filter(index=0).delete()
+            self._measure(
+                "all urls, update",
+                lambda: library.sync_playlists(library_path),
+            )
@@ -0,0 +1,130 @@
+"""This module contains the benchmarkqueue command."""
+import random
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+
+class WriteCounter:
+    """An execute wrapper that counts the statements and rows that modify the database."""
+
+    def __init__(self) -> None:
+        self.statements = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context) -> Any:
+        result = execute(sql, params, many, context)
+        statement = sql.lstrip()[:6].upper()
+        if statement in ("INSERT", "UPDATE", "DELETE"):
+            self.statements += 1
+            rows = context["cursor"].rowcount
+            if statement == "INSERT":
+                # inserts with a RETURNING clause do not reliably report their rowcount
+                rows = max(rows, 1)
+            self.rows += max(rows, 0)
+        return result
+
+
+class Command(BaseCommand):
+    """Defines the benchmarkqueue command."""
+
+    help = (
+        "Measures latency and written rows of every queue operation for different queue sizes. "
+        "Runs on a temporary test database of the configured backend "
+        "(sqlite with DJANGO_DEBUG=1, postgres otherwise)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", nargs="+", type=int, default=[10, 1000, 10000], metavar="N"
+        )
+        parser.add_argument("--repetitions", type=int, default=20)
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write(f"database: {connection.vendor}")
+            self.stdout.write(
+                f"{'operation':<14}{'size':>8}{'ms/op':>10}{'statements/op':>16}{'rows/op':>10}"
+            )
+            for size in options["sizes"]:
+                for operation, stats in self._benchmark(
+                    size, options["repetitions"]
+                ).items():
+                    self.stdout.write(
+                        f"{operation:<14}{size:>8}{stats['ms']:>10.3f}"
+                        f"{stats['statements']:>16.1f}{stats['rows']:>10.1f}"
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    @staticmethod
+    def _benchmark(size: int, repetitions: int) -> Dict[str, Dict[str, float]]:
+        from core.models import QueuedSong
+        from core.musiq import song_queue
+
+        queue = QueuedSong.objects
+        metadata = {
+            "artist": "Artist",
+            "title": "Title",
+            "duration": 180.0,
+            "internal_url": "file:///dev/null",
+            "external_url": "https://www.youtube.com/watch?v=benchmark",
+            "stream_url": None,
+        }
+
+        queue.all().delete()
+        QueuedSong.objects.bulk_create(
+            QueuedSong(
+                index=position * song_queue.INDEX_GAP,
+                manually_requested=False,
+                platform="youtube",
+                **metadata,
+            )
+            for position in range(1, size + 1)
+        )
+
+        def random_key() -> Tuple[int]:
+            return (random.choice(queue.values_list("id", flat=True)),)
+
+        def adjacent_pair() -> Tuple[int, int, int]:
+            keys: List[int] = list(queue.values_list("id", flat=True))
+            position = random.randrange(len(keys) - 1)
+            others = keys[:position] + keys[position + 2 :]
+            element = random.choice(others) if others else keys[position]
+            return keys[position], element, keys[position + 1]
+
+        # each operation is paired with a function that prepares its arguments,
+        # so that selecting keys is not part of the measurement
+        operations: Dict[str, Tuple[Callable[..., Any], Callable[[], Tuple]]] = {
+            "enqueue": (queue.enqueue, lambda: (metadata, False)),
+            "dequeue": (queue.dequeue, tuple),
+            "remove": (queue.remove, random_key),
+            "prioritize": (queue.prioritize, random_key),
+            "deprioritize": (queue.deprioritize, random_key),
+            "reorder": (queue.reorder, adjacent_pair),
+        }
+
+        results = {}
+        for name, (operation, arguments) in operations.items():
+            counter = WriteCounter()
+            elapsed = 0.0
+            for _ in range(repetitions):
+                args = arguments()
+                with connection.execute_wrapper(counter):
+                    start = time.perf_counter()
+                    operation(*args)
+                    elapsed += time.perf_counter() - start
+                # keep the queue at a constant size
+                while queue.count() < size:
+                    queue.enqueue(metadata, False)
+                while queue.count() > size:
+                    queue.dequeue()
+            results[name] = {
+                "ms": elapsed / repetitions * 1000,
+                "statements": counter.statements / repetitions,
+                "rows": counter.rows / repetitions,
+            }
+        return results
@@ -0,0 +1,170 @@
+"""This module contains the benchmarksuggestions command."""
+import json
+import random
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+
+import requests
+from django.conf import settings as conf
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+DEFAULT_DELAYS = ["youtube=0.08", "spotify=0.15", "soundcloud=1.2", "jamendo=0.1"]
+
+
+def start_stub_server(delay: float) -> ThreadingHTTPServer:
+    """Starts a local http server that answers every request with a list of suggestions
+    after a random delay around the given number of seconds."""
+
+    class Handler(BaseHTTPRequestHandler):
+        """Answers with suggestions derived from the query."""
+
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            """Sends the suggestions after the delay."""
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            body = json.dumps([f"{self.path} {index}" for index in range(10)]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args) -> None:  # pylint: disable=arguments-differ
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Command(BaseCommand):
+    """Defines the benchmarksuggestions command."""
+
+    help = (
+        "Measures the latency of online suggestions against local stub servers, "
+        "one per platform with the given delays. Compares the pooled fetch with deadline "
+        "to a new thread and session per platform that waits for all platforms."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queries", type=int, default=30)
+        parser.add_argument(
+            "--delays",
+            nargs="+",
+            default=DEFAULT_DELAYS,
+            metavar="PLATFORM=SECONDS",
+        )
+        parser.add_argument("--deadline", type=float, default=conf.SUGGESTION_DEADLINE)
+
+    def handle(self, *args, **options):
+        delays = {}
+        for delay in options["delays"]:
+            platform, seconds = delay.split("=")
+            delays[platform] = float(seconds)
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self._benchmark(delays, options["queries"], options["deadline"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _benchmark(
+        self, delays: Dict[str, float], queries: int, deadline: float
+    ) -> None:
+        from core.musiq import suggestions
+        from core.settings import storage
+
+        urls = {
+            platform: f"http://127.0.0.1:{start_stub_server(delay).server_port}"
+            for platform, delay in delays.items()
+        }
+
+        # pooled: every platform keeps its session, like the clients of the platforms
+        sessions = {platform: requests.Session() for platform in urls}
+
+        def pooled_fetcher(platform: str) -> Callable:
+            def fetch(query: str, _suggest_playlist: bool) -> List:
+                response = sessions[platform].get(f"{urls[platform]}/{query}")
+                return [
+                    {"key": -1, "value": value, "type": f"{platform}-online"}
+                    for value in response.json()
+                ]
+
+            return fetch
+
+        for platform in urls:
+            suggestions.suggestion_fetchers[platform] = pooled_fetcher(platform)
+
+        def unpooled(query: str) -> List:
+            # one thread and one new session per platform, waiting for the slowest
+            results: List = []
+            threads = []
+            for url in urls.values():
+
+                def fetch(url: str = url) -> None:
+                    with requests.Session() as session:
+                        results.extend(session.get(f"{url}/{query}").json())
+
+                thread = threading.Thread(target=fetch)
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+            return results
+
+        def pooled(query: str) -> List:
+            return suggestions.collect_online_suggestions(
+                query, False, list(urls), deadline
+            )
+
+        def follow_up(query: str) -> List:
+            # the follow-up request of a client for the platforms that were late
+            results = pooled(query)
+            late = {
+                result["type"][: -len("-placeholder")]
+                for result in results
+                if result["type"].endswith("-placeholder")
+            }
+            if late:
+                return suggestions.collect_online_suggestions(
+                    query, False, list(late), 5.0
+                )
+            return results
+
+        counts = {
+            platform: storage.get(f"{platform}_suggestions")  # type: ignore[misc]
+            for platform in urls
+        }
+        self.stdout.write(
+            f"platforms: {', '.join(f'{p} {d * 1000:.0f}ms' for p, d in delays.items())}, "
+            f"deadline: {deadline * 1000:.0f}ms, suggestions per platform: {counts}"
+        )
+        self.stdout.write(f"{'mode':<24}{'p50 ms':>10}{'p95 ms':>10}{'late':>8}")
+        for name, function in [
+            ("thread per platform", unpooled),
+            ("pooled with deadline", pooled),
+            ("with follow-up request", follow_up),
+        ]:
+            latencies = []
+            late = 0
+            for index in range(queries):
+                query = f"{name.replace(' ', '')}{index}"
+                start = time.perf_counter()
+                results = function(query)
+                latencies.append(time.perf_counter() - start)
+                late += any(
+                    result["type"].endswith("-placeholder")
+                    for result in results
+                    if isinstance(result, dict)
+                )
+            latencies.sort()
+            self.stdout.write(
+                f"{name:<24}{statistics.median(latencies) * 1000:>10.1f}"
+                f"{latencies[int(len(latencies) * 0.95) - 1] * 1000:>10.1f}{late:>8}"
+            )
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:37
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def spread_indices(apps, schema_editor):
+    # the queue now uses sparse indices, make room between the songs of a restored queue
+    QueuedSong = apps.get_model("core", "QueuedSong")
+    QueuedSong.objects.update(index=F("index") * 1024)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0017_archivedquery_core_archivedquery_query_trgm_and_more")
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="queuedsong",
+            name="index",
+            field=models.IntegerField(db_index=True),
+        ),
+        migrations.RunPython(spread_indices, migrations.RunPython.noop),
+    ]
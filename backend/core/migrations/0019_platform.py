@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+# the url prefixes of song_utils.determine_url_type at the time of this migration
+URL_PREFIXES = {
+    "local": "local_library/",
+    "youtube": "https://www.youtube.com/",
+    "spotify": "https://open.spotify.com/",
+    "soundcloud": "https://soundcloud.com/",
+    "jamendo": "https://www.jamendo.com/",
+}
+
+
+def fill_platforms(apps, schema_editor):
+    for model_name, url_field in [
+        ("ArchivedSong", "url"),
+        ("PlaylistEntry", "url"),
+        ("QueuedSong", "external_url"),
+        ("CurrentSong", "external_url"),
+    ]:
+        model = apps.get_model("core", model_name)
+        for platform, prefix in URL_PREFIXES.items():
+            model.objects.filter(**{f"{url_field}__startswith": prefix}).update(
+                platform=platform
+            )
+        model.objects.filter(platform="").update(platform="unknown")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0018_queuedsong_index_db_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedsong",
+            name="platform",
+            field=models.CharField(db_index=True, default="", max_length=20),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="currentsong",
+            name="platform",
+            field=models.CharField(db_index=True, default="", max_length=20),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="playlistentry",
+            name="platform",
+            field=models.CharField(db_index=True, default="", max_length=20),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="queuedsong",
+            name="platform",
+            field=models.CharField(db_index=True, default="", max_length=20),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_platforms, migrations.RunPython.noop),
+    ]
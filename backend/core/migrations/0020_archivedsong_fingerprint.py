@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0019_platform"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedsong",
+            name="fingerprint",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+    ]
@@ -37,7 +37,24 @@ class Counter(models.Model):
         return str(self.value)
 
 
-class ArchivedSong(models.Model):
+class PlatformModel(models.Model):
+    """Stores the platform of a song next to its url, so queries can filter by it."""
+
+    # the field containing the url of the song
+    url_field = "url"
+    # see song_utils.determine_url_type
+    platform = models.CharField(max_length=20, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs) -> None:
+        if not self.platform:
+            self.platform = song_utils.determine_url_type(getattr(self, self.url_field))
+        super().save(*args, **kwargs)
+
+
+class ArchivedSong(PlatformModel):
     """Stores an archived song.
     url identifies the song uniquely in the database and on the internet (if applicable)."""
 
@@ -47,6 +64,8 @@ class ArchivedSong(models.Model):
     duration = models.FloatField()
     counter = models.IntegerField()
     cached = models.BooleanField()
+    # size, modification time and inode of the file of a local song when it was last scanned
+    fingerprint = models.CharField(max_length=100, blank=True, default="")
 
     def __str__(self) -> str:
         return self.title + " (" + self.url + "): " + str(self.counter)
@@ -98,7 +117,7 @@ class ArchivedPlaylist(models.Model):
         return self.title + ": " + str(self.counter)
 
 
-class PlaylistEntry(models.Model):
+class PlaylistEntry(PlatformModel):
     """Stores an entry to a playlist. Connects ArchivedSong and ArchivedPlaylist."""
 
     playlist = models.ForeignKey(
@@ -151,11 +170,14 @@ class ArchivedPlaylistQuery(models.Model):
         return self.query
 
 
-class QueuedSong(models.Model):
+class QueuedSong(PlatformModel):
     """Stores a song in the song queue so the queue is not lost on server restart."""
 
+    url_field = "external_url"
+
     id: int
-    index = models.IntegerField()
+    # indices are sparse, see song_queue.INDEX_GAP
+    index = models.IntegerField(db_index=True)
     manually_requested = models.BooleanField()
     votes = models.IntegerField(default=0)
     internal_url = models.CharField(max_length=2000, blank=True, null=True)
@@ -177,9 +199,11 @@ class QueuedSong(models.Model):
         ordering = ["index"]
 
 
-class CurrentSong(models.Model):
+class CurrentSong(PlatformModel):
     """Stores the currently playing song. Only has one element."""
 
+    url_field = "external_url"
+
     queue_key = models.IntegerField()
     manually_requested = models.BooleanField()
     votes = models.IntegerField()
@@ -9,8 +9,6 @@ from typing import Callable
 
 from django.conf import settings as conf
 from django.core.handlers.wsgi import WSGIRequest
-from django.db import transaction
-from django.db.models import F
 from django.http import HttpResponseForbidden
 from django.http.response import HttpResponse, HttpResponseBadRequest
 from django.utils import timezone
@@ -18,7 +16,7 @@ from django.views.decorators.csrf import csrf_exempt
 from mopidyapi import MopidyAPI
 
 from core import models, redis, user_manager
-from core.musiq import musiq, playback
+from core.musiq import musiq, playback, voting
 from core.settings import storage
 from core.util import extract_value
 
@@ -220,8 +218,7 @@ def remove_all(request: WSGIRequest) -> HttpResponse:
         return HttpResponseForbidden()
     with playback.mopidy_command() as allowed:
         if allowed:
-            with transaction.atomic():
-                playback.queue.all().delete()
+            playback.queue.remove_all()
     return HttpResponse()
 
 
@@ -245,6 +242,7 @@ def remove(request: WSGIRequest) -> HttpResponse:
     key = int(key_param)
     try:
         removed = playback.queue.remove(key)
+        voting.forget([key])
         # if we removed a song and it was added by autoplay,
         # we want it to be the new basis for autoplay
         if not removed.manually_requested:
@@ -281,6 +279,32 @@ def reorder(request: WSGIRequest) -> HttpResponse:
     return HttpResponse()
 
 
+def _kick(key: int) -> bool:
+    """Removes the song with the given key after it received too many downvotes.
+    Returns whether the song could be removed."""
+    voting.flush()
+    if models.CurrentSong.objects.filter(queue_key=key).exists():
+        with playback.mopidy_command() as allowed:
+            if allowed:
+                PLAYER.playback.next()
+        # the votes are forgotten once the playback loop deleted the current song
+        return allowed
+
+    try:
+        removed = playback.queue.remove(key)
+    except models.QueuedSong.DoesNotExist:
+        # the song was removed in the meantime
+        return True
+    voting.forget([key])
+    # if we removed a song by voting, and it was added by autoplay,
+    # we want it to be the new basis for autoplay
+    if not removed.manually_requested:
+        playback.handle_autoplay(removed.external_url or removed.title)
+    else:
+        playback.handle_autoplay()
+    return True
+
+
 @csrf_exempt
 @user_manager.tracked
 def vote(request: WSGIRequest) -> HttpResponse:
@@ -300,33 +324,15 @@ def vote(request: WSGIRequest) -> HttpResponse:
     ):
         return HttpResponseBadRequest("nice try")
 
-    models.CurrentSong.objects.filter(queue_key=key).update(votes=F("votes") + amount)
-    try:
-        current_song = models.CurrentSong.objects.get()
-        if (
-            current_song.queue_key == key
-            and current_song.votes
-            <= -storage.get(  # pylint: disable=invalid-unary-operand-type
-                "downvotes_to_kick"
-            )
-        ):
-            with playback.mopidy_command() as allowed:
-                if allowed:
-                    PLAYER.playback.next()
-    except models.CurrentSong.DoesNotExist:
-        pass
-
-    removed = playback.queue.vote(
-        key,
-        amount,
-        -storage.get("downvotes_to_kick"),  # pylint: disable=invalid-unary-operand-type
-    )
-    # if we removed a song by voting, and it was added by autoplay,
-    # we want it to be the new basis for autoplay
-    if removed is not None:
-        if not removed.manually_requested:
-            playback.handle_autoplay(removed.external_url or removed.title)
-        else:
-            playback.handle_autoplay()
+    # votes are counted in redis and written to the database in batches, see voting.flush
+    total = voting.vote(key, amount)
+    if total is None:
+        return HttpResponse()
+    if total <= -storage.get(  # pylint: disable=invalid-unary-operand-type
+        "downvotes_to_kick"
+    ) and voting.claim_kick(key):
+        if not _kick(key):
+            # further downvotes can try again
+            voting.release_kick(key)
     musiq.update_state()
     return HttpResponse()
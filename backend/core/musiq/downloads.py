@@ -0,0 +1,129 @@
+"""This module schedules the downloads of requested songs."""
+
+import base64
+import logging
+import pickle
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from django.conf import settings as conf
+from django.db import transaction
+
+from core import models, redis
+from core.musiq import musiq, voting
+from core.settings import storage
+from core.tasks import app
+
+# download progress is only published in steps of this many percent
+PROGRESS_STEP = 5
+# maps the queue key of each waiting song to its download key
+PENDING = "download_pending"
+# maps the queue key of each waiting song to its pickled job
+JOBS = "download_jobs"
+# maps the queue key of each song that is being downloaded to its download key
+ACTIVE = "download_active"
+
+
+def schedule(queue_key: int, download_key: str, job: Callable[[], None]) -> None:
+    """Schedules the given job, which makes the song with the given queue key available.
+    The jobs wait in redis and are run by celery workers, at most DOWNLOAD_WORKERS at a time.
+    Whenever a worker becomes free, it starts with the waiting song that is played first,
+    so a playlist becomes playable from its head and a slow download does not hold back
+    the songs behind it. Jobs with the same download key are never run at the same time."""
+    # jobs contain the provider of the song, so they are pickled like celery tasks
+    payload = base64.b64encode(pickle.dumps(job)).decode()
+
+    def start() -> None:
+        pipe = redis.connection.pipeline()
+        pipe.hset(PENDING, queue_key, download_key)
+        pipe.hset(JOBS, queue_key, payload)
+        pipe.execute()
+        _download.delay()
+
+    # the placeholder of the song is visible to the workers once it was committed
+    transaction.on_commit(start)
+
+
+def _next_job() -> Optional[Tuple[int, str, Callable[[], None]]]:
+    """Takes the waiting job whose song is played first.
+    Returns None if all workers are busy or no job can be started."""
+    with redis.connection.lock("download_scheduler_lock"):
+        active = redis.connection.hgetall(ACTIVE)
+        if len(active) >= conf.DOWNLOAD_WORKERS:
+            return None
+        pending = {
+            int(queue_key): download_key
+            for queue_key, download_key in redis.connection.hgetall(PENDING).items()
+        }
+        if not pending:
+            return None
+        by_votes = storage.get("interactivity") in [
+            storage.Interactivity.upvotes_only,
+            storage.Interactivity.full_voting,
+        ]
+        position = {
+            queue_key: index
+            for index, queue_key in enumerate(voting.queue_order(by_votes))
+        }
+        runnable = [
+            queue_key
+            for queue_key, download_key in pending.items()
+            if download_key not in active.values()
+        ]
+        if not runnable:
+            # the worker of the running download continues with them
+            return None
+        # songs that are not in the stored order yet are downloaded last
+        queue_key = min(
+            runnable, key=lambda key: (position.get(key, len(position)), key)
+        )
+        download_key = pending[queue_key]
+        pipe = redis.connection.pipeline()
+        pipe.hget(JOBS, queue_key)
+        pipe.hdel(PENDING, queue_key)
+        pipe.hdel(JOBS, queue_key)
+        pipe.hset(ACTIVE, queue_key, download_key)
+        payload, _, _, _ = pipe.execute()
+    return queue_key, download_key, pickle.loads(base64.b64decode(payload))
+
+
+@app.task
+def _download() -> None:
+    """Runs waiting jobs until none is left or enough other workers are downloading."""
+    while True:
+        next_job = _next_job()
+        if next_job is None:
+            return
+        queue_key, download_key, job = next_job
+        try:
+            # songs that were removed from the queue in the meantime are not downloaded
+            if models.QueuedSong.objects.filter(id=queue_key).exists():
+                # requests for the same song wait for this download
+                with redis.connection.lock(f"download_lock_{download_key}"):
+                    job()
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("error while downloading %s", download_key)
+        finally:
+            redis.delete_fields("download_progress", [str(queue_key)])
+            redis.connection.hdel(ACTIVE, queue_key)
+
+
+def progress_hook(queue_key: int) -> Callable[[Dict[str, Any]], None]:
+    """Returns a yt-dlp progress hook that publishes
+    the download progress of the song with the given queue key."""
+    published = -PROGRESS_STEP
+
+    def hook(status: Dict[str, Any]) -> None:
+        nonlocal published
+        if status["status"] != "downloading":
+            return
+        total = status.get("total_bytes") or status.get("total_bytes_estimate")
+        if not total:
+            return
+        percent = min(int(status["downloaded_bytes"] / total * 100), 100)
+        if percent - published < PROGRESS_STEP:
+            return
+        published = percent
+        redis.put_field("download_progress", str(queue_key), percent)
+        musiq.update_state()
+
+    return hook
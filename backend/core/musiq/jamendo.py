@@ -82,11 +82,9 @@ class Jamendo:
         except (KeyError, TypeError):
             return []
 
-        suggestions = [
-            suggestion
-            for suggestion in suggestions
-            if suggestion != query and not song_utils.is_forbidden(suggestion)
-        ]
+        suggestions = song_utils.filter_forbidden(
+            suggestion for suggestion in suggestions if suggestion != query
+        )
         return suggestions
 
 
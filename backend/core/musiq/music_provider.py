@@ -2,9 +2,10 @@
 
 from __future__ import annotations
 
+from functools import partial
 from typing import Optional
 
-from core.musiq import musiq, playback
+from core.musiq import downloads, musiq, playback
 from core.settings import storage
 from core.tasks import app
 
@@ -51,6 +52,15 @@ class MusicProvider:
         Called if there was an error and this element needs to be removed from the queue."""
         raise NotImplementedError()
 
+    def download_key(self) -> Optional[str]:
+        """Returns a key that identifies the download of this resource
+        if it is made available by the download scheduler, None otherwise."""
+        return None
+
+    def queue_key(self) -> Optional[int]:
+        """Returns the key of the placeholder that represents this resource in the queue."""
+        return None
+
     def make_available(self) -> bool:
         """Makes this resource available for playback.
         If possible, downloads it to disk.
@@ -110,6 +120,21 @@ class MusicProvider:
 
         self.enqueue_placeholder(manually_requested)
 
+        download_key = self.download_key()
+        queue_key = self.queue_key()
+        if (
+            enqueue_function is fetch_enqueue
+            and download_key is not None
+            and queue_key is not None
+        ):
+            # downloads are started in the order the songs will be played
+            downloads.schedule(
+                queue_key,
+                download_key,
+                partial(fetch_enqueue, self, session_key, archive),
+            )
+            return
+
         enqueue_function.delay(self, session_key, archive)
 
 
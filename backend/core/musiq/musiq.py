@@ -16,14 +16,14 @@ from django.shortcuts import render
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 
-from core import base, redis, user_manager, util
+from core import base, redis, state_handler, user_manager, util
 from core.models import CurrentSong, QueuedSong
-from core.musiq import controller, playback, song_utils
+from core.musiq import controller, playback, search_index, song_utils, voting
 from core.musiq.music_provider import MusicProvider, ProviderError, WrongUrlError
 from core.musiq.playlist_provider import PlaylistProvider
 from core.musiq.song_provider import SongProvider
 from core.settings import storage
-from core.state_handler import send_state
+from core.state_handler import request_update
 from core.settings.storage import PlatformEnabled, PlatformSuggestions
 
 queue = QueuedSong.objects
@@ -37,6 +37,9 @@ def start() -> None:
 
     controller.start()
     playback.start()
+    if conf.DEBUG:
+        # sqlite has no similarity search, offline suggestions use an index in memory
+        search_index.start()
 
 
 def get_alarm_metadata() -> "Metadata":
@@ -215,8 +218,9 @@ def index(request: WSGIRequest) -> HttpResponse:
     return render(request, "musiq.html", context)
 
 
-def state_dict() -> Dict[str, Any]:
-    """Extends the base state with musiq-specific information and returns it."""
+def state_dict(queue_delta: bool = False) -> Dict[str, Any]:
+    """Extends the base state with musiq-specific information and returns it.
+    If queue_delta is set, only the changes of the queue since the last delta are included."""
     state = base.state_dict()
 
     musiq_state: Dict[str, Any] = {}
@@ -248,27 +252,70 @@ def state_dict() -> Dict[str, Any]:
         musiq_state["paused"] = True
         musiq_state["progress"] = 0
 
-    song_queue = []
-    total_time = 0
-    all_songs = queue.all()
-    if storage.get("interactivity") in [
-        storage.Interactivity.upvotes_only,
-        storage.Interactivity.full_voting,
-    ]:
-        all_songs = all_songs.order_by("-votes", "index")
-    for song in all_songs:
-        song_dict = model_to_dict(song)
-        song_dict = util.camelize(song_dict)
-        song_dict["durationFormatted"] = song_utils.format_seconds(
-            song_dict["duration"]
+    # votes that were not yet written to the database are only counted in redis
+    current_song_dict = musiq_state["currentSong"]
+    if current_song_dict:
+        current_song_dict["votes"] = voting.totals([current_song_dict["queueKey"]]).get(
+            current_song_dict["queueKey"], current_song_dict["votes"]
         )
-        song_queue.append(song_dict)
-        if song_dict["duration"] < 0:
-            # skip duration of placeholders
-            continue
-        total_time += song_dict["duration"]
+
+    song_queue: List[Dict[str, Any]] = []
+
+    def build_queue() -> List[Dict[str, Any]]:
+        # called by publish_delta while no other process publishes,
+        # so a newer revision is never built from an older queue
+        nonlocal song_queue
+        # the order is kept in redis, ordering by votes takes pending votes into account
+        by_votes = storage.get("interactivity") in [
+            storage.Interactivity.upvotes_only,
+            storage.Interactivity.full_voting,
+        ]
+        songs = queue.in_bulk()
+        order = voting.queue_order(by_votes)
+        if set(order) != set(songs):
+            # redis was cleared or a change was not applied yet
+            voting.sync_queue()
+            order = voting.queue_order(by_votes)
+        all_songs = [songs[key] for key in order if key in songs]
+        votes = voting.totals([song.id for song in all_songs])
+        download_progress = redis.get("download_progress")
+        song_queue = []
+        for song in all_songs:
+            song.votes = votes.get(song.id, song.votes)
+            song_dict = model_to_dict(song)
+            song_dict = util.camelize(song_dict)
+            song_dict["downloadProgress"] = download_progress.get(str(song.id))
+            # the stored index is sparse, clients derive the position from the order.
+            # Leaving it out keeps unaffected songs unchanged in deltas.
+            del song_dict["index"]
+            song_dict["durationFormatted"] = song_utils.format_seconds(
+                song_dict["duration"]
+            )
+            song_queue.append(song_dict)
+        return song_queue
+
+    if queue_delta:
+        musiq_state["queueDelta"] = state_handler.publish_delta(
+            "song_queue", build_queue
+        )
+    else:
+        # The queue is sent as of the latest delta, read atomically with its revision.
+        # A queue read from the database could be newer than a delta published after it,
+        # which would then be applied on top of it.
+        snapshot = state_handler.snapshot("song_queue")
+        if snapshot is None:
+            # no delta was published yet, start with the current queue
+            revision = state_handler.publish_delta("song_queue", build_queue)[
+                "revision"
+            ]
+            snapshot = (revision, song_queue)
+        musiq_state["revision"], song_queue = snapshot
+        for position, song_dict in enumerate(song_queue, start=1):
+            song_dict["index"] = position
+        musiq_state["songQueue"] = song_queue
+    # skip the duration of placeholders
+    total_time = sum(song["duration"] for song in song_queue if song["duration"] >= 0)
     musiq_state["totalTimeFormatted"] = song_utils.format_seconds(total_time)
-    musiq_state["songQueue"] = song_queue
 
     if state["alarm"]:
         musiq_state["currentSong"] = {
@@ -300,5 +347,12 @@ def state_dict() -> Dict[str, Any]:
 
 
 def update_state() -> None:
-    """Sends an update event to all connected clients."""
-    send_state(state_dict())
+    """Sends an update event to all connected clients.
+    Updates requested in quick succession are sent only once."""
+    request_update("musiq", _build_update)
+
+
+def _build_update() -> Dict[str, Any]:
+    # writing votes right before building the state batches them per broadcast
+    voting.flush()
+    return state_dict(queue_delta=True)
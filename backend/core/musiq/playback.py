@@ -9,19 +9,19 @@ import random
 import time
 import urllib.parse
 from contextlib import contextmanager
-from threading import Event
-from typing import Iterator, Optional, Tuple
+from threading import Condition, Event, Lock
+from typing import Any, Iterator, List, Optional, Tuple
 
 import requests
 from django.conf import settings as conf
-from django.db import connection, transaction
+from django.db import connection
 from django.utils import timezone
 from mopidyapi.client import MopidyAPI
 from mopidyapi.exceptions import MopidyError
 
 from core import models, redis, user_manager
 from core.lights import controller as lights_controller
-from core.musiq import controller, musiq
+from core.musiq import controller, musiq, voting
 from core.settings import settings, storage
 from core.tasks import app
 from core.musiq import song_utils
@@ -34,6 +34,37 @@ queue = models.QueuedSong.objects
 # this lock is released when restarting mopidy (which happens in another Thread)
 player_lock = redis.connection.lock("player_lock", thread_local=False)
 
+# While waiting for a song to end, this is how often the loop checks
+# whether it should stop or play an alarm.
+FLAG_INTERVAL = 0.25
+# How often mopidy is polled for the end of a song while its events can not be relied upon.
+FALLBACK_POLL_INTERVAL = 1.0
+# The internal timekeeping is checked at least this often, because the song might be seeked.
+WATCHDOG_INTERVAL = 5.0
+# If mopidy did not report the end of a song this long after the internal timekeeping expected it,
+# mopidy is asked whether the event got lost.
+WATCHDOG_GRACE = 2.0
+# The next song is added to mopidy's tracklist this many seconds before the current one ends,
+# so mopidy continues with it without a gap.
+PREBUFFER_LEAD = 10.0
+# Until the current song ends, the prebuffered song is checked this often,
+# in case the queue changed and another song should be played next.
+PREBUFFER_CHECK_INTERVAL = 1.0
+
+
+class _ConnectionWatcher(logging.Filter):
+    """mopidyapi only reports a lost websocket connection through its logger.
+    This filter notices these messages without suppressing them."""
+
+    def __init__(self, playback: "Playback") -> None:
+        super().__init__()
+        self.playback = playback
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.getMessage().startswith("Mopidy connection error"):
+            self.playback.events_connected = False
+        return True
+
 
 def start() -> None:
     """Initializes this module by starting the playback and buzzer loop."""
@@ -58,20 +89,40 @@ def set_playback_error(error: bool) -> None:
 class Playback:
     """Class containing all playback related methods."""
 
-    def __init__(self):
+    def __init__(self, player: Optional[MopidyAPI] = None):
         # the celery worker needs its own player instance.
         # if we use a module-wide instance, methods can be used,
         # but events do not register correctly (probably due to thread boundary)
-        if conf.TESTING:
+        if player is not None:
+            self.player = player
+        elif conf.TESTING:
             # to reduce the amount of created mopidy connections,
             # use the controller's instance during testing
             # this works because everything is run in a single process
             self.player = controller.PLAYER
         else:
+            # a separate logger, so only this connection is watched for errors
             self.player: MopidyAPI = MopidyAPI(
-                host=conf.MOPIDY_HOST, port=conf.MOPIDY_PORT
+                host=conf.MOPIDY_HOST,
+                port=conf.MOPIDY_PORT,
+                logger=logging.getLogger("mopidyapi.playback"),
             )
         self.playback_started = Event()
+        # set when mopidy reports the end of the track with current_tlid
+        self.playback_ended = Event()
+        self.current_tlid: Optional[int] = None
+        self.tlid_lock = Lock()
+        # notified when mopidy reports that the track with started_tlid started
+        self.track_started = Condition(self.tlid_lock)
+        self.started_tlid: Optional[int] = None
+        # the queue key and tlid of the song that was added to mopidy's tracklist
+        # to be played after the current one
+        self.prebuffered: Optional[Tuple[int, int]] = None
+        # whether mopidy's events can be relied upon to detect the end of a song
+        self.events_connected = True
+        # the monotonic time at which the currently playing alarm ends
+        self.alarm_end: Optional[float] = None
+        self.player.logger.addFilter(_ConnectionWatcher(self))
         redis.put("playing", False)
 
         queue.delete_placeholders()
@@ -83,9 +134,133 @@ class Playback:
             self.player.tracklist.set_consume(True)
 
         @self.player.on_event("track_playback_started")
-        def _on_playback_started(_event) -> None:
+        def _on_playback_started(event) -> None:
+            self.events_connected = True
+            with self.track_started:
+                self.started_tlid = event.tl_track.tlid
+                self.track_started.notify_all()
+                # mopidy continued with the prebuffered song, so the current one is over,
+                # even if its track_playback_ended event got lost
+                if (
+                    self.prebuffered is not None
+                    and self.prebuffered[1] == self.started_tlid
+                ):
+                    self.playback_ended.set()
             self.playback_started.set()
 
+        @self.player.on_event("track_playback_ended")
+        def _on_playback_ended(event) -> None:
+            self.events_connected = True
+            with self.tlid_lock:
+                # ignore the end of tracks that were interrupted, e.g. by an alarm
+                if event.tl_track.tlid == self.current_tlid:
+                    self.playback_ended.set()
+
+        @self.player.on_event("playback_state_changed")
+        def _on_playback_state_changed(_event) -> None:
+            # every event shows that the connection to mopidy works
+            self.events_connected = True
+
+    def _expect_end_of(self, tl_tracks: List[Any]) -> None:
+        """Remembers the track whose end _wait_until_song_end waits for."""
+        with self.tlid_lock:
+            self.current_tlid = tl_tracks[0].tlid if tl_tracks else None
+            self.playback_ended.clear()
+
+    def _drop_prebuffer(self) -> None:
+        """Removes the prebuffered song from mopidy's tracklist.
+        The song stays in the queue. Needs to be called inside a mopidy_command."""
+        if self.prebuffered is None:
+            return
+        _, tlid = self.prebuffered
+        self.prebuffered = None
+        self.player.tracklist.remove({"tlid": [tlid]})
+
+    def _peek_next_song(self) -> Optional[models.QueuedSong]:
+        """Returns the song that should be played next according to the current settings,
+        without removing it from the queue."""
+        confirmed = queue.confirmed()
+        if storage.get("interactivity") in [
+            storage.Interactivity.upvotes_only,
+            storage.Interactivity.full_voting,
+        ]:
+            # make sure the pending votes are considered
+            voting.flush()
+            return confirmed.order_by("-votes", "index").first()
+        if storage.get("shuffle"):
+            # keep the random choice for as long as the chosen song is in the queue,
+            # so the prebuffered song is not replaced every time
+            if self.prebuffered is not None:
+                song = confirmed.filter(id=self.prebuffered[0]).first()
+                if song is not None:
+                    return song
+            count = confirmed.count()
+            if count == 0:
+                return None
+            return confirmed[random.randint(0, count - 1)]
+        return confirmed.first()
+
+    def _prebuffer(self) -> float:
+        """Adds the song that will be played next to mopidy's tracklist
+        shortly before the current song ends, so mopidy continues with it without a gap.
+        Replaces the prebuffered song if another song should be played next by now.
+        Returns the number of seconds after which this should be checked again."""
+        if self.alarm_end is not None:
+            return PREBUFFER_CHECK_INTERVAL
+        remaining = self._remaining_time()
+        if remaining is None:
+            return PREBUFFER_CHECK_INTERVAL
+        if remaining > PREBUFFER_LEAD:
+            return min(remaining - PREBUFFER_LEAD, WATCHDOG_INTERVAL)
+
+        song = self._peek_next_song()
+        if song is not None and song.internal_url == "alarm":
+            # alarms are not played through the tracklist
+            song = None
+        song_id = song.id if song is not None else None
+        if self.prebuffered is not None and self.prebuffered[0] == song_id:
+            return PREBUFFER_CHECK_INTERVAL
+        if self.prebuffered is None and song is None:
+            return PREBUFFER_CHECK_INTERVAL
+
+        with mopidy_command() as allowed:
+            if allowed:
+                self._drop_prebuffer()
+                if song is not None:
+                    tl_tracks = self.player.tracklist.add(uris=[song.internal_url])
+                    if tl_tracks:
+                        self.prebuffered = (song.id, tl_tracks[0].tlid)
+        return PREBUFFER_CHECK_INTERVAL
+
+    def _hand_over(self, current_song: models.CurrentSong, recovered: bool) -> bool:
+        """Checks whether mopidy already continued with the given song because it was prebuffered.
+        Returns True if it is playing, False if it still needs to be started."""
+        if self.prebuffered is None:
+            return False
+        song_id, tlid = self.prebuffered
+        self.prebuffered = None
+        if recovered or song_id != current_song.queue_key:
+            return False
+
+        with self.track_started:
+            self.current_tlid = tlid
+            self.playback_ended.clear()
+            started = self.track_started.wait_for(
+                lambda: self.started_tlid == tlid, timeout=1
+            )
+        if not started:
+            # the event might have been lost, ask mopidy directly
+            with mopidy_command(important=True):
+                try:
+                    started = self.player.playback.get_current_tlid() == tlid
+                except (requests.exceptions.ConnectionError, MopidyError):
+                    started = False
+        if not started:
+            logging.warning("prebuffered song did not start")
+            return False
+        set_playback_error(False)
+        return True
+
     def play_alarm(self, interrupt=False, from_buzzer=True) -> None:
         """Play the alarm sound. If specified, interrupts the currently playing song."""
         redis.put("alarm_playing", True)
@@ -96,6 +271,23 @@ class Playback:
             # interrupt the current song if its playing
             if interrupt:
                 self.player.tracklist.clear()
+                self.prebuffered = None
+            elif (
+                self.prebuffered is not None
+                and self.prebuffered[1] == self.player.playback.get_current_tlid()
+            ):
+                # the previous song ended and mopidy already continued with the prebuffered one.
+                # Stop it and play it from the start after the alarm.
+                song_id, _ = self.prebuffered
+                self.player.tracklist.clear()
+                self.prebuffered = None
+                try:
+                    queue.prioritize(song_id)
+                except models.QueuedSong.DoesNotExist:
+                    pass
+            else:
+                # the prebuffered song would be played before the alarm
+                self._drop_prebuffer()
 
             success_probability = storage.get("buzzer_success_probability")
             if success_probability >= 0 and from_buzzer:
@@ -110,13 +302,17 @@ class Playback:
             duration = song_utils.get_metadata(path)["duration"]
 
             redis.put("alarm_duration", duration)
-            self.player.tracklist.add(uris=["file://" + urllib.parse.quote(path)])
+            self._expect_end_of(
+                self.player.tracklist.add(uris=["file://" + urllib.parse.quote(path)])
+            )
             self.player.playback.play()
 
         self.playback_started.wait(timeout=1)
+        self.alarm_end = time.monotonic() + duration
 
         musiq.update_state()
         self._wait_until_song_end()
+        self.alarm_end = None
 
         lights_controller.alarm_stopped()
         redis.put("alarm_playing", False)
@@ -136,6 +332,10 @@ class Playback:
             return models.CurrentSong.objects.get(), True
 
         if queue.count() == 0:
+            if self.prebuffered is not None:
+                # the prebuffered song was removed from the queue
+                with mopidy_command(important=True):
+                    self._drop_prebuffer()
             queue_changed.wait()
             queue_changed.clear()
 
@@ -143,24 +343,15 @@ class Playback:
             # in case of a false wakeup this causes as to wait again
             return None, False
 
-        # select the next song depending on settings
-        song: Optional[models.QueuedSong]
-        if storage.get("interactivity") in [
-            storage.Interactivity.upvotes_only,
-            storage.Interactivity.full_voting,
-        ]:
-            with transaction.atomic():
-                song = queue.confirmed().order_by("-votes", "index")[0]
-                song_id = song.id
-                queue.remove(song.id)
-        elif storage.get("shuffle"):
-            confirmed = queue.confirmed()
-            index = random.randint(0, confirmed.count() - 1)
-            song_id = confirmed[index].id
-            song = queue.remove(song_id)
-        else:
-            # move the first song in the queue into the current song
-            song_id, song = queue.dequeue()
+        # select the next song depending on settings.
+        # If it was prebuffered, mopidy already started playing it.
+        song = self._peek_next_song()
+        if song is not None:
+            song_id = song.id
+            try:
+                song = queue.remove(song_id)
+            except models.QueuedSong.DoesNotExist:
+                song = None
 
         if song is None:
             # either the semaphore didn't match up with the actual count
@@ -237,32 +428,38 @@ class Playback:
 
         return catch_up
 
+    def _remaining_time(self) -> Optional[float]:
+        """Returns how many seconds the current song should still play
+        according to the internal timekeeping, or None if this is unknown."""
+        if self.alarm_end is not None:
+            return self.alarm_end - time.monotonic()
+        if storage.get("paused"):
+            return None
+        try:
+            current_song = models.CurrentSong.objects.get()
+        except models.CurrentSong.DoesNotExist:
+            return None
+        elapsed = (timezone.now() - current_song.created).total_seconds()
+        return current_song.duration - elapsed
+
     def _wait_until_song_end(self) -> bool:
         """Wait until the song is over.
         Returns True when finished without errors, False otherwise."""
-        # This is the event based approach. Unfortunately too error-prone.
-        # If mopidy crashes/restarts for example, no track_playback_ended event is sent
-        # playback_ended.wait()
+        # The end of a song is signaled by mopidy's track_playback_ended event.
+        # Events get lost when the connection to mopidy breaks, e.g. if mopidy restarts.
+        # While the connection is broken, mopidy is polled instead.
+        # Otherwise, mopidy is only asked after the internal timekeeping
+        # expected the song to be over, in case an event got lost anyway.
         error = False
-        while True:
-            with mopidy_command() as allowed:
-                if allowed:
-                    try:
-                        if self.player.playback.get_state() == "stopped":
-                            break
-                    except (requests.exceptions.ConnectionError, MopidyError):
-                        # error during state get, skip until reconnected
-                        error = True
-            # use internal timekeeping to decide when a song is over to lower mopidy performance use
-            #current_song = models.CurrentSong.objects.get()
-            #if (timezone.now() - current_song.created).total_seconds() > current_song.duration:
-            #    break
-            time.sleep(0.1)
-            if redis.get("stop_playback_loop"):
+        next_check = time.monotonic()
+        next_prebuffer = next_check
+        while not self.playback_ended.wait(timeout=FLAG_INTERVAL):
+            flags = redis.get_many(["stop_playback_loop", "alarm_requested"])
+            if flags["stop_playback_loop"]:
                 # in order to stop the playback thread, return False, making the main loop restart.
                 # it will check this variable again and terminate itself.
                 return False
-            if redis.get("alarm_requested"):
+            if flags["alarm_requested"]:
                 redis.put("alarm_requested", False)
                 self.play_alarm(interrupt=True)
                 # the current song was interrupted and needs to be resumed at the correct position
@@ -279,6 +476,37 @@ class Playback:
                 current_song.save()
 
                 return False
+
+            now = time.monotonic()
+            if now >= next_prebuffer:
+                next_prebuffer = now + self._prebuffer()
+            if now < next_check:
+                continue
+            if self.events_connected:
+                remaining = self._remaining_time()
+                if remaining is None:
+                    next_check = now + WATCHDOG_INTERVAL
+                    continue
+                if remaining + WATCHDOG_GRACE > 0:
+                    next_check = now + min(
+                        remaining + WATCHDOG_GRACE, WATCHDOG_INTERVAL
+                    )
+                    continue
+            next_check = now + FALLBACK_POLL_INTERVAL
+            with mopidy_command() as allowed:
+                if allowed:
+                    try:
+                        # with a prebuffered song, mopidy does not stop but continues with it
+                        if self.player.playback.get_current_tlid() != self.current_tlid:
+                            if self.events_connected:
+                                logging.warning(
+                                    "end of song was not reported by mopidy"
+                                )
+                            break
+                    except (requests.exceptions.ConnectionError, MopidyError):
+                        # error during state get, skip until reconnected
+                        error = True
+                        self.events_connected = False
         return not error
 
     def _song_finished(self, current_song: models.CurrentSong) -> None:
@@ -306,9 +534,12 @@ class Playback:
 
         if not queue.exists() and storage.get("backup_stream"):
             redis.put("backup_playing", True)
-            # play backup stream
-            self.player.tracklist.add(uris=[storage.get("backup_stream")])
-            self.player.playback.play()
+            with mopidy_command(important=True):
+                # the prebuffered song is not in the queue anymore
+                self._drop_prebuffer()
+                # play backup stream
+                self.player.tracklist.add(uris=[storage.get("backup_stream")])
+                self.player.playback.play()
 
         musiq.update_state()
 
@@ -329,37 +560,42 @@ class Playback:
 
             catch_up = self._catch_up(current_song, recovered)
 
-            with mopidy_command(important=True):
-                # after a restart consume may be set to False again, so make sure it is on
-                self.player.tracklist.clear()
-                self.player.tracklist.set_consume(True)
-                self.player.tracklist.add(uris=[current_song.internal_url])
-                # temporarily mute mopidy in case we need to seek but mopidy does not react directly
-                # this allows us to seek first and then unmute, preventing audible skips
-                volume = self.player.mixer.get_volume()
-                if catch_up is not None and catch_up >= 0:
-                    self.player.mixer.set_volume(0)
-                # mopidy can only seek when the song is playing
-                # also we do not continue without the playing state properly set.
-                # otherwise waiting might exit before the song started
-                self.player.playback.play()
-                if not self.playback_started.wait(timeout=1):
-                    # mopidy did not acknowledge that it started the song
-                    # to make sure it is not in an error state,
-                    # restart the loop and retry to start the song
-                    # also prevents "queue-eating" bug,
-                    # where mopidy in a failed state would refuse to play any song,
-                    # but raveberry keeps on sending songs from the queue
-                    logging.warning("playback_started event did not trigger")
-                    set_playback_error(True)
-                    self.player.mixer.set_volume(volume)
-                    continue
-                set_playback_error(False)
-                if catch_up is not None and catch_up >= 0:
-                    self.player.playback.seek(catch_up)
-                    if storage.get("paused"):
-                        self.player.playback.pause()
-                    self.player.mixer.set_volume(volume)
+            if not self._hand_over(current_song, recovered):
+                with mopidy_command(important=True):
+                    # after a restart consume may be set to False again, so make sure it is on
+                    self.player.tracklist.clear()
+                    self.prebuffered = None
+                    self.playback_started.clear()
+                    self.player.tracklist.set_consume(True)
+                    self._expect_end_of(
+                        self.player.tracklist.add(uris=[current_song.internal_url])
+                    )
+                    # temporarily mute mopidy in case we need to seek but mopidy does not react directly
+                    # this allows us to seek first and then unmute, preventing audible skips
+                    volume = self.player.mixer.get_volume()
+                    if catch_up is not None and catch_up >= 0:
+                        self.player.mixer.set_volume(0)
+                    # mopidy can only seek when the song is playing
+                    # also we do not continue without the playing state properly set.
+                    # otherwise waiting might exit before the song started
+                    self.player.playback.play()
+                    if not self.playback_started.wait(timeout=1):
+                        # mopidy did not acknowledge that it started the song
+                        # to make sure it is not in an error state,
+                        # restart the loop and retry to start the song
+                        # also prevents "queue-eating" bug,
+                        # where mopidy in a failed state would refuse to play any song,
+                        # but raveberry keeps on sending songs from the queue
+                        logging.warning("playback_started event did not trigger")
+                        set_playback_error(True)
+                        self.player.mixer.set_volume(volume)
+                        continue
+                    set_playback_error(False)
+                    if catch_up is not None and catch_up >= 0:
+                        self.player.playback.seek(catch_up)
+                        if storage.get("paused"):
+                            self.player.playback.pause()
+                        self.player.mixer.set_volume(volume)
             redis.put("playing", True)
 
             musiq.update_state()
@@ -380,6 +616,7 @@ class Playback:
             redis.put("playing", False)
 
             current_song.delete()
+            voting.forget([current_song.queue_key])
 
             self._song_finished(current_song)
 
@@ -13,7 +13,7 @@ from core.models import (
     PlaylistEntry,
     RequestLog,
 )
-from core.musiq import song_utils
+from core.musiq import song_utils, suggestion_cache
 from core.musiq.music_provider import MusicProvider, ProviderError
 from core.musiq.song_provider import SongProvider
 from core.settings import storage
@@ -190,6 +190,8 @@ class PlaylistProvider(MusicProvider):
             ArchivedPlaylistQuery.objects.get_or_create(
                 playlist=archived_playlist, query=self.query
             )
+        # counters and queries determine the offline suggestions
+        suggestion_cache.invalidate_offline()
 
         if storage.get("logging_enabled") and session_key:
             RequestLog.objects.create(
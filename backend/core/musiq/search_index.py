@@ -0,0 +1,285 @@
+"""This module contains an in-memory trigram index of the archived songs and playlists.
+It provides similarity search for sqlite, which does not have the trigram extension of postgres.
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from contextlib import nullcontext
+from itertools import groupby
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Set, Tuple
+
+from django import db
+from django.db.models import QuerySet
+
+from core.models import (
+    ArchivedPlaylist,
+    ArchivedPlaylistQuery,
+    ArchivedQuery,
+    ArchivedSong,
+)
+from core.musiq import suggestion_cache
+
+# the default of pg_trgm.word_similarity_threshold,
+# which is used by the trigram_word_similar lookups in postgres
+WORD_SIMILARITY_THRESHOLD = 0.6
+# rows are loaded from the database in batches of this size
+BATCH_SIZE = 2000
+
+# pg_trgm considers alphanumeric characters as part of words
+_WORD = re.compile(r"[^\W_]+")
+
+
+def trigrams(text: str) -> Set[str]:
+    """Returns the trigrams of the given text the way pg_trgm extracts them:
+    every lower cased word is padded with two spaces in front and one behind."""
+    result = set()
+    for word in _WORD.findall(text.lower()):
+        padded = f"  {word} "
+        result.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class TrigramIndex:
+    """Maps trigrams to the texts containing them.
+    Every text belongs to an owner, e.g. the id of the song it is the title of."""
+
+    def __init__(self) -> None:
+        # maps every trigram to the texts it appears in
+        self.postings: Dict[str, array] = {}
+        # the owner of every text
+        self.owners = array("I")
+
+    def add(self, owner: int, text: str) -> None:
+        """Adds the text to the index."""
+        text_id = len(self.owners)
+        self.owners.append(owner)
+        for trigram in trigrams(text):
+            if trigram not in self.postings:
+                self.postings[trigram] = array("I")
+            self.postings[trigram].append(text_id)
+
+    def search(
+        self, query: str, limit: int, order: Optional[Callable[[int], Any]] = None
+    ) -> List[int]:
+        """Returns the owners of the texts that are most similar to the query,
+        ordered by the greatest similarity of their texts and then by :param order:.
+        Like word_similarity in postgres, the similarity is the fraction of the trigrams
+        of the query that are contained in the text. Unlike postgres,
+        the trigrams do not need to be contained in a continuous extent of the text."""
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            return []
+        # The texts are counted, sorted and grouped in C.
+        # Python only loops over the distinct numbers of shared trigrams.
+        counts: Counter = Counter()
+        for trigram in query_trigrams:
+            counts.update(self.postings.get(trigram, ()))
+        # tolerate rounding errors of the product
+        needed = math.ceil(len(query_trigrams) * WORD_SIMILARITY_THRESHOLD - 1e-9)
+        # a text that shares enough trigrams with the query contains one of the rarest ones,
+        # only these texts need to be sorted
+        rarest = sorted(
+            query_trigrams, key=lambda trigram: len(self.postings.get(trigram, ()))
+        )
+        candidates: Set[int] = set().union(
+            *(
+                self.postings.get(trigram, ())
+                for trigram in rarest[: len(query_trigrams) - needed + 1]
+            )
+        )
+        ranked = sorted(candidates, key=counts.__getitem__, reverse=True)
+
+        result: List[int] = []
+        seen: Set[int] = set()
+        for shared, texts in groupby(ranked, key=counts.__getitem__):
+            if shared < needed or len(result) >= limit:
+                break
+            # the owners whose most similar text shares this many trigrams with the query
+            owners = set(map(self.owners.__getitem__, texts))
+            owners -= seen
+            seen |= owners
+            result.extend(sorted(owners, key=order)[: limit - len(result)])
+        return result
+
+
+class SearchIndex:
+    """Indexes the artists, titles and queries of all archived songs
+    and the titles and queries of all archived playlists."""
+
+    def __init__(self) -> None:
+        self.songs = TrigramIndex()
+        self.playlists = TrigramIndex()
+        # artist and title of every song, to order songs with the same similarity
+        self.song_names: Dict[int, Tuple[str, str]] = {}
+        # the position of every song when ordered by artist and title,
+        # computed when needed because comparing integers is a lot faster
+        self._song_ranks: Optional[Dict[int, int]] = None
+        # the highest id of each model that is contained in the index
+        self.max_ids = {
+            ArchivedSong: 0,
+            ArchivedQuery: 0,
+            ArchivedPlaylist: 0,
+            ArchivedPlaylistQuery: 0,
+        }
+        # the generation of the suggestion cache the index is up to date with
+        self.generation: Optional[str] = None
+        # rows are only added to the index, it needs to be rebuilt when this version changes
+        self.version = suggestion_cache.index_version()
+
+    def update(self, lock: ContextManager = nullcontext()) -> None:
+        """Adds all rows that were created since the last update.
+        The rows are loaded before :param lock: is acquired to add them,
+        so the index can be searched while the database is queried."""
+        # read the generation first, so changes during the update cause another update
+        generation = suggestion_cache.generation()
+        # Queries are loaded before songs, so the songs of all loaded queries are loaded.
+        queries = self._new_rows(ArchivedQuery.objects.all(), "song_id", "query")
+        songs = self._new_rows(ArchivedSong.objects.all(), "artist", "title")
+        playlists = self._new_rows(
+            # radios are never suggested
+            ArchivedPlaylist.objects.exclude(list_id__startswith="RD").exclude(
+                list_id__contains="&list=RD"
+            ),
+            "title",
+        )
+        playlist_queries = self._new_rows(
+            ArchivedPlaylistQuery.objects.all(), "playlist_id", "query"
+        )
+        with lock:
+            for _, song_id, query in queries:
+                self.songs.add(song_id, query)
+            for song_id, artist, title in songs:
+                self.song_names[song_id] = (artist, title)
+                self._song_ranks = None
+                self.songs.add(song_id, artist)
+                self.songs.add(song_id, title)
+            for playlist_id, title in playlists:
+                self.playlists.add(playlist_id, title)
+            for _, playlist_id, query in playlist_queries:
+                self.playlists.add(playlist_id, query)
+            for model, rows in (
+                (ArchivedQuery, queries),
+                (ArchivedSong, songs),
+                (ArchivedPlaylist, playlists),
+                (ArchivedPlaylistQuery, playlist_queries),
+            ):
+                if rows:
+                    self.max_ids[model] = rows[-1][0]
+            self.generation = generation
+
+    def _new_rows(self, queryset: QuerySet, *fields: str) -> List[Tuple]:
+        rows: List[Tuple] = []
+        max_id = self.max_ids[queryset.model]
+        while True:
+            batch = list(
+                queryset.filter(id__gt=max_id)
+                .order_by("id")
+                .values_list("id", *fields)[:BATCH_SIZE]
+            )
+            if not batch:
+                return rows
+            rows.extend(batch)
+            max_id = batch[-1][0]
+
+    def search_songs(self, query: str, limit: int) -> List[int]:
+        """Returns the ids of the songs most similar to the query,
+        ordered like the postgres search: by similarity, artist and title."""
+        if self._song_ranks is None:
+            ordered = sorted(self.song_names, key=self.song_names.__getitem__)
+            self._song_ranks = dict(zip(ordered, range(len(ordered))))
+        return self.songs.search(query, limit, order=self._song_ranks.__getitem__)
+
+    def search_playlists(self, query: str, limit: int) -> List[int]:
+        """Returns the ids of the playlists most similar to the query."""
+        return self.playlists.search(query, limit)
+
+
+_index: Optional[SearchIndex] = None
+_building = False
+_lock = threading.Lock()
+# held while new rows are loaded from the database,
+# searches only wait for it if the index is outdated
+_update_lock = threading.Lock()
+
+
+def _build() -> None:
+    global _index, _building
+    start = time.perf_counter()
+    index = SearchIndex()
+    try:
+        index.update()
+    except Exception:  # pylint: disable=broad-except
+        logging.exception("could not build the search index")
+        with _lock:
+            _building = False
+        return
+    finally:
+        # this thread is not part of a request, so django does not clean up its connection
+        db.close_old_connections()
+    with _lock:
+        _index = index
+        _building = False
+    logging.info(
+        "built search index of %d songs in %.1fs",
+        len(index.song_names),
+        time.perf_counter() - start,
+    )
+
+
+def _start_build(rebuild: bool = False) -> None:
+    # expects the lock to be held
+    # :param rebuild: replace the existing index, which keeps being used until then
+    global _building
+    if (_index is None or rebuild) and not _building:
+        _building = True
+        threading.Thread(target=_build, daemon=True).start()
+
+
+def start() -> None:
+    """Starts building the index in the background."""
+    with _lock:
+        _start_build()
+
+
+def ready() -> bool:
+    """Returns whether the index is built.
+    Starts building it if necessary, e.g. in processes that did not start raveberry."""
+    with _lock:
+        _start_build()
+        return _index is not None
+
+
+def _search(kind: str, query: str, limit: int) -> List[int]:
+    with _lock:
+        index = _index
+    assert index is not None
+    if index.generation != suggestion_cache.generation():
+        with _update_lock:
+            # the index might have been updated while waiting for the lock
+            if index.generation != suggestion_cache.generation():
+                if index.version != suggestion_cache.index_version():
+                    # songs were modified, e.g. their tags were edited
+                    with _lock:
+                        _start_build(rebuild=True)
+                index.update(_lock)
+    with _lock:
+        if kind == "songs":
+            return index.search_songs(query, limit)
+        return index.search_playlists(query, limit)
+
+
+def search_songs(query: str, limit: int) -> List[int]:
+    """Returns the ids of the songs most similar to the query.
+    The index needs to be ready."""
+    return _search("songs", query, limit)
+
+
+def search_playlists(query: str, limit: int) -> List[int]:
+    """Returns the ids of the playlists most similar to the query.
+    The index needs to be ready."""
+    return _search("playlists", query, limit)
@@ -16,7 +16,7 @@ from core.models import (
     CurrentSong,
     PlayLog,
 )
-from core.musiq import musiq, playback, song_utils
+from core.musiq import musiq, playback, song_utils, suggestion_cache
 from core.musiq.music_provider import MusicProvider, WrongUrlError
 from core.musiq.song_utils import Metadata
 from core.settings import storage
@@ -51,12 +51,14 @@ class SongProvider(MusicProvider):
                 logging.error("archived song requested for nonexistent key %s", key)
                 raise ValueError() from error
             external_url = archived_song.url
-        if external_url is None:
+            url_type = archived_song.platform
+        elif external_url is None:
             raise ValueError(
                 "external_url was provided and could not be inferred from remaining attributes."
             )
+        else:
+            url_type = song_utils.determine_url_type(external_url)
         provider_class: Optional[Type[SongProvider]] = None
-        url_type = song_utils.determine_url_type(external_url)
         if url_type == "local":
             from core.musiq.local import LocalSongProvider
 
@@ -170,6 +172,11 @@ class SongProvider(MusicProvider):
         assert self.queued_song
         self.queued_song.delete()
 
+    def queue_key(self) -> Optional[int]:
+        if self.queued_song is None:
+            return None
+        return self.queued_song.id
+
     def check_cached(self) -> bool:
         return False
 
@@ -301,6 +308,8 @@ class SongProvider(MusicProvider):
                 ArchivedQuery.objects.get_or_create(
                     song=archived_song, query=self.query
                 )
+        # counters and queries determine the offline suggestions
+        suggestion_cache.invalidate_offline()
 
         if storage.get("logging_enabled") and session_key:
             RequestLog.objects.create(song=archived_song, session_key=session_key)
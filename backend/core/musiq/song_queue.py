@@ -6,14 +6,24 @@ import random
 from typing import TYPE_CHECKING, Optional, Tuple
 
 from django.db import models, transaction
-from django.db.models import F, QuerySet
+from django.db.models import QuerySet
 
 import core.models
+from core.musiq import voting
 
 if TYPE_CHECKING:
     from core.models import QueuedSong
     from core.musiq.song_utils import Metadata
 
+# Indices of neighboring songs are spaced out by this gap.
+# A song can then be moved between two others by taking the midpoint of their indices,
+# and removing a song leaves a hole instead of shifting every song behind it.
+# Thus, every queue operation only writes the rows it actually touches.
+INDEX_GAP = 1024
+# Stay well inside the range of a 32 bit integer field.
+# When an index would leave this range, the queue is rebalanced.
+MAX_INDEX = 2**30
+
 
 class SongQueue(models.Manager):
     """This is the manager for the QueuedSong model.
@@ -28,7 +38,19 @@ class SongQueue(models.Manager):
     @transaction.atomic
     def delete_placeholders(self) -> None:
         """Deletes all songs from the queue that are not confirmed."""
-        self.filter(internal_url=None).delete()
+        placeholders = self.filter(internal_url=None)
+        keys = list(placeholders.values_list("id", flat=True))
+        placeholders.delete()
+        voting.untrack(keys)
+        voting.forget(keys)
+
+    @transaction.atomic
+    def remove_all(self) -> None:
+        """Deletes all songs from the queue."""
+        keys = list(self.values_list("id", flat=True))
+        self.all().delete()
+        voting.untrack(keys)
+        voting.forget(keys)
 
     @transaction.atomic
     def enqueue(
@@ -39,10 +61,8 @@ class SongQueue(models.Manager):
         enqueue_first=False,
     ) -> QueuedSong:
         """Creates a new song at the end of the queue and returns it."""
-        last = self.last()
-        index = 1 if last is None else last.index + 1
         song = self.create(
-            index=index,
+            index=self._index_after_last(),
             votes=votes,
             manually_requested=manually_requested,
             artist=metadata["artist"],
@@ -52,10 +72,42 @@ class SongQueue(models.Manager):
             external_url=metadata["external_url"],
             stream_url=metadata["stream_url"],
         )
+        voting.track([song])
         if enqueue_first:
             self.prioritize(song.id)
         return song
 
+    def _rebalance(self) -> None:
+        """Spreads the indices of all songs evenly, restoring the gaps between them.
+        This touches every row, but is only needed when a gap was exhausted."""
+        songs = list(self.all().only("id", "index", "votes"))
+        for position, song in enumerate(songs, start=1):
+            song.index = position * INDEX_GAP
+        self.bulk_update(songs, ["index"])
+        voting.track(songs)
+
+    def _index_after_last(self) -> int:
+        """Returns an index that places a song behind every song in the queue."""
+        last = self.last()
+        if last is None:
+            return INDEX_GAP
+        if last.index + INDEX_GAP > MAX_INDEX:
+            self._rebalance()
+            last = self.last()
+            assert last
+        return last.index + INDEX_GAP
+
+    def _index_before_first(self) -> int:
+        """Returns an index that places a song in front of every song in the queue."""
+        first = self.first()
+        if first is None:
+            return INDEX_GAP
+        if first.index - INDEX_GAP < -MAX_INDEX:
+            self._rebalance()
+            first = self.first()
+            assert first
+        return first.index - INDEX_GAP
+
     @transaction.atomic
     def dequeue(self) -> Tuple[int, Optional["QueuedSong"]]:
         """Removes the first completed song from the queue and returns its id and the object."""
@@ -64,7 +116,7 @@ class SongQueue(models.Manager):
             return -1, None
         song_id = song.id
         song.delete()
-        self.filter(index__gt=song.index).update(index=F("index") - 1)
+        voting.untrack([song_id])
         return song_id, song
 
     @transaction.atomic
@@ -75,9 +127,9 @@ class SongQueue(models.Manager):
         if to_prioritize == first:
             return
 
-        self.filter(index__lt=to_prioritize.index).update(index=F("index") + 1)
-        to_prioritize.index = 1
-        to_prioritize.save()
+        to_prioritize.index = self._index_before_first()
+        to_prioritize.save(update_fields=["index"])
+        voting.track([to_prioritize])
 
     @transaction.atomic
     def deprioritize(self, key: int) -> None:
@@ -87,16 +139,16 @@ class SongQueue(models.Manager):
         if to_deprioritize == last:
             return
 
-        self.filter(index__gt=to_deprioritize.index).update(index=F("index") - 1)
-        to_deprioritize.index = self.count()
-        to_deprioritize.save()
+        to_deprioritize.index = self._index_after_last()
+        to_deprioritize.save(update_fields=["index"])
+        voting.track([to_deprioritize])
 
     @transaction.atomic
     def remove(self, key: int) -> "QueuedSong":
         """Removes the song specified by :param key: from the queue and returns it."""
         to_remove = self.get(id=key)
         to_remove.delete()
-        self.filter(index__gt=to_remove.index).update(index=F("index") - 1)
+        voting.untrack([key])
         return to_remove
 
     @transaction.atomic
@@ -136,49 +188,32 @@ class SongQueue(models.Manager):
             self.deprioritize(element_id)
             return
         # neither new_prev and new_next are None
-        # new_prev and new_next have to be adjacent
-        if new_next.index != new_prev.index + 1:
+        # new_prev and new_next have to be adjacent (apart from the moved song itself)
+        if (
+            new_prev.index >= new_next.index
+            or self.filter(index__gt=new_prev.index, index__lt=new_next.index)
+            .exclude(id=element_id)
+            .exists()
+        ):
             raise ValueError("given pair of songs is not adjacent")
 
-        # update indices
-        moving_up = True
-        if new_prev.index > to_reorder.index or new_next.index > to_reorder.index:
-            moving_up = False
-
-        to_update = self.all()
-        if moving_up:
-            new_index = new_next.index
-            to_update = to_update.filter(index__lte=to_reorder.index - 1)
-            to_update = to_update.filter(index__gte=new_next.index)
-            to_update.update(index=F("index") + 1)
-        else:
-            new_index = new_prev.index
-            to_update = to_update.filter(index__lte=new_prev.index)
-            to_update = to_update.filter(index__gte=to_reorder.index + 1)
-            to_update.update(index=F("index") - 1)
-
-        to_reorder.index = new_index
-        to_reorder.save()
+        if new_next.index - new_prev.index < 2:
+            # there is no space left between the two songs, spread out the queue again
+            self._rebalance()
+            new_prev.refresh_from_db(fields=["index"])
+            new_next.refresh_from_db(fields=["index"])
+
+        to_reorder.index = (new_prev.index + new_next.index) // 2
+        to_reorder.save(update_fields=["index"])
+        voting.track([to_reorder])
 
     @transaction.atomic
     def shuffle(self) -> None:
         """Assigns a random index to every song in the queue."""
-        indices = list(range(1, self.count() + 1))
+        songs = list(self.all().only("id", "index", "votes"))
+        indices = [position * INDEX_GAP for position in range(1, len(songs) + 1)]
         random.shuffle(indices)
-        for song, index in zip(self.all(), indices):
+        for song, index in zip(songs, indices):
             song.index = index
-            song.save()
-
-    @transaction.atomic
-    def vote(self, key: int, amount: int, threshold: int) -> Optional["QueuedSong"]:
-        """Modify the vote-count of the song specified by :param key: by :param amount: votes.
-        If the song is now below the threshold, remove and return it."""
-        self.filter(id=key).update(votes=F("votes") + amount)
-        try:
-            song = self.get(id=key)
-            if song.votes <= threshold:
-                song.delete()
-                return song
-        except core.models.QueuedSong.DoesNotExist:
-            pass
-        return None
+        self.bulk_update(songs, ["index"])
+        voting.track(songs)
@@ -1,8 +1,19 @@
 """This module provides some utility functions concerning songs."""
 
+import hashlib
 import os
 import re
-from typing import TYPE_CHECKING, Optional, TypedDict
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Pattern,
+    TypedDict,
+    TypeVar,
+)
 
 import mutagen.easymp4
 
@@ -12,6 +23,8 @@ from django.conf import settings as conf
 if TYPE_CHECKING:
     from core.models import ArchivedPlaylist
 
+T = TypeVar("T")
+
 
 class Metadata(TypedDict, total=False):
     """A type that describes all metadata a song can and should have."""
@@ -51,13 +64,20 @@ def determine_url_type(url: str) -> str:
 def determine_playlist_type(archived_playlist: "ArchivedPlaylist") -> str:
     """Uses the url of the first song in the playlist
     to determine the platform where the playlist is from."""
-    if archived_playlist.list_id.startswith("playlog"):
+    first_song = archived_playlist.entries.first()
+    return playlist_type(
+        archived_playlist.list_id, first_song.url if first_song else None
+    )
+
+
+def playlist_type(list_id: str, first_song_url: Optional[str]) -> str:
+    """Determines the platform where the playlist with the given list id is from,
+    given the url of its first song."""
+    if list_id.startswith("playlog"):
         # The playlist was created from play logs and may contain various song types.
         return "playlog"
-    first_song = archived_playlist.entries.first()
-    if not first_song:
+    if not first_song_url:
         raise ValueError("Playlist contains no songs.")
-    first_song_url = first_song.url
     return determine_url_type(first_song_url)
 
 
@@ -111,16 +131,119 @@ def get_metadata(path: str) -> "Metadata":
     return metadata
 
 
-def is_forbidden(string: str) -> bool:
-    """Returns whether the given string should be filtered according to the forbidden keywords."""
-    # We can't access the variable in settings/basic.py
-    # since we are in a static context without a reference to bes
-    keywords = storage.get("forbidden_keywords")
-    words = re.split(r"[,\s]+", keywords.strip())
-    # delete empty matches
-    words = [word for word in words if word]
+# characters with a special meaning in regular expressions
+_REGEX_SYNTAX = set(".^$*+?{}[]\\|()")
 
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Returns a regular expression that matches any of the given words.
+    The words are arranged in a trie, so the regex engine never compares
+    a character of the searched string to more than one branch."""
+    trie: Dict[str, Dict] = {}
     for word in words:
-        if re.search(word, string, re.IGNORECASE):
+        node = trie
+        for character in word:
+            node = node.setdefault(character, {})
+        # a string containing this word is matched,
+        # so longer words starting with it do not need to be considered
+        node.clear()
+        node[""] = {}
+
+    def branches(node: Dict[str, Dict]) -> str:
+        if "" in node:
+            return ""
+        alternatives = [
+            re.escape(character) + branches(child)
+            for character, child in sorted(node.items())
+        ]
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return f"(?:{'|'.join(alternatives)})"
+
+    return branches(trie)
+
+
+class KeywordFilter:
+    """Matches strings against a list of forbidden keywords.
+    Every keyword is a regular expression that is searched case insensitively.
+    All keywords are compiled once, so every string is scanned by one pattern
+    instead of once per keyword."""
+
+    def __init__(self, keywords: str) -> None:
+        self.keywords = keywords
+        # identifies these keywords, e.g. in keys of cached results that were filtered by them
+        self.version = hashlib.md5(keywords.encode()).hexdigest()[:8]
+        words = re.split(r"[,\s]+", keywords.strip())
+        # delete empty matches
+        words = [word for word in words if word]
+
+        # Most keywords are plain words. These are searched in the lower cased string,
+        # which is a lot faster than ignoring the case in the regex engine.
+        literals = [word.lower() for word in words if not _REGEX_SYNTAX & set(word)]
+        expressions = [word for word in words if _REGEX_SYNTAX & set(word)]
+        self.literal_pattern: Optional[Pattern[str]] = None
+        if literals:
+            self.literal_pattern = re.compile(_trie_pattern(literals))
+        self.pattern: Optional[Pattern[str]] = None
+        if expressions:
+            # every keyword is grouped, so alternatives inside it stay separate
+            self.pattern = re.compile(
+                "|".join(f"(?:{word})" for word in expressions), re.IGNORECASE
+            )
+
+    def is_forbidden(self, string: str) -> bool:
+        """Returns whether the given string contains a forbidden keyword."""
+        if self.literal_pattern and self.literal_pattern.search(string.lower()):
             return True
-    return False
+        return bool(self.pattern and self.pattern.search(string))
+
+    def filter_many(
+        self,
+        items: Iterable[T],
+        strings: Optional[Callable[[T], Iterable[str]]] = None,
+    ) -> List[T]:
+        """Returns the items that do not contain a forbidden keyword.
+        :param strings: returns the strings of an item that are checked.
+        By default, the items are strings themselves."""
+        if self.literal_pattern is None and self.pattern is None:
+            return list(items)
+        is_forbidden = self.is_forbidden
+        if strings is None:
+            return [item for item in items if not is_forbidden(item)]  # type: ignore[arg-type]
+        return [
+            item
+            for item in items
+            if not any(is_forbidden(string) for string in strings(item))
+        ]
+
+
+_keyword_filter = KeywordFilter("")
+
+
+def keyword_filter() -> KeywordFilter:
+    """Returns the filter for the current forbidden keywords.
+    It is only compiled again after the keywords changed."""
+    global _keyword_filter
+    # We can't access the variable in settings/basic.py
+    # since we are in a static context without a reference to bes.
+    # The setting is cached in memory and evicted by set_forbidden_keywords,
+    # so comparing it to the keywords of the current filter is cheap.
+    keywords = storage.get("forbidden_keywords")
+    current = _keyword_filter
+    if current.keywords != keywords:
+        current = KeywordFilter(keywords)
+        _keyword_filter = current
+    return current
+
+
+def is_forbidden(string: str) -> bool:
+    """Returns whether the given string should be filtered according to the forbidden keywords."""
+    return keyword_filter().is_forbidden(string)
+
+
+def filter_forbidden(
+    items: Iterable[T], strings: Optional[Callable[[T], Iterable[str]]] = None
+) -> List[T]:
+    """Returns the items that should not be filtered according to the forbidden keywords.
+    See KeywordFilter.filter_many."""
+    return keyword_filter().filter_many(items, strings)
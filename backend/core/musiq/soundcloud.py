@@ -40,11 +40,9 @@ class Soundcloud:
             "https://api-v2.soundcloud.com/search/queries", q=query
         )
 
-        suggestions = [
-            item.query
-            for item in response.collection
-            if not song_utils.is_forbidden(item.query)
-        ]
+        suggestions = song_utils.filter_forbidden(
+            item.query for item in response.collection
+        )
         return suggestions
 
 
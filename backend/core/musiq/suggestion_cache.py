@@ -0,0 +1,141 @@
+"""This module caches suggestion results in redis, so they are shared by all processes."""
+
+import json
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core import redis
+from core.musiq import song_utils
+
+# every cached result is stored under this prefix followed by its key
+PREFIX = "suggestion_cache:"
+# the keys of all cached results, scored by the time they were last used
+LRU = "suggestion_cache_lru"
+# replaced whenever the archived songs or playlists change,
+# which invalidates all cached offline results
+GENERATION = "suggestion_cache_generation"
+# replaced whenever archived songs or playlists were modified instead of only added,
+# which requires the search index to be rebuilt
+INDEX_VERSION = "suggestion_cache_index_version"
+# hit, miss and latency counters
+STATS = "suggestion_cache_stats"
+
+# the least recently used results are evicted when there are more than this many
+MAX_ENTRIES = 2000
+# cached results are discarded after this many seconds
+TTL = 600
+# a longer query can be answered from the results of one of its prefixes
+# that is at most this many characters shorter
+MAX_PREFIX_DISTANCE = 16
+
+
+def normalize(query: str) -> str:
+    """Returns the query in the form that is used to look it up in the cache."""
+    return " ".join(query.lower().split())
+
+
+def forbidden_version() -> str:
+    """Returns a short identifier of the current forbidden keywords.
+    Results that were filtered by these keywords are cached under it."""
+    return song_utils.keyword_filter().version
+
+
+def invalidate_offline(modified: bool = False) -> None:
+    """Discards all cached offline results, e.g. after a song was archived.
+    :param modified: whether existing songs or playlists were changed, e.g. their titles."""
+    # a random value instead of a counter, so the generation also changes
+    # after redis was cleared, e.g. between tests
+    pipe = redis.connection.pipeline(transaction=False)
+    if modified:
+        pipe.set(INDEX_VERSION, uuid.uuid4().hex[:8])
+    pipe.set(GENERATION, uuid.uuid4().hex[:8])
+    pipe.execute()
+
+
+def generation() -> str:
+    """Returns the generation that offline results are currently cached under."""
+    return redis.connection.get(GENERATION) or ""
+
+
+def index_version() -> str:
+    """Returns the version of the songs and playlists a search index needs to be built from."""
+    return redis.connection.get(INDEX_VERSION) or ""
+
+
+def get(key: str) -> Optional[Any]:
+    """Returns the value cached under the given key, or None."""
+    return get_many([key])[0]
+
+
+def get_many(keys: List[str]) -> List[Optional[Any]]:
+    """Returns the values cached under the given keys, None for missing values."""
+    pipe = redis.connection.pipeline(transaction=False)
+    pipe.mget([PREFIX + key for key in keys])
+    # mark the values as recently used, if they exist
+    pipe.zadd(LRU, {key: time.time() for key in keys}, xx=True)
+    values, _ = pipe.execute()
+    return [None if value is None else json.loads(value) for value in values]
+
+
+def get_prefixed(
+    make_key: Callable[[str], str], query: str
+) -> Optional[Tuple[str, Any]]:
+    """Returns the value cached for the given normalized query,
+    or for its longest prefix that has a cached value.
+    :param make_key: returns the key of the value for a given query.
+    Returns the query the value belongs to together with the value."""
+    candidates = [
+        query[:length]
+        for length in range(len(query), max(len(query) - MAX_PREFIX_DISTANCE, 0), -1)
+        # prefixes ending in a space are the same query as without it
+        if not query[:length].endswith(" ")
+    ]
+    if not candidates:
+        return None
+    keys = [make_key(candidate) for candidate in candidates]
+    values = redis.connection.mget([PREFIX + key for key in keys])
+    for candidate, key, value in zip(candidates, keys, values):
+        if value is not None:
+            redis.connection.zadd(LRU, {key: time.time()}, xx=True)
+            return candidate, json.loads(value)
+    return None
+
+
+def put(key: str, value: Any) -> None:
+    """Caches the given value under the given key.
+    Evicts the least recently used values if the cache is full."""
+    pipe = redis.connection.pipeline(transaction=False)
+    pipe.set(PREFIX + key, json.dumps(value), ex=TTL)
+    pipe.zadd(LRU, {key: time.time()})
+    pipe.zcard(LRU)
+    *_, size = pipe.execute()
+    if size > MAX_ENTRIES:
+        evicted = redis.connection.zpopmin(LRU, size - MAX_ENTRIES)
+        if evicted:
+            redis.connection.delete(*(PREFIX + key for key, _ in evicted))
+
+
+def count(event: str, seconds: float) -> None:
+    """Counts a lookup that resulted in the given event, e.g. offline_hit or online_miss,
+    and took the given number of seconds."""
+    pipe = redis.connection.pipeline(transaction=False)
+    pipe.hincrby(STATS, event, 1)
+    pipe.hincrbyfloat(STATS, f"{event}_seconds", seconds)
+    pipe.execute()
+
+
+def stats() -> Dict[str, Dict[str, float]]:
+    """Returns the number and average latency in milliseconds of every kind of lookup."""
+    counters = redis.connection.hgetall(STATS)
+    result: Dict[str, Dict[str, float]] = {}
+    for event, number in sorted(counters.items()):
+        if event.endswith("_seconds"):
+            continue
+        seconds = float(counters.get(f"{event}_seconds", 0))
+        result[event] = {
+            "count": int(number),
+            "average_ms": seconds / int(number) * 1000,
+        }
+    result["entries"] = {"count": redis.connection.zcard(LRU)}
+    return result
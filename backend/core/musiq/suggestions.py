@@ -3,19 +3,39 @@ type into the input field on the musiq page."""
 
 from __future__ import annotations
 
+import logging
 import random
 import threading
-from typing import Any, Dict, Iterable, List, Mapping, TypedDict, Union, cast
-
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Tuple,
+    TypedDict,
+    Union,
+    cast,
+)
+
+from django import db
 from django.core.handlers.wsgi import WSGIRequest
-from django.db.models import F, Q
+from django.db.models import F, OuterRef, Q, QuerySet, Subquery
 from django.db.models.functions import Greatest
-from django.http import HttpResponseBadRequest
+from django.http import HttpResponseBadRequest, HttpResponseForbidden
 from django.http.response import HttpResponse, JsonResponse
 
-from core import redis
-from core.models import ArchivedPlaylist, ArchivedQuery, ArchivedSong
-from core.musiq import song_utils
+from core import redis, user_manager
+from core.models import (
+    ArchivedPlaylist,
+    ArchivedPlaylistQuery,
+    ArchivedQuery,
+    ArchivedSong,
+    PlaylistEntry,
+)
+from core.musiq import search_index, song_utils, suggestion_cache
 from core.settings import storage
 from core.settings.storage import PlatformEnabled, PlatformSuggestions
 from main import settings
@@ -28,6 +48,7 @@ u_values_list = [
     "u_duration",
     "u_counter",
     "u_cached",
+    "u_platform",
 ]
 
 
@@ -67,124 +88,351 @@ def random_suggestion(request: WSGIRequest) -> HttpResponse:
     return JsonResponse({"suggestion": playlist.title, "key": playlist.id})
 
 
+def _youtube_suggestions(query: str, _suggest_playlist: bool) -> List[SuggestionResult]:
+    from core.musiq.youtube import Youtube
+
+    return [
+        {"key": -1, "value": suggestion, "type": "youtube-online"}
+        for suggestion in Youtube().get_search_suggestions(query)
+    ]
+
+
+def _spotify_suggestions(query: str, suggest_playlist: bool) -> List[SuggestionResult]:
+    from core.musiq.spotify import Spotify
+
+    return [
+        {"key": external_url, "value": suggestion, "type": "spotify-online"}
+        for suggestion, external_url in Spotify().get_search_suggestions(
+            query, suggest_playlist
+        )
+    ]
+
+
+def _soundcloud_suggestions(
+    query: str, _suggest_playlist: bool
+) -> List[SuggestionResult]:
+    from core.musiq.soundcloud import Soundcloud
+
+    return [
+        {"key": -1, "value": suggestion, "type": "soundcloud-online"}
+        for suggestion in Soundcloud().get_search_suggestions(query)
+    ]
+
+
+def _jamendo_suggestions(query: str, _suggest_playlist: bool) -> List[SuggestionResult]:
+    from core.musiq.jamendo import Jamendo
+
+    return [
+        {"key": -1, "value": suggestion, "type": "jamendo-online"}
+        for suggestion in Jamendo().get_search_suggestions(query)
+    ]
+
+
+# maps each platform to the function fetching its online suggestions, in the order they are shown
+suggestion_fetchers: Dict[str, Callable[[str, bool], List[SuggestionResult]]] = {
+    "youtube": _youtube_suggestions,
+    "spotify": _spotify_suggestions,
+    "soundcloud": _soundcloud_suggestions,
+    "jamendo": _jamendo_suggestions,
+}
+
+# Suggestions are fetched by long-lived threads instead of one new thread per platform and query.
+# Every platform has its own threads, so a slow platform does not delay the others.
+_executors = {
+    platform: ThreadPoolExecutor(
+        max_workers=3, thread_name_prefix=f"{platform}_suggestions"
+    )
+    for platform in suggestion_fetchers
+}
+# Fetches that are running or finished recently, keyed by platform, query and playlist flag.
+# Identical requests, e.g. from guests typing the same query or from the follow-up request
+# for late platforms, use the same fetch.
+_fetches: Dict[Tuple[str, str, bool], Tuple[float, Future[List[SuggestionResult]]]] = {}
+_fetches_lock = threading.Lock()
+# how many seconds finished fetches are kept for follow-up requests
+FETCH_RETENTION = 10.0
+
+
+def _online_cache_key(platform: str, query: str, suggest_playlist: bool) -> str:
+    # online results are filtered by the forbidden keywords inside the fetchers
+    return (
+        f"online:{platform}:{int(suggest_playlist)}:"
+        f"{suggestion_cache.forbidden_version()}:{suggestion_cache.normalize(query)}"
+    )
+
+
+def _run_fetcher(
+    platform: str, query: str, suggest_playlist: bool
+) -> List[SuggestionResult]:
+    start = time.perf_counter()
+    try:
+        results = suggestion_fetchers[platform](query, suggest_playlist)
+        suggestion_cache.put(
+            _online_cache_key(platform, query, suggest_playlist), results
+        )
+        suggestion_cache.count("online_miss", time.perf_counter() - start)
+        return results
+    finally:
+        # the threads of the executor live longer than any request,
+        # so django does not clean up their connections
+        db.close_old_connections()
+
+
+def _fetch(
+    platform: str, query: str, suggest_playlist: bool
+) -> Future[List[SuggestionResult]]:
+    now = time.monotonic()
+    key = (platform, query, suggest_playlist)
+    with _fetches_lock:
+        for old_key, (started, _) in list(_fetches.items()):
+            if now - started > FETCH_RETENTION:
+                del _fetches[old_key]
+        if key not in _fetches:
+            _fetches[key] = (
+                now,
+                _executors[platform].submit(
+                    _run_fetcher, platform, query, suggest_playlist
+                ),
+            )
+        return _fetches[key][1]
+
+
+def collect_online_suggestions(
+    query: str, suggest_playlist: bool, platforms: Iterable[str], deadline: float
+) -> List[SuggestionResult]:
+    """Fetches the online suggestions of all given platforms in parallel.
+    Returns the suggestions that arrived within :param deadline: seconds.
+    Platforms that did not answer in time are represented by placeholders,
+    their suggestions can be requested again while they are still being fetched.
+    Suggestions of previous fetches are answered from the cache."""
+    start = time.perf_counter()
+    platforms = list(platforms)
+    cached = suggestion_cache.get_many(
+        [_online_cache_key(platform, query, suggest_playlist) for platform in platforms]
+    )
+    lookup_seconds = time.perf_counter() - start
+    for value in cached:
+        if value is not None:
+            suggestion_cache.count("online_hit", lookup_seconds)
+    futures = {
+        platform: _fetch(platform, query, suggest_playlist)
+        for platform, value in zip(platforms, cached)
+        if value is None
+    }
+    wait(futures.values(), timeout=deadline)
+
+    results: List[SuggestionResult] = []
+    for platform, value in zip(platforms, cached):
+        count = storage.get(cast(PlatformSuggestions, f"{platform}_suggestions"))
+        if value is not None:
+            results.extend(value[:count])
+            continue
+        future = futures[platform]
+        if not future.done():
+            results.extend(
+                {"key": -1, "value": "...", "type": f"{platform}-placeholder"}
+                for _ in range(count)
+            )
+            continue
+        try:
+            results.extend(future.result()[:count])
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("could not fetch %s suggestions for %s", platform, query)
+    return results
+
+
 def online_suggestions(request: WSGIRequest) -> JsonResponse:
-    """Returns online suggestions for a given query."""
+    """Returns online suggestions for a given query.
+    If given, only the comma separated :param platforms: are asked."""
     query = request.GET["term"]
     suggest_playlist = request.GET["playlist"] == "true"
+    requested_platforms = request.GET.get("platforms")
 
     if storage.get("new_music_only"):
         return JsonResponse([], safe=False)
 
     results: List[SuggestionResult] = []
     if storage.get("online_suggestions") and redis.get("has_internet"):
-        threads = []
-        results_lock = threading.Lock()
+        platforms = [
+            platform
+            for platform in suggestion_fetchers
+            if storage.get(cast(PlatformEnabled, f"{platform}_enabled"))
+            and storage.get(cast(PlatformSuggestions, f"{platform}_suggestions")) > 0
+        ]
+        if requested_platforms:
+            platforms = [
+                platform
+                for platform in platforms
+                if platform in requested_platforms.split(",")
+            ]
+        results = collect_online_suggestions(
+            query, suggest_playlist, platforms, settings.SUGGESTION_DEADLINE
+        )
 
-        def fetch_youtube() -> None:
-            from core.musiq.youtube import Youtube
+    return JsonResponse(results, safe=False)
 
-            youtube_suggestions = Youtube().get_search_suggestions(query)
-            youtube_suggestions = youtube_suggestions[
-                : storage.get("youtube_suggestions")
-            ]
-            with results_lock:
-                for suggestion in youtube_suggestions:
-                    results.append(
-                        {"key": -1, "value": suggestion, "type": "youtube-online"}
-                    )
 
-        def fetch_spotify() -> None:
-            from core.musiq.spotify import Spotify
+def _enabled_platforms() -> List[str]:
+    return [
+        platform
+        for platform in ["youtube", "spotify", "soundcloud", "jamendo"]
+        if storage.get(cast(PlatformEnabled, f"{platform}_enabled"))
+    ]
 
-            spotify_suggestions = Spotify().get_search_suggestions(
-                query, suggest_playlist
-            )
-            spotify_suggestions = spotify_suggestions[
-                : storage.get("spotify_suggestions")
-            ]
-            with results_lock:
-                for suggestion, external_url in spotify_suggestions:
-                    results.append(
-                        {
-                            "key": external_url,
-                            "value": suggestion,
-                            "type": "spotify-online",
-                        }
-                    )
-
-        def fetch_soundcloud() -> None:
-            from core.musiq.soundcloud import Soundcloud
-
-            soundcloud_suggestions = Soundcloud().get_search_suggestions(query)
-            soundcloud_suggestions = soundcloud_suggestions[
-                : storage.get("soundcloud_suggestions")
-            ]
-            with results_lock:
-                for suggestion in soundcloud_suggestions:
-                    results.append(
-                        {"key": -1, "value": suggestion, "type": "soundcloud-online"}
-                    )
-
-        def fetch_jamendo() -> None:
-            from core.musiq.jamendo import Jamendo
-
-            jamendo_suggestions = Jamendo().get_search_suggestions(query)
-            jamendo_suggestions = jamendo_suggestions[
-                : storage.get("jamendo_suggestions")
-            ]
-            with results_lock:
-                for suggestion in jamendo_suggestions:
-                    results.append(
-                        {"key": -1, "value": suggestion, "type": "jamendo-online"}
-                    )
-
-        suggestion_fetchers = {
-            "youtube": fetch_youtube,
-            "spotify": fetch_spotify,
-            "soundcloud": fetch_soundcloud,
-            "jamendo": fetch_jamendo,
-        }
 
-        for platform in ["youtube", "spotify", "soundcloud", "jamendo"]:
-            if (
-                storage.get(cast(PlatformEnabled, f"{platform}_enabled"))
-                and storage.get(cast(PlatformSuggestions, f"{platform}_suggestions"))
-                > 0
-            ):
-                thread = threading.Thread(target=suggestion_fetchers[platform])
-                threads.append(thread)
-                thread.start()
+def _suggestable_songs(prefix: str = "") -> Q:
+    # Returns the condition for songs that can be suggested.
+    # :param prefix: the path to the song fields, if the condition is used for a related model
+    # don't suggest local songs if they are not cached (=not at expected location)
+    condition = Q(**{f"{prefix}platform": "local", f"{prefix}cached": True})
+    # don't suggest songs if the respective platform is disabled
+    online = Q(**{f"{prefix}platform__in": _enabled_platforms()})
+    # don't suggest online songs when we don't have internet
+    if not redis.get("has_internet"):
+        online &= Q(**{f"{prefix}cached": True})
+    return condition | online
+
+
+def _with_first_songs(playlists: QuerySet[ArchivedPlaylist]) -> QuerySet:
+    # annotates the platform of each playlist, which is the one of its first song,
+    # and whether this song is cached (None if it is not archived)
+    first_entries = PlaylistEntry.objects.filter(playlist=OuterRef("id")).order_by(
+        "index"
+    )
+    first_songs = ArchivedSong.objects.filter(url=OuterRef("first_song_url"))
+    return (
+        playlists.annotate(first_song_url=Subquery(first_entries.values("url")[:1]))
+        .annotate(platform=Subquery(first_entries.values("platform")[:1]))
+        .annotate(first_song_cached=Subquery(first_songs.values("cached")[:1]))
+    )
 
-        for thread in threads:
-            thread.join()
 
-    return JsonResponse(results, safe=False)
+def _suggestable_playlists() -> Q:
+    # Returns the condition for playlists annotated by _with_first_songs
+    # that can be suggested. Playlists without songs are never suggested.
+    # don't suggest local playlists if their first song is not cached
+    # i.e. not at the expected location
+    # don't suggest playlists if the respective platform is disabled
+    return Q(platform="local", first_song_cached=True) | Q(
+        platform__in=_enabled_platforms()
+    )
 
 
-def _offline_playlist_suggestions(query: str) -> List[SuggestionResult]:
-    results: List[SuggestionResult] = []
+def _ranked_rows(
+    ranked_ids: Callable[[int], List[int]], rows: QuerySet, key: str, limit: int
+) -> List[Dict]:
+    # Returns the rows with the given ids in their order, until there are :param limit: rows.
+    # :param ranked_ids: returns the given number of ids ordered by their rank.
+    # Not all of these ids might be contained in :param rows:, which is filtered.
+    # Thus, more ids are requested until enough rows were found.
+    count = limit
+    while True:
+        ids = ranked_ids(count)
+        rows_by_id = {row[key]: row for row in rows.filter(id__in=ids)}
+        result = [rows_by_id[row_id] for row_id in ids if row_id in rows_by_id]
+        if len(result) >= limit or len(ids) < count:
+            return result[:limit]
+        count *= 4
+
+
+def _cached_rows(
+    kind: str, query: str, fetch_rows: Callable[[str, bool], Tuple[List[Dict], bool]]
+) -> List[Dict]:
+    # Only the rows from the database are cached, the forbidden keywords are applied afterwards.
+    # :param fetch_rows: returns the rows for a query, matched by substrings or by similarity,
+    # and whether these are all matching rows.
+    start = time.perf_counter()
+    normalized = suggestion_cache.normalize(query)
+    limit = storage.get("number_of_suggestions")
+    generation = suggestion_cache.generation()
+    # sqlite matches substrings until the search index is built
+    substring = settings.DEBUG and not search_index.ready()
+
+    # the rows are filtered by the enabled platforms and the internet connection
+    filters = f"{','.join(_enabled_platforms())}:{int(redis.get('has_internet'))}"
+
+    def make_key(candidate: str) -> str:
+        mode = "substring" if substring else "similarity"
+        return f"offline:{kind}:{mode}:{generation}:{filters}:{limit}:{candidate}"
+
+    if substring:
+        # Every term is matched as a substring. Thus, the rows of a longer query
+        # are the rows of its prefix that contain all terms, if the prefix had all its rows.
+        cached = suggestion_cache.get_prefixed(make_key, normalized)
+        if cached is not None:
+            prefix, entry = cached
+            if prefix == normalized:
+                suggestion_cache.count("offline_hit", time.perf_counter() - start)
+                return entry["rows"]
+            if entry["complete"]:
+                terms = normalized.split()
+                rows = [
+                    row
+                    for row in entry["rows"]
+                    if all(term in row["haystack"] for term in terms)
+                ]
+                suggestion_cache.put(
+                    make_key(normalized), {"rows": rows, "complete": True}
+                )
+                suggestion_cache.count(
+                    "offline_prefix_hit", time.perf_counter() - start
+                )
+                return rows
+    else:
+        # similarity does not allow to derive results from other queries
+        entry = suggestion_cache.get(make_key(normalized))
+        if entry is not None:
+            suggestion_cache.count("offline_hit", time.perf_counter() - start)
+            return entry["rows"]
+
+    rows, complete = fetch_rows(query, substring)
+    suggestion_cache.put(make_key(normalized), {"rows": rows, "complete": complete})
+    suggestion_cache.count("offline_miss", time.perf_counter() - start)
+    return rows
+
+
+def _playlist_rows(query: str, substring: bool) -> Tuple[List[Dict], bool]:
     terms = query.split()
     remaining_playlists = ArchivedPlaylist.objects.prefetch_related("queries")
     # exclude radios from suggestions
     remaining_playlists = remaining_playlists.exclude(list_id__startswith="RD").exclude(
         list_id__contains="&list=RD"
     )
+    remaining_playlists = _with_first_songs(remaining_playlists).filter(
+        _suggestable_playlists()
+    )
+    playlist_values = ["id", "list_id", "title", "counter", "platform"]
 
-    # we could have more strict types with TypedDicts,
-    # but massaging both QuerySets into a single Type would require asserts/casts,
-    # which have little performance impact but should be avoided in this critical codepath
-    playlist_results: Iterable[Mapping[str, Any]]
-    if settings.DEBUG:
+    limit = storage.get("number_of_suggestions")
+    if substring:
         matching_playlists = remaining_playlists
         for term in terms:
             matching_playlists = matching_playlists.filter(
                 Q(title__icontains=term) | Q(queries__query__icontains=term)
             )
 
-        playlist_results = (
+        rows = list(
             matching_playlists.order_by("-counter")
-            .values("id", "title", "counter")
-            .distinct()[: storage.get("number_of_suggestions")]
+            .values(*playlist_values)
+            .distinct()[:limit]
+        )
+        # the text that was matched against, to filter these rows for longer queries
+        queries: Dict[int, List[str]] = {}
+        for playlist_id, playlist_query in ArchivedPlaylistQuery.objects.filter(
+            playlist_id__in=[row["id"] for row in rows]
+        ).values_list("playlist_id", "query"):
+            queries.setdefault(playlist_id, []).append(playlist_query)
+        for row in rows:
+            row["haystack"] = "\n".join(
+                [row["title"], *queries.get(row["id"], [])]
+            ).lower()
+        return rows, len(rows) < limit
+    if settings.DEBUG:
+        rows = _ranked_rows(
+            lambda count: search_index.search_playlists(query, count),
+            remaining_playlists.values(*playlist_values),
+            "id",
+            limit,
         )
     else:
         from django.contrib.postgres.search import TrigramWordSimilarity
@@ -195,35 +443,25 @@ def _offline_playlist_suggestions(query: str) -> List[SuggestionResult]:
             max_similarity=Greatest("title_similarity", "query_similarity"),
         )
 
-        playlist_results = (
+        rows = list(
             similar_playlists.order_by("-max_similarity")
-            .values("id", "title", "counter")
-            .distinct()[: storage.get("number_of_suggestions")]
+            .values(*playlist_values)
+            .distinct()[:limit]
         )
-    for playlist in playlist_results:
-        archived_playlist = ArchivedPlaylist.objects.get(id=playlist["id"])
-        platform = song_utils.determine_playlist_type(archived_playlist)
+    return rows, False
+
+
+def _offline_playlist_suggestions(query: str) -> List[SuggestionResult]:
+    results: List[SuggestionResult] = []
+    for playlist in _cached_rows("playlists", query, _playlist_rows):
         result_dict: SuggestionResult = {
             "key": playlist["id"],
             "value": playlist["title"],
             "counter": playlist["counter"],
-            "type": platform,
+            "type": "playlog"
+            if playlist["list_id"].startswith("playlog")
+            else playlist["platform"],
         }
-        first_entry = archived_playlist.entries.first()
-        if first_entry and platform == "local":
-            # don't suggest local playlists if their first song is not cached
-            # i.e. not at the expected location
-            try:
-                first_song = ArchivedSong.objects.filter(url=first_entry.url).get()
-                if not first_song.cached:
-                    continue
-            except ArchivedSong.DoesNotExist:
-                continue
-        else:
-            # don't suggest songs if the respective platform is disabled
-            assert platform in ["youtube", "spotify", "soundcloud", "jamendo"]
-            if not storage.get(cast(PlatformEnabled, f"{platform}_enabled")):
-                continue
         results.append(result_dict)
     return results
 
@@ -253,6 +491,7 @@ def _postgres_song_results(query: str) -> List[Dict[str, Union[int, str, float]]
 
     similar_queries = (
         ArchivedQuery.objects.filter(Q(query__trigram_word_similar=query))
+        .filter(_suggestable_songs("song__"))
         .annotate(u_id=F("song__id"))
         .annotate(u_url=F("song__url"))
         .annotate(u_artist=F("song__artist"))
@@ -260,6 +499,7 @@ def _postgres_song_results(query: str) -> List[Dict[str, Union[int, str, float]]
         .annotate(u_duration=F("song__duration"))
         .annotate(u_counter=F("song__counter"))
         .annotate(u_cached=F("song__cached"))
+        .annotate(u_platform=F("song__platform"))
         .annotate(u_query=F("query"))
         .annotate(artist_similarity=TrigramWordSimilarity(query, "u_artist"))
         .annotate(title_similarity=TrigramWordSimilarity(query, "u_title"))
@@ -276,6 +516,7 @@ def _postgres_song_results(query: str) -> List[Dict[str, Union[int, str, float]]
         ArchivedSong.objects.filter(
             Q(artist__trigram_word_similar=query) | Q(title__trigram_word_similar=query)
         )
+        .filter(_suggestable_songs())
         .annotate(u_id=F("id"))
         .annotate(u_url=F("url"))
         .annotate(u_artist=F("artist"))
@@ -283,6 +524,7 @@ def _postgres_song_results(query: str) -> List[Dict[str, Union[int, str, float]]
         .annotate(u_duration=F("duration"))
         .annotate(u_counter=F("counter"))
         .annotate(u_cached=F("cached"))
+        .annotate(u_platform=F("platform"))
         .annotate(u_query=F("queries__query"))
         .annotate(artist_similarity=TrigramWordSimilarity(query, "u_artist"))
         .annotate(title_similarity=TrigramWordSimilarity(query, "u_title"))
@@ -335,14 +577,38 @@ def _postgres_song_results(query: str) -> List[Dict[str, Union[int, str, float]]
     return song_results
 
 
-def _offline_song_suggestions(query: str) -> List[SuggestionResult]:
-    results: List[SuggestionResult] = []
+def _song_values(songs: QuerySet[ArchivedSong]) -> QuerySet:
+    # annotate with same values as in the postgres case to have a consistent interface
+    return songs.annotate(
+        u_id=F("id"),
+        u_url=F("url"),
+        u_artist=F("artist"),
+        u_title=F("title"),
+        u_duration=F("duration"),
+        u_counter=F("counter"),
+        u_cached=F("cached"),
+        u_platform=F("platform"),
+    ).values(*u_values_list)
+
+
+def _indexed_song_results(query: str) -> List[Dict[str, Any]]:
+    # sqlite3 does not have a similarity function, the search index emulates the one of postgres
+    return _ranked_rows(
+        lambda count: search_index.search_songs(query, count),
+        _song_values(ArchivedSong.objects.filter(_suggestable_songs())),
+        "u_id",
+        storage.get("number_of_suggestions"),
+    )
+
+
+def _song_rows(query: str, substring: bool) -> Tuple[List[Dict], bool]:
     terms = query.split()
-    song_results: Iterable[Mapping[str, Any]]
-    if settings.DEBUG:
+    if substring:
         # Testing the whole table whether it contains any term is quite costly.
-        # Used for sqlite3 which does not have a similarity function.
-        matching_songs = ArchivedSong.objects.prefetch_related("queries")
+        # Used for sqlite3 until the search index is built.
+        matching_songs = ArchivedSong.objects.prefetch_related("queries").filter(
+            _suggestable_songs()
+        )
         for term in terms:
             matching_songs = matching_songs.filter(
                 Q(title__icontains=term)
@@ -350,21 +616,20 @@ def _offline_song_suggestions(query: str) -> List[SuggestionResult]:
                 | Q(queries__query__icontains=term)
             )
 
-        song_results = (
-            matching_songs.order_by("-counter")
-            # annotate with same values as in the postgres case to have a consistent interface
-            .annotate(
-                u_id=F("id"),
-                u_url=F("url"),
-                u_artist=F("artist"),
-                u_title=F("title"),
-                u_duration=F("duration"),
-                u_counter=F("counter"),
-                u_cached=F("cached"),
-            )
-            .values(*u_values_list)
-            .distinct()[: storage.get("number_of_suggestions")]
+        limit = storage.get("number_of_suggestions")
+        song_results = list(
+            _song_values(matching_songs.order_by("-counter")).distinct()[:limit]
         )
+        # the text that was matched against, to filter these rows for longer queries
+        queries: Dict[int, List[str]] = {}
+        for song_id, song_query in ArchivedQuery.objects.filter(
+            song_id__in=[song["u_id"] for song in song_results]
+        ).values_list("song_id", "query"):
+            queries.setdefault(song_id, []).append(song_query)
+        for song in song_results:
+            song["haystack"] = "\n".join(
+                [song["u_artist"], song["u_title"], *queries.get(song["u_id"], [])]
+            ).lower()
 
         # Perhaps this could be combined with the similarity search
         # to improve usability with the right weighting.
@@ -379,34 +644,25 @@ def _offline_song_suggestions(query: str) -> List[SuggestionResult]:
 
         # To combine, use union instead of | (or) in order to access the annotated values
         # similar_songs = union(matching_songs)
-    else:
-        song_results = _postgres_song_results(query)
+        return song_results, len(song_results) < limit
+    if settings.DEBUG:
+        return _indexed_song_results(query), False
+    return _postgres_song_results(query), False
 
-    has_internet = redis.get("has_internet")
-    for song in song_results:
-        if song_utils.is_forbidden(song["u_artist"]) or song_utils.is_forbidden(
-            song["u_title"]
-        ):
-            continue
 
-        platform = song_utils.determine_url_type(song["u_url"])
-        # don't suggest online songs when we don't have internet
-        if not has_internet and not song["u_cached"]:
-            continue
-        if platform == "local":
-            # don't suggest local songs if they are not cached (=not at expected location)
-            if not song["u_cached"]:
-                continue
-        else:
-            # don't suggest songs if the respective platform is disabled
-            assert platform in ["youtube", "spotify", "soundcloud", "jamendo"]
-            if not storage.get(cast(PlatformEnabled, f"{platform}_enabled")):
-                continue
+def _offline_song_suggestions(query: str) -> List[SuggestionResult]:
+    results: List[SuggestionResult] = []
+    # the platforms and the internet connection are already considered by the database query
+    songs = song_utils.filter_forbidden(
+        _cached_rows("songs", query, _song_rows),
+        lambda song: (song["u_artist"], song["u_title"]),
+    )
+    for song in songs:
         result_dict: SuggestionResult = {
             "key": song["u_id"],
             "value": song_utils.displayname(song["u_artist"], song["u_title"]),
             "counter": song["u_counter"],
-            "type": platform,
+            "type": song["u_platform"],
             "durationFormatted": song_utils.format_seconds(song["u_duration"]),
         }
         results.append(result_dict)
@@ -434,3 +690,11 @@ def offline_suggestions(request: WSGIRequest) -> JsonResponse:
         results = _offline_song_suggestions(query)
 
     return JsonResponse(results, safe=False)
+
+
+def suggestion_cache_stats(request: WSGIRequest) -> HttpResponse:
+    """Returns the number and average latency of cache hits and misses for suggestions.
+    Only admin is permitted to see this."""
+    if not user_manager.is_admin(request.user):
+        return HttpResponseForbidden()
+    return JsonResponse(suggestion_cache.stats())
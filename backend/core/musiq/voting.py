@@ -0,0 +1,182 @@
+"""This module aggregates votes in redis and writes them to the database in batches."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+
+from core import models, redis
+
+if TYPE_CHECKING:
+    from core.models import QueuedSong
+
+# the current vote count of every song that was voted on, keyed by its queue key
+TOTALS = "vote_totals"
+# vote changes that were not yet written to the database
+DELTAS = "vote_deltas"
+# songs that were already kicked, so concurrent downvotes do not kick them again
+KICKED = "vote_kicked"
+# every song in the queue, scored by its index
+QUEUE = "vote_queue"
+# Ordering by votes scores a song by index - VOTE_WEIGHT * votes.
+# Indices stay below 2**31 in magnitude, so votes always outweigh them,
+# and the scores are exact as long as a song has less than 2**20 votes.
+VOTE_WEIGHT = 2**32
+
+
+def _seed(key: int) -> bool:
+    """Initializes the vote count of the given song from the database.
+    Returns False if the song does not exist."""
+    if redis.connection.zscore(TOTALS, key) is not None:
+        return True
+    votes = (
+        models.QueuedSong.objects.filter(id=key).values_list("votes", flat=True).first()
+    )
+    if votes is None:
+        votes = (
+            models.CurrentSong.objects.filter(queue_key=key)
+            .values_list("votes", flat=True)
+            .first()
+        )
+    if votes is None:
+        return False
+    # if another request seeded this song in the meantime, keep its count
+    redis.connection.zadd(TOTALS, {key: votes}, nx=True)
+    return True
+
+
+def vote(key: int, amount: int) -> Optional[int]:
+    """Changes the vote count of the song specified by :param key: by :param amount:.
+    Returns the new vote count, or None if the song does not exist."""
+    if not _seed(key):
+        return None
+    pipe = redis.connection.pipeline()
+    pipe.zincrby(TOTALS, amount, key)
+    pipe.hincrby(DELTAS, key, amount)
+    total, _ = pipe.execute()
+    return int(total)
+
+
+def claim_kick(key: int) -> bool:
+    """Returns True exactly once for every song, for the caller that should remove it."""
+    return bool(redis.connection.sadd(KICKED, key))
+
+
+def release_kick(key: int) -> None:
+    """Allows the given song to be kicked again, after kicking it failed."""
+    redis.connection.srem(KICKED, key)
+
+
+def track(songs: Iterable[QueuedSong]) -> None:
+    """Stores the index of the given songs in the queue.
+    Songs that were not voted on yet start with their votes from the database.
+    Applied once the current transaction commits."""
+    indices = {song.id: song.index for song in songs}
+    votes = {song.id: song.votes for song in songs}
+    if not indices:
+        return
+
+    def apply() -> None:
+        pipe = redis.connection.pipeline()
+        pipe.zadd(QUEUE, indices)
+        pipe.zadd(TOTALS, votes, nx=True)
+        pipe.execute()
+
+    transaction.on_commit(apply)
+
+
+def untrack(keys: Iterable[int]) -> None:
+    """Removes the given songs from the queue once the current transaction commits.
+    Their votes are kept, because a removed song might become the current song."""
+    keys = list(keys)
+    if keys:
+        transaction.on_commit(lambda: redis.connection.zrem(QUEUE, *keys))
+
+
+def forget(keys: Iterable[int]) -> None:
+    """Removes the votes of the given songs once the current transaction commits.
+    Called when they are neither queued nor playing anymore."""
+    keys = list(keys)
+    if not keys:
+        return
+
+    def apply() -> None:
+        pipe = redis.connection.pipeline()
+        pipe.zrem(TOTALS, *keys)
+        pipe.srem(KICKED, *keys)
+        pipe.execute()
+
+    transaction.on_commit(apply)
+
+
+def sync_queue() -> None:
+    """Replaces the stored queue with the one in the database."""
+    songs = list(models.QueuedSong.objects.values_list("id", "index", "votes"))
+    pipe = redis.connection.pipeline()
+    pipe.delete(QUEUE)
+    if songs:
+        pipe.zadd(QUEUE, {key: index for key, index, _ in songs})
+        pipe.zadd(TOTALS, {key: votes for key, _, votes in songs}, nx=True)
+    pipe.execute()
+
+
+def queue_order(by_votes: bool) -> List[int]:
+    """Returns the keys of all queued songs in their order.
+    If :param by_votes: is set, songs with more votes come first."""
+    if by_votes:
+        keys = redis.connection.zinter({QUEUE: 1, TOTALS: -VOTE_WEIGHT})
+    else:
+        keys = redis.connection.zrange(QUEUE, 0, -1)
+    return [int(key) for key in keys]
+
+
+def totals(keys: Iterable[int]) -> Dict[int, int]:
+    """Returns the current vote counts of the given songs.
+    Songs that were never voted on are missing, their count in the database is up to date."""
+    keys = list(keys)
+    pipe = redis.connection.pipeline(transaction=False)
+    for key in keys:
+        pipe.zscore(TOTALS, key)
+    return {
+        key: int(total) for key, total in zip(keys, pipe.execute()) if total is not None
+    }
+
+
+def flush() -> None:
+    """Writes all pending vote changes to the database, with one statement per table."""
+    pipe = redis.connection.pipeline()
+    pipe.hgetall(DELTAS)
+    pipe.delete(DELTAS)
+    pending, _ = pipe.execute()
+    deltas = {int(key): int(delta) for key, delta in pending.items() if int(delta)}
+    if not deltas:
+        return
+
+    try:
+        with transaction.atomic():
+            models.QueuedSong.objects.filter(id__in=deltas).update(
+                votes=F("votes")
+                + Case(
+                    *(When(id=key, then=Value(delta)) for key, delta in deltas.items()),
+                    default=Value(0),
+                )
+            )
+            models.CurrentSong.objects.filter(queue_key__in=deltas).update(
+                votes=F("votes")
+                + Case(
+                    *(
+                        When(queue_key=key, then=Value(delta))
+                        for key, delta in deltas.items()
+                    ),
+                    default=Value(0),
+                )
+            )
+    except Exception:
+        # keep the changes for the next flush
+        pipe = redis.connection.pipeline()
+        for key, delta in deltas.items():
+            pipe.hincrby(DELTAS, key, delta)
+        pipe.execute()
+        raise
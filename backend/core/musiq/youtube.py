@@ -10,6 +10,8 @@ import logging
 import os
 import pickle
 import subprocess
+import threading
+import time
 import urllib.parse
 from contextlib import contextmanager
 from typing import Any, Dict, Iterator, List, Optional, cast
@@ -20,16 +22,21 @@ import yt_dlp
 from django.conf import settings
 from django.http.response import HttpResponse
 
-from core.musiq import musiq, song_utils
+from core.musiq import downloads, musiq, song_utils
 from core.musiq.playlist_provider import PlaylistProvider
 from core.musiq.song_provider import SongProvider
 from core.settings import storage
 
 
-@contextmanager
-def youtube_session() -> Iterator[requests.Session]:
-    """This context opens a requests session and loads the youtube cookies file."""
+# the cookies of the shared session are written to disk at most this often (in seconds)
+COOKIES_SAVE_INTERVAL = 60.0
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_cookies_saved = 0.0
+
 
+def _create_session() -> requests.Session:
     cookies_path = os.path.join(settings.BASE_DIR, "config/youtube_cookies.pickle")
     session = requests.session()
     # Have yt-dlp deal with consent cookies etc to setup a valid session
@@ -47,10 +54,32 @@ def youtube_session() -> Iterator[requests.Session]:
 
     headers = {"User-Agent": yt_dlp.utils.random_user_agent()}
     session.headers.update(headers)
+    return session
+
+
+@contextmanager
+def youtube_session() -> Iterator[requests.Session]:
+    """This context provides a requests session with the youtube cookies.
+    The session is created once and shared, so its connections are reused."""
+    global _session, _cookies_saved
+
+    with _session_lock:
+        if _session is None:
+            _session = _create_session()
+        session = _session
     yield session
 
-    with open(cookies_path, "wb") as cookies_file:
-        pickle.dump(session.cookies, cookies_file)
+    with _session_lock:
+        if time.monotonic() - _cookies_saved < COOKIES_SAVE_INTERVAL:
+            return
+        _cookies_saved = time.monotonic()
+        # Other threads might still use the session and change its cookies.
+        # The jar holds this lock while it modifies cookies, so the copy is consistent.
+        with session.cookies._cookies_lock:
+            cookies = session.cookies.copy()
+        cookies_path = os.path.join(settings.BASE_DIR, "config/youtube_cookies.pickle")
+        with open(cookies_path, "wb") as cookies_file:
+            pickle.dump(cookies, cookies_file)
 
 
 class YoutubeDLLogger:
@@ -133,11 +162,9 @@ class Youtube:
         suggestions = suggestions[1]
         # suggestions are given as tuples
         # extract the string and skip the query if it occurs identically
-        suggestions = [
-            entry[0]
-            for entry in suggestions
-            if entry[0] != query and not song_utils.is_forbidden(entry[0])
-        ]
+        suggestions = song_utils.filter_forbidden(
+            entry[0] for entry in suggestions if entry[0] != query
+        )
         return suggestions
 
 
@@ -187,12 +214,25 @@ class YoutubeSongProvider(SongProvider, Youtube):
 
         return self.check_not_too_large(self.info_dict["filesize"])
 
+    def download_key(self) -> Optional[str]:
+        if not self.id:
+            return None
+        return f"youtube_{self.id}"
+
     def _download(self) -> bool:
         download_error = None
         location = None
 
+        ydl_opts = self.ydl_opts
+        queue_key = self.queue_key()
+        if queue_key is not None:
+            ydl_opts = {
+                **ydl_opts,
+                "progress_hooks": [downloads.progress_hook(queue_key)],
+            }
+
         try:
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 ydl.download([self.get_external_url()])
 
             location = self.get_path()
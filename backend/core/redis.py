@@ -1,19 +1,22 @@
 """This module provides functionality to interface with Redis."""
-from ast import literal_eval
-from typing import Any, Dict, List, Optional, Tuple, Union, Literal
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union, Literal
 
 from django.conf import settings as conf
 from redis import Redis
 
-from core.util import strtobool
-
 # locks:
 # player_lock:  controlling mopidy api accesses
 # lights_lock:  ensures lights settings are not changed during device updates
+# download_lock_<download key>: ensures a song is only downloaded by one process at a time
+# download_scheduler_lock: ensures every waiting download is started only once
 
 # channels
 # lights_settings_changed
 
+# versioned deltas (see state_handler.publish_delta):
+# <name>_revision, <name>_entries, <name>_delta_lock
+
 DeviceInitialized = Literal
 
 # values:
@@ -38,6 +41,10 @@ defaults = {
     "resolutions": [],
     "current_resolution": (0, 0),
     "current_fps": 0.0,
+    "cava_dropped_frames": 0,
+    "cava_late_frames": 0,
+    # frame timings and overruns of the lights loop
+    "lights_timings": {},
     # settings
     "has_internet": False,
     "youtube_available": False,
@@ -45,14 +52,37 @@ defaults = {
     "soundcloud_available": False,
     "jamendo_available": False,
     "library_scan_progress": "0 / 0 / 0",
+    # identifies the running library watcher, the others stop
+    "library_watcher_id": "",
     "bluetoothctl_active": False,
-    "bluetooth_devices": [],
     # user manager
     "active_requests": 0,
     "last_user_count_update": 0.0,
-    "last_requests": {},
 }
 
+# These keys are stored as redis hashes so single fields can be modified atomically.
+# maps key to the type of its values
+hashes = {
+    # maps the address of each device to its name
+    "bluetooth_devices": str,
+    # maps the queue key of each song that is being downloaded to its progress in percent
+    "download_progress": int,
+    # how often each state was requested to be broadcast and how often it was sent,
+    # as "<state>:requested" and "<state>:sent" (see state_handler.Broadcaster)
+    "state_broadcasts": int,
+}
+
+# sorted sets, accessed through connection:
+# last_requests: the ip of each client, scored by the time of its last request
+
+# downloads (see musiq.downloads): download_pending, download_jobs, download_active
+
+# vote counting (see musiq.voting): vote_totals, vote_deltas, vote_kicked, vote_queue
+
+# suggestion cache (see musiq.suggestion_cache):
+# suggestion_cache:<key>, suggestion_cache_lru, suggestion_cache_generation,
+# suggestion_cache_index_version, suggestion_cache_stats
+
 connection = Redis(host=conf.REDIS_HOST, port=conf.REDIS_PORT, decode_responses=True)
 
 
@@ -61,27 +91,74 @@ def start() -> None:
     connection.flushdb()
 
 
-def get(key: str) -> Union[bool, int, float, str, List, Dict, Tuple]:
-    """This method returns the value for the given :param key: from redis.
-    Vaules of non-existing keys are set to their respective default value."""
-    # values are stored as string in redis
+def _decode(key: str, value: Optional[str]) -> Any:
+    # values are stored as json
     # cast the value to its respective type, defined by the default value, before returning it
     default = defaults[key]
-    value = connection.get(key)
     if value is None:
         return default
-    if type(default) is bool:
-        return strtobool(value)
-    if type(default) in (list, dict, tuple):
-        # evaluate the stored literal
-        return literal_eval(value)
-    return type(default)(value)
+    decoded = json.loads(value)
+    if key == "resolutions":
+        return [tuple(resolution) for resolution in decoded]
+    return type(default)(decoded)
+
+
+def get(key: str) -> Union[bool, int, float, str, List, Dict, Tuple]:
+    """This method returns the value for the given :param key: from redis.
+    Values of non-existing keys are set to their respective default value."""
+    if key in hashes:
+        value_type = hashes[key]
+        return {
+            field: value_type(value) for field, value in connection.hgetall(key).items()
+        }
+    return _decode(key, connection.get(key))
+
+
+def get_many(keys: Iterable[str]) -> Dict[str, Any]:
+    """Returns a dictionary with the values for all given :param keys:.
+    All values are fetched in a single roundtrip."""
+    keys = list(keys)
+    pipe = connection.pipeline(transaction=False)
+    for key in keys:
+        if key in hashes:
+            pipe.hgetall(key)
+        else:
+            pipe.get(key)
+    values = {}
+    for key, value in zip(keys, pipe.execute()):
+        if key in hashes:
+            value_type = hashes[key]
+            values[key] = {field: value_type(val) for field, val in value.items()}
+        else:
+            values[key] = _decode(key, value)
+    return values
 
 
 def put(key: str, value: Any, expire: Optional[float] = None) -> None:
     """This method sets the value for the given :param key: to the given :param value:.
     If set, the key will expire after :param ex: seconds."""
-    connection.set(key, str(value), ex=expire)
+    if key in hashes:
+        pipe = connection.pipeline()
+        pipe.delete(key)
+        if value:
+            pipe.hset(key, mapping=value)
+        if expire is not None:
+            pipe.expire(key, int(expire))
+        pipe.execute()
+        return
+    connection.set(key, json.dumps(value), ex=expire)
+
+
+def put_field(key: str, field: str, value: Any) -> None:
+    """Sets a single :param field: of the hash stored at :param key: to :param value:."""
+    connection.hset(key, field, value)
+
+
+def delete_fields(key: str, fields: Iterable[str]) -> None:
+    """Removes the given :param fields: from the hash stored at :param key:."""
+    fields = list(fields)
+    if fields:
+        connection.hdel(key, *fields)
 
 
 class Event:
@@ -1,4 +1,4 @@
-from typing import Dict, List, Literal, Tuple, overload
+from typing import Any, Dict, Iterable, List, Literal, Tuple, overload
 
 from redis import Redis
 
@@ -9,6 +9,13 @@ DeviceInitialized = Literal[
 connection: Redis
 
 def start() -> None: ...
+def get_many(keys: Iterable[str]) -> Dict[str, Any]: ...
+def put_field(
+    key: Literal["bluetooth_devices", "download_progress"], field: str, value: Any
+) -> None: ...
+def delete_fields(
+    key: Literal["bluetooth_devices", "download_progress"], fields: Iterable[str]
+) -> None: ...
 
 class Event:
     def __init__(self, name: str) -> None: ...
@@ -39,13 +46,15 @@ def get(
     ]
 ) -> bool: ...
 @overload
-def get(key: Literal["active_requests"]) -> int: ...
+def get(
+    key: Literal["active_requests", "cava_dropped_frames", "cava_late_frames"]
+) -> int: ...
 @overload
 def get(
     key: Literal["alarm_duration", "current_fps", "last_user_count_update"]
 ) -> float: ...
 @overload
-def get(key: Literal["library_scan_progress"]) -> str: ...
+def get(key: Literal["library_scan_progress", "library_watcher_id"]) -> str: ...
 @overload
 def get(key: Literal["led_programs", "screen_programs"]) -> List[str]: ...
 @overload
@@ -53,9 +62,11 @@ def get(key: Literal["resolutions"]) -> List[Tuple[int, int]]: ...
 @overload
 def get(key: Literal["current_resolution"]) -> Tuple[int, int]: ...
 @overload
-def get(key: Literal["bluetooth_devices"]) -> List[Dict[str, str]]: ...
+def get(key: Literal["lights_timings"]) -> Dict[str, Any]: ...
 @overload
-def get(key: Literal["last_requests"]) -> Dict[str, float]: ...
+def get(key: Literal["bluetooth_devices"]) -> Dict[str, str]: ...
+@overload
+def get(key: Literal["download_progress", "state_broadcasts"]) -> Dict[str, int]: ...
 @overload
 def put(
     key: Literal[
@@ -80,14 +91,19 @@ def put(
     value: bool,
 ) -> None: ...
 @overload
-def put(key: Literal["active_requests"], value: int) -> None: ...
+def put(
+    key: Literal["active_requests", "cava_dropped_frames", "cava_late_frames"],
+    value: int,
+) -> None: ...
 @overload
 def put(
     key: Literal["alarm_duration", "current_fps", "last_user_count_update"],
     value: float,
 ) -> None: ...
 @overload
-def put(key: Literal["library_scan_progress"], value: str) -> None: ...
+def put(
+    key: Literal["library_scan_progress", "library_watcher_id"], value: str
+) -> None: ...
 @overload
 def put(key: Literal["led_programs", "screen_programs"], value: List[str]) -> None: ...
 @overload
@@ -95,6 +111,10 @@ def put(key: Literal["resolutions"], value: List[Tuple[int, int]]) -> None: ...
 @overload
 def put(key: Literal["current_resolution"], value: Tuple[int, int]) -> None: ...
 @overload
-def put(key: Literal["bluetooth_devices"], value: List[Dict[str, str]]) -> None: ...
+def put(key: Literal["lights_timings"], value: Dict[str, Any]) -> None: ...
+@overload
+def put(key: Literal["bluetooth_devices"], value: Dict[str, str]) -> None: ...
 @overload
-def put(key: Literal["last_requests"], value: Dict[str, float]) -> None: ...
+def put(
+    key: Literal["download_progress", "state_broadcasts"], value: Dict[str, int]
+) -> None: ...
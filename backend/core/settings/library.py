@@ -2,24 +2,49 @@
 
 from __future__ import annotations
 
+import bisect
+import json
 import logging
 import os
 import time
-from typing import Tuple, List
-
+from contextlib import contextmanager
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import billiard
+from django import db
 from django.conf import settings as conf
+from django.db import transaction
+from django.db.models import QuerySet
 from django.core.handlers.wsgi import WSGIRequest
 from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
 from mutagen import MutagenError
 
 from core import redis
 from core.models import ArchivedPlaylist, ArchivedSong, PlaylistEntry
-from core.musiq import song_utils
-from core.settings import settings
+from core.musiq import song_utils, suggestion_cache
+from core.settings import settings, storage
 from core.settings.settings import control
 from core.tasks import app
+from core.util import extract_value, strtobool
+
+if TYPE_CHECKING:
+    from core.musiq.song_utils import Metadata
 
 UPDATE_FREQUENCY = 0.5
+# files are parsed and added in chunks of this size, the progress is saved after each chunk
+CHUNK_SIZE = 500
+# libraries with fewer new files than this are parsed without starting worker processes
+PARALLEL_THRESHOLD = 200
 
 
 def get_library_path() -> str:
@@ -73,56 +98,311 @@ def scan_library(request: WSGIRequest) -> HttpResponse:
     return HttpResponse(f"started scanning in {library_path}. This could take a while")
 
 
-def _count_files(library_path: str) -> int:
+def _checkpoint_path() -> str:
+    return os.path.join(conf.SONGS_CACHE_DIR, "library_scan_checkpoint.json")
+
+
+def _load_checkpoint(library_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_checkpoint_path(), encoding="utf-8") as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (FileNotFoundError, ValueError):
+        return None
+    if checkpoint["library_path"] != library_path:
+        # the checkpoint belongs to the scan of another library
+        return None
+    return checkpoint
+
+
+def _save_checkpoint(checkpoint: Dict[str, Any]) -> None:
+    # replace the file atomically, so an interruption never leaves a partial checkpoint
+    temporary_path = _checkpoint_path() + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(temporary_path, _checkpoint_path())
+
+
+def _remove_checkpoint() -> None:
+    try:
+        os.remove(_checkpoint_path())
+    except FileNotFoundError:
+        pass
+
+
+def start() -> None:
+    """Initializes this module. Resumes a library scan that was interrupted
+    and starts watching the library if enabled."""
+    from core.settings import library_watcher
+
+    library_watcher.start()
+
+    try:
+        with open(_checkpoint_path(), encoding="utf-8") as checkpoint_file:
+            library_path = json.load(checkpoint_file)["library_path"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return
+    if not os.path.isdir(library_path):
+        _remove_checkpoint()
+        return
+    logging.info("resuming the interrupted scan of %s", library_path)
+    _scan_library.delay(library_path)
+
+
+@control
+def set_library_watcher(request: WSGIRequest) -> HttpResponse:
+    """Enables or disables watching the library for changes."""
+    from core.settings import library_watcher
+
+    value, response = extract_value(request.POST)
+    enabled = strtobool(value)
+    storage.put("library_watcher", enabled)
+    if enabled:
+        library_watcher.start()
+    else:
+        library_watcher.stop()
+    return response
+
+
+def fingerprint(stat: os.stat_result) -> str:
+    """Returns a value that changes whenever the file with the given stat is modified."""
+    return f"{stat.st_size}:{stat.st_mtime_ns}:{stat.st_ino}"
+
+
+def find_files(library_path: str, root: str = "") -> Dict[str, str]:
+    """Returns the fingerprints of all files in the library by their paths relative to it.
+    :param root: only the files in this directory of the library are returned."""
     last_update = time.time()
-    filecount = 0
-    for (dirpath, _, filenames) in os.walk(library_path):
+    files: Dict[str, str] = {}
+    directories = [os.path.join(library_path, root)]
+    while directories:
+        directory = directories.pop()
         now = time.time()
-        if now - last_update > UPDATE_FREQUENCY:
+        if not root and now - last_update > UPDATE_FREQUENCY:
+            # only scans of the whole library report their progress
             last_update = now
-            _set_scan_progress(f"{filecount} / 0 / 0")
-        if os.path.abspath(dirpath) == os.path.abspath(conf.SONGS_CACHE_DIR):
+            _set_scan_progress(f"{len(files)} / 0 / 0")
+        if os.path.abspath(directory) == os.path.abspath(conf.SONGS_CACHE_DIR):
             # do not add files handled by raveberry as local files
             continue
-        filecount += len(filenames)
-    _set_scan_progress(f"{filecount} / 0 / 0")
-    return filecount
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            # like os.walk, symlinks to directories are not followed
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.path)
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                # e.g. a broken symlink
+                continue
+            files[entry.path[len(library_path) + 1 :]] = fingerprint(stat)
+    return files
 
 
-def _scan_files(library_path: str, filecount: int) -> Tuple[int, int]:
-    last_update = time.time()
-    files_scanned = 0
-    files_added = 0
-    for (dirpath, _, filenames) in os.walk(library_path):
-        if os.path.abspath(dirpath) == os.path.abspath(conf.SONGS_CACHE_DIR):
-            # do not add files handled by raveberry as local files
+def _read_metadata(path: str) -> Optional[Metadata]:
+    # executed in the worker processes of the scan
+    try:
+        return song_utils.get_metadata(path)
+    except (ValueError, MutagenError):
+        # the given file could not be parsed and will not be added to the database
+        return None
+
+
+@contextmanager
+def _metadata_reader(files: int) -> Iterator[Callable[[List[str]], Iterable]]:
+    # Yields a function that reads the metadata of the files at the given paths.
+    # Parsing is cpu bound, so large libraries are parsed by a pool of processes.
+    if files < PARALLEL_THRESHOLD or (os.cpu_count() or 1) == 1:
+        yield lambda paths: map(_read_metadata, paths)
+        return
+    # the forked processes must not share the connection to the database
+    db.connections.close_all()
+    # Scans run in celery workers, which are daemonic processes.
+    # Unlike multiprocessing, billiard allows these to start processes.
+    with billiard.get_context("fork").Pool() as pool:
+        yield lambda paths: pool.map(_read_metadata, paths, chunksize=16)
+
+
+# maps the url of every known local song to its id, fingerprint and whether it is cached
+KnownSongs = Dict[str, Tuple[int, str, bool]]
+
+
+def load_known_songs(songs: QuerySet[ArchivedSong]) -> KnownSongs:
+    """Returns the id, fingerprint and cached flag of the given songs by their urls."""
+    return {
+        url: (song_id, fingerprint, cached)
+        for song_id, url, fingerprint, cached in songs.values_list(
+            "id", "url", "fingerprint", "cached"
+        )
+    }
+
+
+def _needs_parsing(path: str, files: Dict[str, str], known_songs: KnownSongs) -> bool:
+    # whether the file at the given path is new or changed since it was last scanned
+    known_song = known_songs.get(os.path.join("local_library", path))
+    return known_song is None or known_song[1] != files[path]
+
+
+def _sync_chunk(
+    library_path: str,
+    paths: List[str],
+    files: Dict[str, str],
+    known_songs: KnownSongs,
+    read_metadata: Callable[[List[str]], Iterable],
+) -> Tuple[int, int]:
+    # Synchronizes the songs of the files at the given paths with the database.
+    # Only new files and files whose fingerprint changed are parsed.
+    # Returns the number of added and updated songs.
+    parsed_paths = [path for path in paths if _needs_parsing(path, files, known_songs)]
+    # songs whose file is unchanged, but was missing during the last scan
+    restored_ids = []
+    for path in paths:
+        known_song = known_songs.get(os.path.join("local_library", path))
+        if known_song and known_song[1] == files[path] and not known_song[2]:
+            restored_ids.append(known_song[0])
+
+    new_songs = []
+    # the ids of songs whose file changed with their new values
+    updates: List[Tuple[int, Dict[str, Any]]] = []
+    for path, metadata in zip(
+        parsed_paths,
+        read_metadata([os.path.join(library_path, path) for path in parsed_paths]),
+    ):
+        external_url = os.path.join("local_library", path)
+        known_song = known_songs.get(external_url)
+        if metadata is None:
+            if known_song:
+                # the file was replaced by one that can not be played
+                updates.append(
+                    (known_song[0], {"cached": False, "fingerprint": files[path]})
+                )
             continue
-        now = time.time()
-        if now - last_update > UPDATE_FREQUENCY:
-            last_update = now
-            _set_scan_progress(f"{filecount} / {files_scanned} / {files_added}")
-        for filename in filenames:
-            files_scanned += 1
-            path = os.path.join(dirpath, filename)
-            try:
-                metadata = song_utils.get_metadata(path)
-            except (ValueError, MutagenError):
-                # the given file could not be parsed and will not be added to the database
-                pass
-            else:
-                library_relative_path = path[len(library_path) + 1 :]
-                external_url = os.path.join("local_library", library_relative_path)
-                if not ArchivedSong.objects.filter(url=external_url).exists():
-                    files_added += 1
-                    ArchivedSong.objects.create(
-                        url=external_url,
-                        artist=metadata["artist"],
-                        title=metadata["title"],
-                        duration=metadata["duration"],
-                        counter=0,
-                        cached=metadata["cached"],
-                    )
-    return files_scanned, files_added
+        values = {
+            "artist": metadata["artist"],
+            "title": metadata["title"],
+            "duration": metadata["duration"],
+            "cached": metadata["cached"],
+            "fingerprint": files[path],
+        }
+        if known_song:
+            updates.append((known_song[0], values))
+        else:
+            new_songs.append(
+                ArchivedSong(
+                    url=external_url,
+                    # bulk_create does not call save, which determines the platform
+                    platform="local",
+                    counter=0,
+                    **values,
+                )
+            )
+
+    with transaction.atomic():
+        ArchivedSong.objects.bulk_create(new_songs, ignore_conflicts=True)
+        # single updates in one transaction are faster than bulk_update,
+        # whose case expressions grow with the number of rows
+        for song_id, values in updates:
+            ArchivedSong.objects.filter(id=song_id).update(**values)
+        ArchivedSong.objects.filter(id__in=restored_ids).update(cached=True)
+    if new_songs or updates or restored_ids:
+        # make the changes searchable while the scan continues
+        suggestion_cache.invalidate_offline(
+            modified=any("title" in values for _, values in updates)
+        )
+    return len(new_songs), len(updates) + len(restored_ids)
+
+
+def _remove_missing(files: Dict[str, str], known_songs: KnownSongs) -> int:
+    # Marks the given songs whose files were not found as not cached.
+    # They stay in the database, e.g. for their play logs, but are not suggested anymore.
+    # Returns the number of removed songs.
+    removed_urls = [
+        url
+        for url, (_, _, cached) in known_songs.items()
+        if cached and url[len("local_library/") :] not in files
+    ]
+    for chunk_start in range(0, len(removed_urls), CHUNK_SIZE):
+        ArchivedSong.objects.filter(
+            url__in=removed_urls[chunk_start : chunk_start + CHUNK_SIZE]
+        ).update(cached=False)
+    if removed_urls:
+        suggestion_cache.invalidate_offline()
+    return len(removed_urls)
+
+
+def sync_files(
+    library_path: str, files: Dict[str, str], known_songs: KnownSongs
+) -> Tuple[int, int, int]:
+    """Synchronizes the given songs with the given files of the library.
+    Returns the number of added, updated and removed songs."""
+    added = updated = 0
+    paths = sorted(files)
+    parsed_files = sum(_needs_parsing(path, files, known_songs) for path in paths)
+    with _metadata_reader(parsed_files) as read_metadata:
+        for chunk_start in range(0, len(paths), CHUNK_SIZE):
+            chunk_added, chunk_updated = _sync_chunk(
+                library_path,
+                paths[chunk_start : chunk_start + CHUNK_SIZE],
+                files,
+                known_songs,
+                read_metadata,
+            )
+            added += chunk_added
+            updated += chunk_updated
+    return added, updated, _remove_missing(files, known_songs)
+
+
+def _scan_files(
+    library_path: str, files: Dict[str, str], checkpoint: Dict[str, Any]
+) -> None:
+    # Synchronizes the local songs in the database with the given files.
+    # The progress is stored in the given checkpoint after every chunk of files.
+    last_update = time.time()
+    scan_start = last_update
+    resumed_files = checkpoint["files_scanned"]
+
+    def report() -> None:
+        rate = (checkpoint["files_scanned"] - resumed_files) / max(
+            time.time() - scan_start, 1e-3
+        )
+        _set_scan_progress(
+            f"{len(files)} / {checkpoint['files_scanned']} / {checkpoint['files_added']}"
+            f" ({checkpoint['files_updated']} updated, "
+            f"{checkpoint['files_removed']} removed, {rate:.0f} files/s)"
+        )
+
+    # load all known songs at once instead of querying them for every file
+    known_songs = load_known_songs(
+        ArchivedSong.objects.filter(url__startswith="local_library/")
+    )
+
+    # the files of an interrupted scan up to its checkpoint were already handled
+    remaining = sorted(path for path in files if path > checkpoint["last_path"])
+    parsed_files = sum(_needs_parsing(path, files, known_songs) for path in remaining)
+
+    with _metadata_reader(parsed_files) as read_metadata:
+        for chunk_start in range(0, len(remaining), CHUNK_SIZE):
+            chunk = remaining[chunk_start : chunk_start + CHUNK_SIZE]
+            added, updated = _sync_chunk(
+                library_path, chunk, files, known_songs, read_metadata
+            )
+
+            checkpoint["files_scanned"] += len(chunk)
+            checkpoint["files_added"] += added
+            checkpoint["files_updated"] += updated
+            checkpoint["last_path"] = chunk[-1]
+            _save_checkpoint(checkpoint)
+
+            now = time.time()
+            if now - last_update > UPDATE_FREQUENCY:
+                last_update = now
+                report()
+
+    checkpoint["files_removed"] = _remove_missing(files, known_songs)
+    report()
 
 
 @app.task
@@ -134,16 +414,146 @@ def _scan_library(library_path: str) -> None:
         pass
     os.symlink(library_path, library_link)
 
-    filecount = _count_files(library_path)
+    files = find_files(library_path)
+    _set_scan_progress(f"{len(files)} / 0 / 0")
+
+    checkpoint = _load_checkpoint(library_path)
+    if checkpoint is None:
+        checkpoint = {
+            "library_path": library_path,
+            "last_path": "",
+            "files_scanned": 0,
+            "files_added": 0,
+            "files_updated": 0,
+            "files_removed": 0,
+        }
+        logging.info("started scanning in %s", library_path)
+    else:
+        logging.info(
+            "resumed scanning in %s after %s", library_path, checkpoint["last_path"]
+        )
 
-    logging.info("started scanning in %s", library_path)
+    try:
+        _scan_files(library_path, files, checkpoint)
+    finally:
+        # Only a scan whose process was killed is resumed.
+        # A scan that failed would fail again every time raveberry starts.
+        _remove_checkpoint()
+
+    from core.settings import library_watcher
+
+    # the library might have changed, watch the new one
+    library_watcher.start()
+
+    logging.info(
+        "done scanning in %s: %d added, %d updated, %d removed",
+        library_path,
+        checkpoint["files_added"],
+        checkpoint["files_updated"],
+        checkpoint["files_removed"],
+    )
+
+
+def sync_playlists(
+    library_path: str,
+    folders: Optional[Iterable[str]] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Tuple[int, int]:
+    """Updates the playlists of the given folders, relative to the library.
+    The playlist of every folder contains the cached songs in it and all its subfolders.
+    :param folders: defaults to every folder containing songs.
+    :param progress: called with the number of processed songs and written entries
+    after every folder.
+    Returns the number of changed playlists and the number of their entries."""
+    # unfortunately there is no way to access track numbers across different file types
+    # so we have to add songs to playlists alphabetically.
+    # Comparing the components of the urls orders them like a depth first traversal
+    # that visits the entries of every folder sorted by their names.
+    # Thus, the songs of every folder are a contiguous range of the sorted urls.
+    urls = sorted(
+        tuple(url.split("/"))
+        for url in ArchivedSong.objects.filter(
+            url__startswith="local_library/", cached=True
+        ).values_list("url", flat=True)
+    )
+
+    if folders is None:
+        folders = {""}
+        for url in urls:
+            # all folders containing the song, without the local_library prefix
+            for depth in range(2, len(url)):
+                folders.add("/".join(url[1:depth]))
+
+    playlist_ids = {
+        folder: os.path.join("local_library", folder) for folder in set(folders)
+    }
+    playlists = {
+        playlist.list_id: playlist
+        for playlist in ArchivedPlaylist.objects.filter(
+            list_id__in=playlist_ids.values()
+        )
+    }
+    entries: Dict[int, List[str]] = {playlist.id: [] for playlist in playlists.values()}
+    for playlist_id, url in (
+        PlaylistEntry.objects.filter(playlist__in=playlists.values())
+        .order_by("index")
+        .values_list("playlist_id", "url")
+    ):
+        entries[playlist_id].append(url)
+
+    changed_playlists = 0
+    changed_entries = 0
+    songs_processed = 0
+    for folder, playlist_id in sorted(playlist_ids.items()):
+        prefix = ("local_library",) + tuple(filter(None, folder.split("/")))
+        # the first url after the ones starting with the prefix
+        end = prefix[:-1] + (prefix[-1] + "\0",)
+        song_urls = [
+            "/".join(url)
+            for url in urls[
+                bisect.bisect_left(urls, prefix) : bisect.bisect_left(urls, end)
+            ]
+        ]
+        # every song is counted once, in the folder it is located in
+        songs_processed += sum(
+            1 for url in song_urls if os.path.dirname(url) == playlist_id.rstrip("/")
+        )
+        if progress:
+            progress(songs_processed, changed_entries)
 
-    files_scanned, files_added = _scan_files(library_path, filecount)
+        playlist = playlists.get(playlist_id)
+        if playlist is None:
+            if not song_urls:
+                continue
+            title = os.path.basename(
+                os.path.normpath(os.path.join(library_path, folder))
+            )
+            playlist = ArchivedPlaylist(list_id=playlist_id, title=title, counter=0)
+        elif entries[playlist.id] == song_urls:
+            continue
 
-    assert files_scanned == filecount
-    _set_scan_progress(f"{filecount} / {files_scanned} / {files_added}")
+        with transaction.atomic():
+            if playlist.id is None:
+                playlist.save()
+            else:
+                # empty playlists are kept for their counter and queries,
+                # they are not suggested
+                playlist.entries.all().delete()
+            PlaylistEntry.objects.bulk_create(
+                [
+                    # bulk_create does not call save, which determines the platform
+                    PlaylistEntry(
+                        playlist=playlist, index=index, url=url, platform="local"
+                    )
+                    for index, url in enumerate(song_urls)
+                ]
+            )
+        changed_playlists += 1
+        changed_entries += len(song_urls)
 
-    logging.info("done scanning in %s", library_path)
+    if changed_playlists:
+        suggestion_cache.invalidate_offline()
+    return changed_playlists, changed_entries
 
 
 @control
@@ -171,56 +581,26 @@ def _create_playlists() -> None:
 
     _set_scan_progress(f"{local_files} / 0 / 0")
 
-    scan_start = time.time()
-    last_update = scan_start
+    last_update = time.time()
     files_processed = 0
     files_added = 0
 
-    def _scan_folder(dirpath: str) -> List[str]:
+    def report(songs_processed: int, entries_written: int) -> None:
         nonlocal last_update, files_processed, files_added
+        files_processed = songs_processed
+        files_added = entries_written
         now = time.time()
         if now - last_update > UPDATE_FREQUENCY:
             last_update = now
             _set_scan_progress(f"{local_files} / {files_processed} / {files_added}")
 
-        song_urls = []
-        # unfortunately there is no way to access track numbers across different file types
-        # so we have to add songs to playlists alphabetically
-        for filename in sorted(os.listdir(dirpath)):
-            path = os.path.join(dirpath, filename)
-
-            if os.path.isdir(path):
-                song_urls.extend(_scan_folder(path))
-                continue
-
-            library_relative_path = path[len(library_path) + 1 :]
-            external_url = os.path.join("local_library", library_relative_path)
-            if ArchivedSong.objects.filter(url=external_url).exists():
-                files_processed += 1
-                song_urls.append(external_url)
-
-        if not song_urls:
-            return []
-
-        playlist_id = os.path.join("local_library", dirpath[len(library_path) + 1 :])
-        playlist_title = os.path.split(dirpath)[1]
-        playlist, created = ArchivedPlaylist.objects.get_or_create(
-            list_id=playlist_id, title=playlist_title, counter=0
-        )
-        if not created:
-            # this playlist already exists, skip
-            return song_urls
-
-        song_index = 0
-        for external_url in song_urls:
-            PlaylistEntry.objects.create(
-                playlist=playlist, index=song_index, url=external_url
-            )
-            files_added += 1
-            song_index += 1
-
-        return song_urls
-
-    _scan_folder(library_path)
+    # existing playlists are updated as well, e.g. after songs were added to a folder
+    changed_playlists, files_added = sync_playlists(library_path, progress=report)
 
     _set_scan_progress(f"{local_files} / {files_processed} / {files_added}")
+    logging.info(
+        "done creating playlists in %s: %d changed, %d entries",
+        library_path,
+        changed_playlists,
+        files_added,
+    )
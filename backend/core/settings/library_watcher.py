@@ -0,0 +1,295 @@
+"""This module watches the local library for changes and applies them to the database,
+so new music can be found without scanning the library."""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+import uuid
+from typing import Dict, Iterable, List, Set, Tuple
+
+from django import db
+from django.db.models import Q
+
+from core import redis
+from core.models import ArchivedSong
+from core.settings import library, storage
+from core.tasks import app
+
+# changes are applied after no file changed for this many seconds,
+# so copying an album causes a single update
+DEBOUNCE = 2.0
+# changes are applied after this many seconds, even if files keep changing
+MAX_DELAY = 10.0
+
+# the events of inotify(7) that are used
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCHED_EVENTS = (
+    IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+
+# wd, mask, cookie and length of the name that follows
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """A minimal binding of the inotify api of linux.
+    Implemented with ctypes, so no additional dependency is required."""
+
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """Watches the directory at the given path for the given events.
+        Returns the watch descriptor that identifies the directory in events."""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        """Stops watching the directory with the given watch descriptor."""
+        # fails if the directory was already deleted, which also removes the watch
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout: float) -> List[Tuple[int, int, str]]:
+        """Waits at most :param timeout: seconds for events and returns them.
+        Every event consists of its watch descriptor, mask and file name."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self) -> None:
+        """Stops watching all directories."""
+        os.close(self.fd)
+
+
+def _ancestors(path: str) -> Iterable[str]:
+    # all folders containing the given path, relative to the library
+    while path:
+        path = os.path.dirname(path)
+        yield path
+
+
+class _Watcher:
+    """Collects the changes in the library and applies them."""
+
+    def __init__(self, library_path: str) -> None:
+        self.library_path = library_path
+        self.inotify = Inotify()
+        # the directory of every watch descriptor, relative to the library
+        self.directories: Dict[int, str] = {}
+        # files that were created, modified or removed
+        self.changed_files: Set[str] = set()
+        # directories that were created or removed, including everything in them
+        self.changed_directories: Set[str] = set()
+        # whether events were lost, which requires a full scan
+        self.overflow = False
+
+    def watch(self, directory: str) -> None:
+        """Watches the given directory and all its subdirectories."""
+        for dirpath, _, _ in os.walk(os.path.join(self.library_path, directory)):
+            try:
+                wd = self.inotify.add_watch(dirpath, WATCHED_EVENTS | IN_ONLYDIR)
+            except OSError as error:
+                if error.errno == errno.ENOSPC:
+                    logging.warning(
+                        "could not watch %s, increase fs.inotify.max_user_watches",
+                        dirpath,
+                    )
+                    return
+                # the directory was removed in the meantime
+                continue
+            self.directories[wd] = dirpath[len(self.library_path) + 1 :]
+
+    def unwatch(self, directory: str) -> None:
+        """Stops watching the given directory and all its subdirectories."""
+        for wd, path in list(self.directories.items()):
+            if path == directory or path.startswith(directory + "/"):
+                self.inotify.rm_watch(wd)
+                del self.directories[wd]
+
+    def handle(self, wd: int, mask: int, name: str) -> None:
+        """Records the change described by the given event."""
+        if mask & IN_Q_OVERFLOW:
+            self.overflow = True
+            return
+        if mask & IN_IGNORED:
+            # the directory was removed
+            self.directories.pop(wd, None)
+            return
+        if wd not in self.directories:
+            return
+        path = os.path.join(self.directories[wd], name)
+        if mask & IN_ISDIR:
+            if mask & (IN_MOVED_FROM | IN_DELETE):
+                # directories moved out of the library would still be watched
+                self.unwatch(path)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.watch(path)
+            self.changed_directories.add(path)
+        else:
+            self.changed_files.add(path)
+
+    @property
+    def changed(self) -> bool:
+        """Whether there are changes that were not applied yet."""
+        return bool(self.changed_files or self.changed_directories or self.overflow)
+
+    def apply(self) -> None:
+        """Applies all recorded changes to the songs and playlists in the database.
+        If this fails, the whole library is scanned the next time."""
+        try:
+            self._apply()
+        except Exception:
+            # the changes were already taken from the recorded ones
+            self.overflow = True
+            raise
+
+    def _apply(self) -> None:
+        if self.overflow:
+            logging.warning("missed changes in the library, scanning it")
+            self.overflow = False
+            self.changed_files.clear()
+            self.changed_directories.clear()
+            files = library.find_files(self.library_path)
+            library.sync_files(
+                self.library_path,
+                files,
+                library.load_known_songs(
+                    ArchivedSong.objects.filter(url__startswith="local_library/")
+                ),
+            )
+            folders = {""}
+            for path in files:
+                folders.update(_ancestors(path))
+            library.sync_playlists(self.library_path, folders)
+            return
+
+        changed_files = self.changed_files
+        changed_directories = self.changed_directories
+        self.changed_files = set()
+        self.changed_directories = set()
+
+        files: Dict[str, str] = {}
+        for path in changed_files:
+            try:
+                stat = os.stat(os.path.join(self.library_path, path))
+            except OSError:
+                # the file was removed
+                continue
+            files[path] = library.fingerprint(stat)
+        for directory in changed_directories:
+            files.update(library.find_files(self.library_path, directory))
+
+        songs = Q(
+            url__in=[os.path.join("local_library", path) for path in changed_files]
+        )
+        for directory in changed_directories:
+            songs |= Q(url__startswith=os.path.join("local_library", directory, ""))
+        known_songs = library.load_known_songs(ArchivedSong.objects.filter(songs))
+
+        added, updated, removed = library.sync_files(
+            self.library_path, files, known_songs
+        )
+
+        # the playlists of all folders that contain changed files
+        folders: Set[str] = set(changed_directories)
+        for path in [
+            *changed_files,
+            *changed_directories,
+            *files,
+            *(url[len("local_library/") :] for url in known_songs),
+        ]:
+            folders.update(_ancestors(path))
+        playlists, _ = library.sync_playlists(self.library_path, folders)
+        logging.info(
+            "applied changes in the library: %d added, %d updated, %d removed, "
+            "%d playlists changed",
+            added,
+            updated,
+            removed,
+            playlists,
+        )
+
+
+@app.task
+def _watch(library_path: str, watcher_id: str) -> None:
+    watcher = _Watcher(library_path)
+    try:
+        watcher.watch("")
+        logging.info(
+            "watching %d directories in %s", len(watcher.directories), library_path
+        )
+        first_change = last_change = 0.0
+        # another watcher replaces this one when the library changes
+        while redis.get("library_watcher_id") == watcher_id:
+            events = watcher.inotify.read(timeout=1)
+            for event in events:
+                watcher.handle(*event)
+            now = time.time()
+            if events:
+                if not first_change:
+                    first_change = now
+                last_change = now
+            if watcher.changed and (
+                now - last_change > DEBOUNCE or now - first_change > MAX_DELAY
+            ):
+                # this task runs forever, make sure its connection is still usable
+                db.close_old_connections()
+                try:
+                    watcher.apply()
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception("could not apply changes in the library")
+                first_change = last_change = 0.0
+    finally:
+        watcher.inotify.close()
+
+
+def start() -> None:
+    """Starts watching the library if enabled.
+    Replaces the watcher of a previous library."""
+    library_link = library.get_library_path()
+    if not storage.get("library_watcher") or not os.path.islink(library_link):
+        return
+    watcher_id = uuid.uuid4().hex
+    redis.put("library_watcher_id", watcher_id)
+    _watch.delay(os.path.realpath(library_link), watcher_id)
+
+
+def stop() -> None:
+    """Stops watching the library."""
+    redis.put("library_watcher_id", "")
@@ -16,9 +16,9 @@ from django.core.handlers.wsgi import WSGIRequest
 from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
 
-from core import base, redis, tasks, user_manager
-from core.settings.storage import get
-from core.state_handler import send_state
+from core import base, redis, state_handler, tasks, user_manager, util
+from core.settings import storage
+from core.state_handler import request_update
 
 
 def control(
@@ -83,60 +83,85 @@ def state_dict() -> Dict[str, Any]:
     """Extends the base state with settings-specific information and returns it."""
     state = base.state_dict()
 
-    settings_state: Dict[str, Any] = {}
-    settings_state["interactivity"] = get("interactivity")
-    settings_state["ipChecking"] = get("ip_checking")
-    settings_state["downvotesToKick"] = get("downvotes_to_kick")
-    settings_state["loggingEnabled"] = get("logging_enabled")
-    settings_state["hashtagsActive"] = get("hashtags_active")
-    settings_state["privilegedStream"] = get("privileged_stream")
-    settings_state["onlineSuggestions"] = get("online_suggestions")
-    settings_state["numberOfSuggestions"] = get("number_of_suggestions")
-    settings_state["connectivityHost"] = get("connectivity_host")
-    settings_state["hasInternet"] = redis.get("has_internet")
-    settings_state["newMusicOnly"] = get("new_music_only")
-    settings_state["enqueueFirst"] = get("enqueue_first")
-    settings_state["songCooldown"] = get("song_cooldown")
-    settings_state["maxDownloadSize"] = get("max_download_size")
-    settings_state["maxPlaylistItems"] = get("max_playlist_items")
-    settings_state["maxQueueLength"] = get("max_queue_length")
-    settings_state["additionalKeywords"] = get("additional_keywords")
-    settings_state["forbiddenKeywords"] = get("forbidden_keywords")
-    settings_state["peopleToParty"] = get("people_to_party")
-    settings_state["alarmProbability"] = get("alarm_probability")
-    settings_state["buzzerCooldown"] = get("buzzer_cooldown")
-    settings_state["buzzerSuccessProbability"] = get("buzzer_success_probability")
-
-    settings_state["youtubeEnabled"] = get("youtube_enabled")
-    settings_state["youtubeSuggestions"] = get("youtube_suggestions")
-
-    settings_state["spotifyEnabled"] = get("spotify_enabled")
-    settings_state["spotifySuggestions"] = get("spotify_suggestions")
-
-    settings_state["soundcloudEnabled"] = get("soundcloud_enabled")
-    settings_state["soundcloudSuggestions"] = get("soundcloud_suggestions")
-
-    settings_state["jamendoEnabled"] = get("jamendo_enabled")
-    settings_state["jamendoSuggestions"] = get("jamendo_suggestions")
-
-    settings_state["backupStream"] = get("backup_stream")
-
-    settings_state["bluetoothScanning"] = redis.get("bluetoothctl_active")
-    settings_state["bluetoothDevices"] = redis.get("bluetooth_devices")
-
-    settings_state["feedCava"] = get("feed_cava")
-    settings_state["output"] = get("output")
+    # all settings are fetched at once, their names in the state are camelized
+    settings_state: Dict[str, Any] = util.camelize(
+        storage.get_many(
+            [
+                "interactivity",
+                "ip_checking",
+                "downvotes_to_kick",
+                "logging_enabled",
+                "hashtags_active",
+                "privileged_stream",
+                "online_suggestions",
+                "number_of_suggestions",
+                "connectivity_host",
+                "new_music_only",
+                "enqueue_first",
+                "song_cooldown",
+                "max_download_size",
+                "max_playlist_items",
+                "max_queue_length",
+                "additional_keywords",
+                "forbidden_keywords",
+                "people_to_party",
+                "alarm_probability",
+                "buzzer_cooldown",
+                "buzzer_success_probability",
+                "youtube_enabled",
+                "youtube_suggestions",
+                "spotify_enabled",
+                "spotify_suggestions",
+                "soundcloud_enabled",
+                "soundcloud_suggestions",
+                "jamendo_enabled",
+                "jamendo_suggestions",
+                "backup_stream",
+                "feed_cava",
+                "output",
+                "library_watcher",
+            ]
+        )
+    )
+    values = redis.get_many(
+        [
+            "has_internet",
+            "bluetoothctl_active",
+            "bluetooth_devices",
+            "library_scan_progress",
+            "youtube_available",
+            "spotify_available",
+            "soundcloud_available",
+            "jamendo_available",
+        ]
+    )
+    settings_state["hasInternet"] = values["has_internet"]
+
+    settings_state["bluetoothScanning"] = values["bluetoothctl_active"]
+    settings_state["bluetoothDevices"] = [
+        {"address": address, "name": name}
+        for address, name in values["bluetooth_devices"].items()
+    ]
 
     _add_homewifi_state(settings_state)
 
-    settings_state["scanProgress"] = redis.get("library_scan_progress")
+    settings_state["scanProgress"] = values["library_scan_progress"]
+
+    # how many of the requested state updates were coalesced into broadcasts
+    settings_state["stateBroadcasts"] = (
+        ", ".join(
+            f"{name} {counters['requested']} / {counters['sent']}"
+            for name, counters in sorted(state_handler.broadcaster.counters().items())
+        )
+        or "-"
+    )
 
     _add_system_install_state(settings_state)
 
-    settings_state["youtubeConfigured"] = redis.get("youtube_available")
-    settings_state["spotifyConfigured"] = redis.get("spotify_available")
-    settings_state["soundcloudConfigured"] = redis.get("soundcloud_available")
-    settings_state["jamendoConfigured"] = redis.get("jamendo_available")
+    settings_state["youtubeConfigured"] = values["youtube_available"]
+    settings_state["spotifyConfigured"] = values["spotify_available"]
+    settings_state["soundcloudConfigured"] = values["soundcloud_available"]
+    settings_state["jamendoConfigured"] = values["jamendo_available"]
 
     state["settings"] = settings_state
     return state
@@ -160,5 +185,6 @@ def index(request: WSGIRequest) -> HttpResponse:
 
 
 def update_state() -> None:
-    """Sends an update event to all connected clients."""
-    send_state(state_dict())
+    """Sends an update event to all connected clients.
+    Updates requested in quick succession are sent only once."""
+    request_update("settings", state_dict)
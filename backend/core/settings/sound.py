@@ -22,7 +22,7 @@ from core.tasks import app
 # we need to release the lock(=kill the process) in a different request than the one that started it
 # this made using the lock complicated, and only one admin should be using the page at once anyway
 
-# bluetooth_devices: List[Dict[str, str]] = []
+# bluetooth_devices: Dict[str, str] = {}  # maps address to name
 
 
 @control
@@ -61,7 +61,7 @@ def _stop_bluetoothctl(bluetoothctl: subprocess.Popen) -> None:
 @app.task
 def _scan_bluetooth() -> None:
     bluetoothctl = _start_bluetoothctl()
-    redis.put("bluetooth_devices", [])
+    redis.put("bluetooth_devices", {})
     assert bluetoothctl and bluetoothctl.stdin
 
     bluetoothctl.stdin.write(b"devices\n")
@@ -84,9 +84,7 @@ def _scan_bluetooth() -> None:
             # devices named after their address are no speakers
             if re.match("[A-Z0-9][A-Z0-9](-[A-Z0-9][A-Z0-9]){5}", name):
                 continue
-            bluetooth_devices = redis.get("bluetooth_devices")
-            bluetooth_devices.append({"address": address, "name": name})
-            redis.put("bluetooth_devices", bluetooth_devices)
+            redis.put_field("bluetooth_devices", address, name)
             settings.update_state()
 
 
@@ -1,10 +1,14 @@
 """This module provides methods to access database settings."""
+import logging
+import threading
+import time
 from ast import literal_eval
-from typing import Union, Literal
+from typing import Dict, Iterable, Optional, Union, Literal
 
-from cachetools import TTLCache, cached
+from django.db import transaction
+from redis.exceptions import RedisError
 
-from core import models
+from core import models, redis
 from core.util import strtobool
 
 
@@ -23,6 +27,8 @@ DeviceBrightness = Literal
 DeviceMonochrome = Literal
 DeviceProgram = Literal
 
+Value = Union[bool, int, float, str, tuple]
+
 # maps key to default and type of value
 defaults = {
     # basic settings
@@ -47,6 +53,8 @@ defaults = {
     "alarm_probability": 0.0,
     "buzzer_cooldown": 1.0,
     "buzzer_success_probability": -1.0,
+    # library
+    "library_watcher": False,
     # platforms
     "local_enabled": True,
     "youtube_enabled": True,
@@ -75,11 +83,15 @@ defaults = {
     "autoplay": False,
     # lights
     "ups": 30.0,
+    # the ups are lowered if more frames than this take longer than 1/ups
+    "max_overrun_rate": 0.25,
     "fixed_color": (0.0, 0.0, 0.0),
     "program_speed": 0.5,
     "wled_led_count": 10,
     "wled_ip": "",
     "wled_port": 21324,
+    "wled_protocol": "DNRGB",
+    "wled_targets": "",
     # the concise, but not much shorter version:
     # **{
     #    k: v
@@ -115,28 +127,91 @@ defaults = {
     "dynamic_resolution": False,
 }
 
-# Settings change very rarely, cache them to reduce database roundtrips.
+# Settings change very rarely, so each process caches them in memory without expiry.
 # This is especially advantageous for suggestions which check whether platforms are enabled.
-# There is a data inconsistency issue when a setting is changed in one process.
-# Only that process would flush its cache, others would retain the stale value.
-# This could be fixed by communicating the cache flush through redis.
-# However, with the daphne setup there is currently only one process handling requests,
-# and settings are never changed outside a request (especially not in a celery worker).
-# So this is fine as long as no additional daphne (or other) workers are used.
-# The lights flushes the cache in its update function.
-cache: TTLCache = TTLCache(ttl=10, maxsize=128)
-
-
-@cached(cache)
-def get(key: str) -> Union[bool, int, float, str, tuple]:
-    """This method returns the value for the given :param key:.
-    Values of non-existing keys are set to their respective default value."""
+# To keep the caches of all processes (daphne, celery workers, the lights worker) consistent,
+# every put announces the changed key on a redis channel.
+# A thread in each process listens on this channel and evicts the key from its cache.
+# Values are only cached while this thread is subscribed, so no change can be missed.
+cache: Dict[str, Value] = {}
+CHANNEL = "settings_changed"
+_cache_lock = threading.Lock()
+# incremented on every eviction,
+# so values that were read before a concurrent change are not cached afterwards
+_generation = 0
+_subscribed = False
+_listener: Optional[threading.Thread] = None
+
+
+def _listen() -> None:
+    global _subscribed
+    while True:
+        pubsub = redis.connection.pubsub()
+        try:
+            pubsub.subscribe(CHANNEL)
+            for message in pubsub.listen():
+                if message["type"] == "subscribe":
+                    # redis-py also subscribes again after reconnecting on its own,
+                    # changes announced in between were missed
+                    clear_cache()
+                    with _cache_lock:
+                        _subscribed = True
+                elif message["type"] == "message":
+                    evict(message["data"])
+        except RedisError:
+            if _subscribed:
+                logging.warning("lost connection to settings channel, disabling cache")
+        except Exception:  # pylint: disable=broad-except
+            # keep listening, otherwise changes could not be evicted anymore
+            logging.exception("error in settings channel, disabling cache")
+        finally:
+            # even if this thread ends, no value is served from the cache anymore
+            with _cache_lock:
+                _subscribed = False
+            clear_cache()
+            pubsub.close()
+        time.sleep(1)
+
+
+def _ensure_listener() -> int:
+    """Makes sure this process listens for changed settings.
+    Returns the current generation of the cache."""
+    global _listener
+    with _cache_lock:
+        # the thread is started lazily,
+        # so it also exists in processes that were forked after importing this module
+        if _listener is None or not _listener.is_alive():
+            _listener = threading.Thread(target=_listen, daemon=True)
+            _listener.start()
+        return _generation
+
+
+def _store(key: str, value: Value, generation: int) -> None:
+    with _cache_lock:
+        if _subscribed and generation == _generation:
+            cache[key] = value
+
+
+def evict(key: str) -> None:
+    """Removes the given key from the cache of this process."""
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        cache.pop(key, None)
+
+
+def clear_cache() -> None:
+    """Removes all keys from the cache of this process."""
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        cache.clear()
+
+
+def _parse(key: str, value: str) -> Value:
     # values are stored as string in the database
     # cast the value to its respective type, defined by the default value, before returning it
     default = defaults[key]
-    value = models.Setting.objects.get_or_create(
-        key=key, defaults={"value": str(default)}
-    )[0].value
     if type(default) is str:
         return str(value)
     if type(default) is int:
@@ -151,7 +226,57 @@ def get(key: str) -> Union[bool, int, float, str, tuple]:
     raise ValueError(f"{key} not defined")
 
 
-def put(key: str, value: Union[bool, int, float, str, tuple]) -> None:
+def get(key: str) -> Value:
+    """This method returns the value for the given :param key:.
+    Values of non-existing keys are set to their respective default value."""
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+    generation = _ensure_listener()
+    default = defaults[key]
+    setting = models.Setting.objects.get_or_create(
+        key=key, defaults={"value": str(default)}
+    )[0]
+    value = _parse(key, setting.value)
+    _store(key, value, generation)
+    return value
+
+
+def get_many(keys: Iterable[str]) -> Dict[str, Value]:
+    """Returns a dictionary with the values for all given :param keys:.
+    Uncached values are fetched with a single query,
+    non-existing keys are set to their respective default value."""
+    values = {}
+    missing = []
+    for key in keys:
+        try:
+            values[key] = cache[key]
+        except KeyError:
+            missing.append(key)
+    if not missing:
+        return values
+
+    generation = _ensure_listener()
+    stored = dict(
+        models.Setting.objects.filter(key__in=missing).values_list("key", "value")
+    )
+    new_settings = [
+        models.Setting(key=key, value=str(defaults[key]))
+        for key in missing
+        if key not in stored
+    ]
+    models.Setting.objects.bulk_create(new_settings, ignore_conflicts=True)
+    for setting in new_settings:
+        stored[setting.key] = setting.value
+
+    for key in missing:
+        values[key] = _parse(key, stored[key])
+        _store(key, values[key], generation)
+    return values
+
+
+def put(key: str, value: Value) -> None:
     """This method sets the :param value: for the given :param key:."""
     default = defaults[key]
     setting = models.Setting.objects.get_or_create(
@@ -159,4 +284,7 @@ def put(key: str, value: Union[bool, int, float, str, tuple]) -> None:
     )[0]
     setting.value = str(value)
     setting.save()
-    cache.clear()
+    evict(key)
+    # other processes must not read the old value after evicting it,
+    # so only announce the change once it is visible to them
+    transaction.on_commit(lambda: redis.connection.publish(CHANNEL, key))
@@ -1,6 +1,4 @@
-from typing import Literal, overload
-
-from cachetools import TTLCache
+from typing import Any, Dict, Iterable, Literal, Union, overload
 
 # Sometimes the storage functions are accessed dynamically.
 # Comfort mypy by telling it the value will still be one of the specified ones.
@@ -37,8 +35,14 @@ DeviceProgram = Literal[
     "last_screen_program",
 ]
 
-cache: TTLCache = TTLCache(ttl=10, maxsize=128)
+Value = Union[bool, int, float, str, tuple]
+
+cache: Dict[str, Value]
+CHANNEL: str
 
+def evict(key: str) -> None: ...
+def clear_cache() -> None: ...
+def get_many(keys: Iterable[str]) -> Dict[str, Any]: ...
 @overload
 def get(
     key: Literal[
@@ -54,6 +58,7 @@ def get(
         "spotify_enabled",
         "soundcloud_enabled",
         "jamendo_enabled",
+        "library_watcher",
         "feed_cava",
         "paused",
         "shuffle",
@@ -92,6 +97,7 @@ def get(
         "buzzer_success_probability",
         "volume",
         "ups",
+        "max_overrun_rate",
         "program_speed",
         "ring_brightness",
         "strip_brightness",
@@ -115,6 +121,8 @@ def get(
         "output",
         "backup_stream",
         "wled_ip",
+        "wled_protocol",
+        "wled_targets",
         "ring_program",
         "last_ring_program",
         "strip_program",
@@ -144,6 +152,7 @@ def put(
         "spotify_enabled",
         "soundcloud_enabled",
         "jamendo_enabled",
+        "library_watcher",
         "feed_cava",
         "paused",
         "shuffle",
@@ -184,6 +193,7 @@ def put(
         "buzzer_success_probability",
         "volume",
         "ups",
+        "max_overrun_rate",
         "program_speed",
         "ring_brightness",
         "strip_brightness",
@@ -208,6 +218,8 @@ def put(
         "output",
         "backup_stream",
         "wled_ip",
+        "wled_protocol",
+        "wled_targets",
         "ring_program",
         "last_ring_program",
         "strip_program",
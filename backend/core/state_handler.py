@@ -1,21 +1,167 @@
 """This module handles realtime communication via websockets."""
 import json
-from typing import Any, Dict
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from asgiref.sync import async_to_sync
 from channels.generic.websocket import WebsocketConsumer
 from channels.layers import get_channel_layer
+from django import db
+from django.conf import settings as conf
 from django.core.handlers.wsgi import WSGIRequest
 from django.http import JsonResponse
 
+from core import redis
+
 
 def send_state(state: Dict[str, Any]) -> None:
     """Sends the given dictionary as a state update to all connected clients."""
-    data = {"type": "state_update", "state": state}
+    # serialize once here instead of once for every connected client
+    data = {"type": "state_update", "text": json.dumps(state)}
     channel_layer = get_channel_layer()
     async_to_sync(channel_layer.group_send)("state", data)
 
 
+class Broadcaster:
+    """Coalesces update requests for each kind of state.
+    The first request for a state schedules its broadcast after the given window.
+    Further requests until then are merged into this broadcast.
+    The state is built right before it is sent, in a separate thread,
+    so it contains every change that led to one of the merged requests.
+    How often each state was requested and sent is counted in redis,
+    summed over all processes."""
+
+    def __init__(self, window: float) -> None:
+        self.window = window
+        # maps the name of each scheduled state to its deadline and build function
+        self._scheduled: Dict[str, Tuple[float, Callable[[], Dict[str, Any]]]] = {}
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def request(self, name: str, build: Callable[[], Dict[str, Any]]) -> None:
+        """Schedules a broadcast of the state with the given name,
+        unless one is already scheduled."""
+        redis.connection.hincrby("state_broadcasts", f"{name}:requested")
+        with self._condition:
+            if name in self._scheduled:
+                return
+            self._scheduled[name] = (time.monotonic() + self.window, build)
+            # the thread is started lazily,
+            # so it also exists in processes that were forked after importing this module
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    @staticmethod
+    def counters() -> Dict[str, Dict[str, int]]:
+        """Returns the number of requested and sent updates for each state."""
+        counters: Dict[str, Dict[str, int]] = {}
+        for field, count in redis.get("state_broadcasts").items():
+            name, _, counter = field.rpartition(":")
+            counters.setdefault(name, {"requested": 0, "sent": 0})[counter] = count
+        return counters
+
+    def _next_due(self) -> Tuple[str, Callable[[], Dict[str, Any]]]:
+        with self._condition:
+            while True:
+                if not self._scheduled:
+                    self._condition.wait()
+                    continue
+                name, (deadline, build) = min(
+                    self._scheduled.items(), key=lambda item: item[1][0]
+                )
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                # requests from now on schedule a new broadcast,
+                # because this one might be built before their change
+                del self._scheduled[name]
+                return name, build
+
+    def _run(self) -> None:
+        while True:
+            name, build = self._next_due()
+            try:
+                send_state(build())
+                redis.connection.hincrby("state_broadcasts", f"{name}:sent")
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("could not broadcast %s state", name)
+            finally:
+                # this thread lives longer than any request,
+                # so django does not clean up its connection
+                db.close_old_connections()
+
+
+broadcaster = Broadcaster(conf.STATE_BROADCAST_WINDOW)
+
+
+def request_update(name: str, build: Callable[[], Dict[str, Any]]) -> None:
+    """Requests a broadcast of the state built by the given function.
+    Requests for the same name are coalesced, see Broadcaster."""
+    broadcaster.request(name, build)
+
+
+def snapshot(name: str) -> Optional[Tuple[int, List[Dict[str, Any]]]]:
+    """Returns the revision of the most recently published delta for the given list
+    together with the entries it resulted in, in their order.
+    Both are read in one transaction, so every later delta applies to these entries.
+    Returns None if no delta was published yet."""
+    pipe = redis.connection.pipeline(transaction=True)
+    pipe.get(f"{name}_revision")
+    pipe.get(f"{name}_order")
+    pipe.hgetall(f"{name}_entries")
+    revision, order, entries = pipe.execute()
+    if order is None:
+        return None
+    return int(revision), [json.loads(entries[str(id)]) for id in json.loads(order)]
+
+
+def publish_delta(
+    name: str, build: Callable[[], List[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """Compares the entries returned by :param build: to the ones
+    that were published last under the given name. Every entry needs a unique "id".
+    The entries are built while no other process publishes under this name,
+    so a later revision never contains older entries.
+    Stores the new entries as the latest revision and returns the difference,
+    consisting of the new order of ids, all changed or inserted entries and all removed ids.
+    Clients apply a delta only if they are at its base revision
+    and request a full state otherwise."""
+    # Deltas can be computed in every process that updates the state,
+    # so the previous entries are stored in redis, serialized and keyed by their id.
+    # Together with their order they are the snapshot that full states are built from.
+    entries_key = f"{name}_entries"
+    with redis.connection.lock(f"{name}_delta_lock"):
+        entries = build()
+        serialized = {
+            str(entry["id"]): json.dumps(entry, sort_keys=True) for entry in entries
+        }
+        previous = redis.connection.hgetall(entries_key)
+        pipe = redis.connection.pipeline()
+        pipe.delete(entries_key)
+        if serialized:
+            pipe.hset(entries_key, mapping=serialized)
+        pipe.set(f"{name}_order", json.dumps([entry["id"] for entry in entries]))
+        pipe.incr(f"{name}_revision")
+        revision = pipe.execute()[-1]
+
+    return {
+        "base": revision - 1,
+        "revision": revision,
+        "order": [entry["id"] for entry in entries],
+        "changed": [
+            entry
+            for entry in entries
+            if previous.get(str(entry["id"])) != serialized[str(entry["id"])]
+        ],
+        "removed": [int(key) for key in previous if key not in serialized],
+    }
+
+
 def get_state(_request: WSGIRequest, module) -> JsonResponse:
     """Calls the get_state function of the given module and returns its result."""
     state = module.state_dict()
@@ -37,4 +183,4 @@ class StateConsumer(WebsocketConsumer):
 
     def state_update(self, event: Dict[str, Any]):
         """Receives a message from the room group and sends it back to the websocket."""
-        self.send(text_data=json.dumps(event["state"]))
+        self.send(text_data=event["text"])
@@ -27,13 +27,9 @@ def is_admin(user) -> bool:
 
 
 def update_user_count() -> None:
-    """Go through all recent requests and delete those that were too long ago."""
+    """Delete all users whose last request was too long ago."""
     now = time.time()
-    last_requests = redis.get("last_requests")
-    for key, value in list(last_requests.items()):
-        if now - value >= INACTIVITY_PERIOD:
-            del last_requests[key]
-            redis.put("last_requests", last_requests)
+    redis.connection.zremrangebyscore("last_requests", "-inf", now - INACTIVITY_PERIOD)
     redis.put("last_user_count_update", now)
 
 
@@ -42,13 +38,13 @@ def get_count() -> int:
     Updates this number after an intervals since the last update."""
     if time.time() - redis.get("last_user_count_update") >= 60:
         update_user_count()
-    return len(redis.get("last_requests"))
+    return redis.connection.zcard("last_requests")
 
 
 def partymode_enabled() -> bool:
     """Determines whether partymode is enabled,
     based on the number of currently active users."""
-    return len(redis.get("last_requests")) >= storage.get("people_to_party")
+    return redis.connection.zcard("last_requests") >= storage.get("people_to_party")
 
 
 def get_client_ip(request: WSGIRequest):
@@ -104,22 +100,17 @@ def tracked(
             request.session.save()
 
         request_ip = get_client_ip(request)
-        last_requests = redis.get("last_requests")
-        last_requests[request_ip] = time.time()
-        redis.put("last_requests", last_requests)
+        redis.connection.zadd("last_requests", {request_ip: time.time()})
 
-        def check():
-            active = redis.get("active_requests")
+        def check(active: int) -> None:
             if active > 0:
                 leds.enable_act_led()
             else:
                 leds.disable_act_led()
 
-        redis.connection.incr("active_requests")
-        check()
+        check(redis.connection.incr("active_requests"))
         response = func(request)
-        redis.connection.decr("active_requests")
-        check()
+        check(redis.connection.decr("active_requests"))
 
         return response
 
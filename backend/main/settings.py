@@ -169,6 +169,7 @@ CELERY_IMPORTS = [
     "core.musiq.playback",
     "core.musiq.music_provider",
     "core.settings.library",
+    "core.settings.library_watcher",
     "core.settings.sound",
 ]
 CELERY_TASK_SERIALIZER = "pickle"
@@ -177,6 +178,13 @@ if TESTING:
     CELERY_ALWAYS_EAGER = True
     CELERY_EAGER_PROPAGATES_EXCEPTIONS = True
 
+# Update requests for the same state within this many seconds result in a single broadcast
+STATE_BROADCAST_WINDOW = float(os.environ.get("STATE_BROADCAST_WINDOW", "0.075"))
+# How many songs are downloaded in parallel
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "3"))
+# Online suggestions of a platform that take longer than this many seconds are sent separately
+SUGGESTION_DEADLINE = float(os.environ.get("SUGGESTION_DEADLINE", "0.5"))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
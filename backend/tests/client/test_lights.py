@@ -1,17 +1,24 @@
 # add attributes to mock object
 # type: ignore[assignment]
 import colorsys
+import io
 import json
+import os
+import socket
 import time
-from threading import Thread
-from typing import Iterable, Tuple
-from unittest.mock import Mock
+from threading import Event, Thread
+from typing import Any, Iterable, List, Tuple
+from unittest.mock import Mock, patch
 
+import numpy as np
 from django.db import connection
 from django.urls import reverse
 
 from core import redis
+from core.lights import programs, scheduler, wled
+from core.lights.output import Output
 from core.lights.worker import DeviceManager
+from core.settings import storage
 from tests.raveberry_test import RaveberryTest
 
 
@@ -50,20 +57,24 @@ class LedTests(RaveberryTest):
 
         super().tearDown()
 
+    def _assert_ring_colors(self, color: Tuple[float, float, float]) -> None:
+        # the colors are passed as an array with one row per led
+        (colors,), _ = self.set_ring_colors.call_args
+        self.assertEqual(
+            colors.tolist(),
+            [list(color) for _ in range(self.manager.devices.ring.LED_COUNT)],
+        )
+
     def test_fixed(self) -> None:
         self.client.post(reverse("set-ring-program"), {"value": "Fixed"})
         self.client.post(reverse("set-strip-program"), {"value": "Fixed"})
         time.sleep(0.5)
-        self.set_ring_colors.assert_called_with(
-            list((0, 0, 0) for _ in range(self.manager.devices.ring.LED_COUNT))
-        )
+        self._assert_ring_colors((0, 0, 0))
         self.set_strip_color.assert_called_with((0, 0, 0))
         self.client.post(reverse("set-fixed-color"), {"value": "#abcdef"})
         time.sleep(0.5)
         color = tuple(val / 255 for val in (0xAB, 0xCD, 0xEF))
-        self.set_ring_colors.assert_called_with(
-            list(color for _ in range(self.manager.devices.ring.LED_COUNT))
-        )
+        self._assert_ring_colors(color)
         self.set_strip_color.assert_called_with(color)
 
     def _assert_all_hues(self, colors: Iterable[Tuple[float, float, float]]) -> None:
@@ -106,3 +117,293 @@ class LedTests(RaveberryTest):
         state = json.loads(self.client.get(reverse("lights-state")).content)
         self.assertEqual(state["lights"]["ringProgram"], "Fixed")
         self.assertEqual(state["lights"]["stripProgram"], "Rainbow")
+
+
+class WledTests(RaveberryTest):
+    def setUp(self) -> None:
+        super().setUp()
+        self.wled = wled.WLED(Mock())
+        self.wled.brightness = 1.0
+        # receives the packets instead of a WLED instance
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.bind(("127.0.0.1", 0))
+        self.receiver.settimeout(1)
+        self.wled.targets = [
+            wled.Target("127.0.0.1", self.receiver.getsockname()[1], 0, 65535)
+        ]
+
+    def tearDown(self) -> None:
+        self.receiver.close()
+        self.wled.socket.close()
+        super().tearDown()
+
+    def _receive(self, count: int) -> List[bytes]:
+        return [self.receiver.recv(2048) for _ in range(count)]
+
+    def test_parse_targets(self) -> None:
+        self.assertEqual(
+            wled.parse_targets("192.168.1.2:21324@0-299, 192.168.1.3,", 4048),
+            [
+                wled.Target("192.168.1.2", 21324, 0, 299),
+                wled.Target("192.168.1.3", 4048, 0, 65535),
+            ],
+        )
+        self.assertEqual(
+            wled.parse_targets("192.168.1.2@300", 21324),
+            [wled.Target("192.168.1.2", 21324, 300, 300)],
+        )
+        self.assertEqual(wled.parse_targets("", 21324), [])
+        for value in [
+            "192.168.1.256",
+            "wled.local",
+            "192.168.1.2:0",
+            "192.168.1.2:port",
+            "192.168.1.2@-5",
+            "192.168.1.2@300-299",
+            "192.168.1.2@0-all",
+        ]:
+            with self.assertRaises(ValueError, msg=value):
+                wled.parse_targets(value, 21324)
+
+    def test_ddp_port(self) -> None:
+        storage.put("wled_targets", "192.168.1.2")
+        storage.put("wled_protocol", "DDP")
+        self.wled.load_settings()
+        self.assertEqual(self.wled.targets[0].port, wled.DDP_PORT)
+        storage.put("wled_protocol", "DNRGB")
+        self.wled.load_settings()
+        self.assertEqual(self.wled.targets[0].port, storage.get("wled_port"))
+
+    def test_dnrgb_packets(self) -> None:
+        colors = np.random.rand(600, 3)
+        frame = wled.color_bytes(colors, 1.0)
+        self.wled.protocol = "DNRGB"
+        self.wled.set_colors(colors)
+        first, second = self._receive(2)
+        self.assertEqual(first[:4], bytes([wled.DNRGB, wled.DNRGB_TIMEOUT, 0, 0]))
+        self.assertEqual(first[4:], frame[: 489 * 3])
+        # the second packet starts at led 489
+        self.assertEqual(second[:4], bytes([wled.DNRGB, wled.DNRGB_TIMEOUT, 1, 233]))
+        self.assertEqual(second[4:], frame[489 * 3 :])
+
+    def test_ddp_packets(self) -> None:
+        colors = np.random.rand(1000, 3)
+        frame = wled.color_bytes(colors, 1.0)
+        self.wled.protocol = "DDP"
+        # only the leds of the target are sent
+        self.wled.targets = [self.wled.targets[0]._replace(first=100, last=1099)]
+        self.wled.set_colors(np.concatenate([np.zeros((100, 3)), colors]))
+        packets = self._receive(3)
+        received = b""
+        for index, packet in enumerate(packets):
+            flags, sequence, data_type, _ = packet[:4]
+            offset = int.from_bytes(packet[4:8], "big")
+            length = int.from_bytes(packet[8:10], "big")
+            # only the last packet displays the frame
+            self.assertEqual(flags & wled.DDP_PUSH, index == len(packets) - 1)
+            self.assertEqual(sequence, self.wled.sequence)
+            self.assertEqual(data_type, wled.DDP_TYPE_RGB24)
+            self.assertEqual(offset, len(received))
+            self.assertEqual(length, len(packet) - 10)
+            received += packet[10:]
+        self.assertEqual(received, frame)
+
+
+class CavaTests(RaveberryTest):
+    def setUp(self) -> None:
+        super().setUp()
+        self.cava = programs.Cava(Mock())
+        self.cava.consumers = 1
+        # a pipe replaces the fifo cava writes into
+        read_fd, self.write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        self.cava.cava_fifo = io.FileIO(read_fd, "rb")
+
+    def tearDown(self) -> None:
+        self.cava.cava_fifo.close()
+        os.close(self.write_fd)
+        super().tearDown()
+
+    def _write_frames(self, values: Iterable[int]) -> None:
+        for value in values:
+            os.write(self.write_fd, bytes([value]) * self.cava.frame_length)
+
+    def test_dropped_frames(self) -> None:
+        self._write_frames([1, 2, 3])
+        self.cava.compute()
+        # only the newest frame is used
+        self.assertEqual(list(self.cava.current_frame), [3] * programs.Cava.BARS)
+        self.assertEqual(self.cava.dropped_frames, 2)
+        self.assertEqual(self.cava.late_frames, 0)
+        self.assertEqual(redis.get("cava_dropped_frames"), 2)
+
+    def test_late_frames(self) -> None:
+        self.cava.compute()
+        # silence until the first frame arrives
+        self.assertEqual(list(self.cava.current_frame), [0] * programs.Cava.BARS)
+        self.assertEqual(self.cava.late_frames, 1)
+
+        # an incomplete frame is kept for the next update
+        half = self.cava.frame_length // 2
+        os.write(self.write_fd, bytes([4]) * half)
+        self.cava.compute()
+        self.assertEqual(self.cava.late_frames, 2)
+        os.write(self.write_fd, bytes([4]) * (self.cava.frame_length - half))
+        self.cava.compute()
+        self.assertEqual(list(self.cava.current_frame), [4] * programs.Cava.BARS)
+        self.assertEqual(self.cava.late_frames, 2)
+        self.assertEqual(self.cava.dropped_frames, 0)
+
+    def test_wrap_around(self) -> None:
+        # fill the ring up to its last frame
+        self._write_frames([1] * (programs.Cava.RING_FRAMES - 1))
+        self.cava.compute()
+        self.assertEqual(
+            self.cava.ring_position,
+            (programs.Cava.RING_FRAMES - 1) * self.cava.frame_length,
+        )
+
+        # the second frame continues at the start of the ring
+        self._write_frames([2, 3])
+        self.cava.compute()
+        self.assertEqual(self.cava.ring_position, self.cava.frame_length)
+        self.assertEqual(list(self.cava.current_frame), [3] * programs.Cava.BARS)
+        self.assertEqual(self.cava.dropped_frames, programs.Cava.RING_FRAMES - 1)
+
+        # a read that ends exactly at the end of the ring wraps around as well
+        self._write_frames([5] * (programs.Cava.RING_FRAMES - 1))
+        self.cava.compute()
+        self.assertEqual(self.cava.ring_position, 0)
+        self.assertEqual(list(self.cava.current_frame), [5] * programs.Cava.BARS)
+
+
+class ScriptedClock:
+    """Replaces the time module of the scheduler, sleeping only advances the clock."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class SchedulerTests(RaveberryTest):
+    def setUp(self) -> None:
+        super().setUp()
+        self.clock = ScriptedClock()
+        patcher = patch.object(scheduler, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scheduler = scheduler.FrameScheduler(100, 0.1)
+
+    def _run_frames(self, count: int, duration: float) -> None:
+        for _ in range(count):
+            self.scheduler.start_frame()
+            self.clock.now += duration
+            self.scheduler.wait()
+
+    def test_adapt(self) -> None:
+        # frames of 15ms do not fit into the 10ms of 100 ups
+        self._run_frames(scheduler.WINDOW // 4 - 1, 0.015)
+        self.scheduler.adapt()
+        # not enough frames to decide yet
+        self.assertEqual(self.scheduler.ups, 100)
+        self._run_frames(1, 0.015)
+        self.scheduler.adapt()
+        self.assertAlmostEqual(self.scheduler.ups, 80)
+        self.assertTrue(self.scheduler.degraded)
+
+        # 12.5ms are still too short
+        self._run_frames(scheduler.WINDOW // 4, 0.015)
+        self.scheduler.adapt()
+        self.assertAlmostEqual(self.scheduler.ups, 64)
+        # frames that fit into the 15.6ms keep the ups
+        self._run_frames(scheduler.WINDOW // 4, 0.012)
+        self.scheduler.adapt()
+        self.assertAlmostEqual(self.scheduler.ups, 64)
+        # only the first frames overrun while catching up with the cadence
+        self.assertLess(self.scheduler.stats()["overrun_rate"], 0.1)
+
+        # faster frames raise the ups only once the slow ones left the window
+        self._run_frames(scheduler.WINDOW // 2, 0.005)
+        self.scheduler.adapt()
+        self.assertAlmostEqual(self.scheduler.ups, 64)
+        self._run_frames(scheduler.WINDOW // 2, 0.005)
+        self.scheduler.adapt()
+        self.assertAlmostEqual(self.scheduler.ups, 80)
+        self.assertTrue(self.scheduler.degraded)
+
+        # the ups are restored, but never raised above the configured ones
+        self._run_frames(scheduler.WINDOW // 4, 0.005)
+        self.scheduler.adapt()
+        self.assertAlmostEqual(self.scheduler.ups, 100)
+        self.assertFalse(self.scheduler.degraded)
+        self._run_frames(scheduler.WINDOW // 4, 0.005)
+        self.scheduler.adapt()
+        self.assertAlmostEqual(self.scheduler.ups, 100)
+
+    def test_minimum_ups(self) -> None:
+        for _ in range(20):
+            self._run_frames(scheduler.WINDOW // 4, 1)
+            self.scheduler.adapt()
+        self.assertEqual(self.scheduler.ups, scheduler.MIN_UPS)
+        self.assertTrue(self.scheduler.degraded)
+
+
+class BlockingDevice:
+    """A device whose sends block until they are released."""
+
+    def __init__(self) -> None:
+        self.name = "blocking"
+        self.sending = Event()
+        self.release = Event()
+        self.calls: List[Any] = []
+
+    def send(self, frame: Any) -> None:
+        self.calls.append(frame)
+        self.sending.set()
+        self.release.wait(timeout=5)
+
+    def clear(self) -> None:
+        self.calls.append("clear")
+
+
+class OutputTests(RaveberryTest):
+    def setUp(self) -> None:
+        super().setUp()
+        self.device = BlockingDevice()
+        self.output = Output(self.device)
+
+    def tearDown(self) -> None:
+        self.device.release.set()
+        self.output.stop()
+        super().tearDown()
+
+    def test_stale_frames(self) -> None:
+        self.output.publish(1)
+        self.assertTrue(self.device.sending.wait(timeout=1))
+        # while the first frame is sent, only the newest one is kept
+        self.output.publish(2)
+        self.output.publish(3)
+        self.device.release.set()
+        time.sleep(0.1)
+        self.assertEqual(self.device.calls, [1, 3])
+        self.assertEqual(self.output.stats()["dropped"], 1)
+
+    def test_clear_after_send(self) -> None:
+        self.output.publish(1)
+        self.assertTrue(self.device.sending.wait(timeout=1))
+        self.output.publish(2)
+        clear = Thread(target=self.output.clear)
+        clear.start()
+        time.sleep(0.1)
+        # the device is not cleared while a frame is sent
+        self.assertEqual(self.device.calls, [1])
+        self.device.release.set()
+        clear.join(timeout=1)
+        time.sleep(0.1)
+        # the waiting frame is dropped instead of being shown after the clear
+        self.assertEqual(self.device.calls, [1, "clear"])
@@ -1,7 +1,25 @@
 import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+from unittest.mock import patch
 
+import billiard
+from django.conf import settings as conf
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from core import redis
+from core.models import ArchivedPlaylist, ArchivedSong, PlaylistEntry
+from core.musiq import search_index, suggestion_cache, suggestions
+from core.settings import library, library_watcher, storage
+from tests import util
 from tests.music_test import MusicTest
 
 
@@ -27,6 +45,269 @@ class LocaldriveTests(MusicTest):
         self.assertEqual(current_song["artist"], "Kevin MacLeod")
         self.assertEqual(current_song["title"], "Backbeat")
 
+    def test_rescan(self) -> None:
+        test_library = os.path.join(conf.TEST_CACHE_DIR, "test_library")
+        self.client.post(reverse("scan-library"), {"library_path": test_library})
+        # no file changed since the scan in setUp
+        self._poll_state(
+            "settings-state",
+            lambda state: " ".join(
+                state["settings"]["scanProgress"].split()
+            ).startswith("5 / 5 / 0 (0 updated, 0 removed"),
+        )
+
+    def _interrupt_scan(self) -> str:
+        # pretends that a scan was interrupted after the songs in the heroes folder
+        test_library = os.path.join(conf.TEST_CACHE_DIR, "test_library")
+        ArchivedSong.objects.filter(url__startswith="local_library/").delete()
+        library._save_checkpoint(
+            {
+                "library_path": test_library,
+                "last_path": "heroes/New Hero in Town.mp3",
+                "files_scanned": 2,
+                "files_added": 2,
+                "files_updated": 0,
+                "files_removed": 0,
+            }
+        )
+        return test_library
+
+    def test_resumed_scan(self) -> None:
+        self._interrupt_scan()
+        library.start()
+        self.assertEqual(
+            sorted(
+                ArchivedSong.objects.filter(
+                    url__startswith="local_library/"
+                ).values_list("url", flat=True)
+            ),
+            [
+                "local_library/other/Backbeat.mp3",
+                "local_library/other/Forest Frolic Loop.mp3",
+                "local_library/other/Village Tarantella.mp3",
+            ],
+        )
+        self.assertTrue(
+            " ".join(redis.get("library_scan_progress").split()).startswith(
+                "5 / 5 / 5 (0 updated, 0 removed"
+            )
+        )
+        self.assertFalse(os.path.exists(library._checkpoint_path()))
+
+    def test_parallel_metadata(self) -> None:
+        test_library = os.path.join(conf.TEST_CACHE_DIR, "test_library")
+        paths = [
+            os.path.join(test_library, path)
+            for path in library.find_files(test_library, "other")
+        ]
+        # scans run in celery workers, which are daemonic processes
+        process = multiprocessing.current_process()
+        process.daemon = True
+        try:
+            # take the parallel path on machines with a single core as well
+            with patch.object(os, "cpu_count", return_value=2):
+                with library._metadata_reader(
+                    library.PARALLEL_THRESHOLD
+                ) as read_metadata:
+                    self.assertTrue(billiard.active_children())
+                    metadata = list(read_metadata(paths))
+        finally:
+            process.daemon = False
+        self.assertEqual(metadata, [library._read_metadata(path) for path in paths])
+
+    def test_failed_scan(self) -> None:
+        test_library = self._interrupt_scan()
+        with patch.object(library, "_sync_chunk", side_effect=OSError):
+            with self.assertRaises(OSError):
+                library._scan_library(test_library)
+        # the failed scan is not resumed when raveberry starts again
+        self.assertFalse(os.path.exists(library._checkpoint_path()))
+
+    def test_library_watcher(self) -> None:
+        test_library = os.path.join(conf.TEST_CACHE_DIR, "test_library")
+        with tempfile.TemporaryDirectory() as library_path:
+            watcher = library_watcher._Watcher(library_path)
+            try:
+                watcher.watch("")
+
+                os.mkdir(os.path.join(library_path, "new"))
+                shutil.copy(
+                    os.path.join(test_library, "other", "Backbeat.mp3"),
+                    os.path.join(library_path, "new"),
+                )
+                for event in watcher.inotify.read(timeout=1):
+                    watcher.handle(*event)
+                self.assertEqual(watcher.changed_directories, {"new"})
+                watcher.apply()
+                self.assertFalse(watcher.changed)
+                song = ArchivedSong.objects.get(url="local_library/new/Backbeat.mp3")
+                self.assertTrue(song.cached)
+                self.assertEqual(
+                    list(
+                        PlaylistEntry.objects.filter(
+                            playlist__list_id="local_library/new"
+                        ).values_list("url", flat=True)
+                    ),
+                    ["local_library/new/Backbeat.mp3"],
+                )
+
+                os.remove(os.path.join(library_path, "new", "Backbeat.mp3"))
+                for event in watcher.inotify.read(timeout=1):
+                    watcher.handle(*event)
+                self.assertEqual(watcher.changed_files, {"new/Backbeat.mp3"})
+                with patch.object(library, "sync_files", side_effect=OSError):
+                    with self.assertRaises(OSError):
+                        watcher.apply()
+                # the lost changes are found by scanning the library
+                self.assertTrue(watcher.overflow)
+                watcher.apply()
+                song.refresh_from_db()
+                self.assertFalse(song.cached)
+            finally:
+                watcher.inotify.close()
+
+    def test_library_watcher_task(self) -> None:
+        # celery workers only know the tasks of the modules they import on startup,
+        # this process imported the watcher already
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import django; django.setup(); from core.tasks import app; "
+                "app.loader.import_default_modules(); print(sorted(app.tasks))",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+            env={**os.environ, "DJANGO_SETTINGS_MODULE": "main.settings"},
+        )
+        self.assertIn("core.settings.library_watcher._watch", result.stdout)
+
+    def _suggest(self, term: str) -> list:
+        # sqlite matches substrings until the search index is built
+        while not search_index.ready():
+            time.sleep(0.1)
+        return self._get_suggestions(term)
+
+    def _get_suggestions(self, term: str) -> list:
+        return json.loads(
+            self.client.get(
+                reverse("offline-suggestions"), {"term": term, "playlist": "false"}
+            ).content
+        )
+
+    def test_cached_suggestions(self) -> None:
+        self.assertEqual(self._suggest("Backbeat"), self._suggest("backbeat"))
+        suggestion = self._suggest("backbeat")[0]
+        stats = json.loads(self.client.get(reverse("suggestion-cache-stats")).content)
+        self.assertEqual(stats["offline_hit"]["count"], 2)
+        self.client.logout()
+        response = self.client.get(reverse("suggestion-cache-stats"))
+        self.assertEqual(response.status_code, 403)
+        util.admin_login(self.client)
+
+        # requesting the song changes its counter, which must not be served from the cache
+        self._request_suggestion(suggestion["key"])
+        self._poll_current_song()
+        self.assertEqual(
+            self._suggest("backbeat")[0]["counter"], suggestion["counter"] + 1
+        )
+
+    def test_prefix_suggestions(self) -> None:
+        # until the search index is built, results of a cached prefix are reused
+        while not search_index.ready():
+            time.sleep(0.1)
+        with search_index._lock:
+            index = search_index._index
+            # pretend the index is still being built
+            search_index._index = None
+            search_index._building = True
+        try:
+            self._get_suggestions("back")
+            suggestion = self._get_suggestions("back beat")[-1]
+        finally:
+            with search_index._lock:
+                search_index._index = index
+                search_index._building = False
+        self.assertEqual(suggestion["value"], "Kevin MacLeod – Backbeat")
+        stats = json.loads(self.client.get(reverse("suggestion-cache-stats")).content)
+        self.assertEqual(stats["offline_prefix_hit"]["count"], 1)
+
+    def test_similar_suggestions(self) -> None:
+        self.assertEqual(
+            self._suggest("bakbeat")[0]["value"], "Kevin MacLeod – Backbeat"
+        )
+        self.assertEqual(
+            self._suggest("back beat")[0]["value"], "Kevin MacLeod – Backbeat"
+        )
+
+    def test_platform_suggestions(self) -> None:
+        # the scan and the playlists create their rows in bulk, without calling save
+        self.assertFalse(
+            ArchivedSong.objects.exclude(platform="local").exists()
+            or PlaylistEntry.objects.exclude(platform="local").exists()
+        )
+        song_fields = {"artist": "Other", "duration": 46, "counter": 0, "cached": False}
+        online = ArchivedSong.objects.create(
+            url="https://www.youtube.com/watch?v=jbWZsFp2Yh4",
+            title="Backbeat Cover",
+            **song_fields,
+        )
+        unknown = ArchivedSong.objects.create(
+            url="https://example.com/backbeat.mp3", title="Backbeat Live", **song_fields
+        )
+        self.assertEqual(online.platform, "youtube")
+        self.assertEqual(unknown.platform, "unknown")
+        suggestion_cache.invalidate_offline()
+
+        def suggested() -> List[int]:
+            return [suggestion["key"] for suggestion in self._suggest("backbeat")]
+
+        # uncached online songs are only suggested with internet
+        redis.put("has_internet", False)
+        self.assertNotIn(online.id, suggested())
+        redis.put("has_internet", True)
+        self.assertIn(online.id, suggested())
+        storage.put("youtube_enabled", False)
+        self.assertNotIn(online.id, suggested())
+        storage.put("youtube_enabled", True)
+        self.assertNotIn(unknown.id, suggested())
+
+    def test_forbidden_suggestions(self) -> None:
+        self.assertTrue(self._suggest("backbeat"))
+        self.client.post(reverse("set-forbidden-keywords"), {"value": "foo, BACK"})
+        self.assertFalse(self._suggest("backbeat"))
+        self.client.post(reverse("set-forbidden-keywords"), {"value": "mac.eod"})
+        self.assertFalse(self._suggest("backbeat"))
+        self.client.post(reverse("set-forbidden-keywords"), {"value": ""})
+        self.assertTrue(self._suggest("backbeat"))
+
+    def test_playlist_suggestion_queries(self) -> None:
+        for index in range(5):
+            playlist = ArchivedPlaylist.objects.create(
+                list_id=f"local_library/mix{index}", title=f"Mix {index}", counter=0
+            )
+            PlaylistEntry.objects.create(
+                playlist=playlist, index=0, url="local_library/other/Backbeat.mp3"
+            )
+        suggestion_cache.invalidate_offline()
+        while not search_index.ready():
+            time.sleep(0.1)
+        # update the search index
+        suggestions._offline_playlist_suggestions("update")
+
+        def suggest(term: str) -> Tuple[int, int]:
+            with CaptureQueriesContext(connection) as context:
+                results = suggestions._offline_playlist_suggestions(term)
+            return len(results), len(context)
+
+        few_results, few_queries = suggest("heroes")
+        many_results, many_queries = suggest("mix")
+        self.assertEqual(few_results, 1)
+        self.assertEqual(many_results, 5)
+        # the number of queries does not depend on the number of suggestions
+        self.assertEqual(few_queries, many_queries)
+
     def test_suggested_playlist(self) -> None:
         state = self._add_local_playlist()
         self.assertEqual(
@@ -0,0 +1,73 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+from tests.raveberry_test import RaveberryTest
+
+
+class MigrationTests(RaveberryTest):
+    def _migrate(self, target: str):
+        executor = MigrationExecutor(connection)
+        nodes = [("core", target)] if target else executor.loader.graph.leaf_nodes()
+        executor.migrate(nodes)
+        return executor.loader.project_state(nodes).apps
+
+    def tearDown(self) -> None:
+        # later tests need the latest schema
+        self._migrate("")
+        super().tearDown()
+
+    def test_platform(self) -> None:
+        apps = self._migrate("0018_queuedsong_index_db_index")
+        urls = {
+            "local": "local_library/other/Backbeat.mp3",
+            "youtube": "https://www.youtube.com/watch?v=jbWZsFp2Yh4",
+            "spotify": "https://open.spotify.com/track/4bgT0ZzeGAyOsc9ngMljXz",
+            "soundcloud": "https://soundcloud.com/kevin-macleod/backbeat",
+            "jamendo": "https://www.jamendo.com/track/1234",
+            "unknown": "https://example.com/backbeat.mp3",
+        }
+        archived_song = apps.get_model("core", "ArchivedSong")
+        playlist = apps.get_model("core", "ArchivedPlaylist").objects.create(
+            list_id="local_library/other", title="other", counter=0
+        )
+        song_fields = {"artist": "Kevin MacLeod", "title": "Backbeat", "duration": 46}
+        for index, url in enumerate(urls.values()):
+            archived_song.objects.create(url=url, counter=0, cached=True, **song_fields)
+            apps.get_model("core", "PlaylistEntry").objects.create(
+                playlist=playlist, index=index, url=url
+            )
+            apps.get_model("core", "QueuedSong").objects.create(
+                index=index,
+                manually_requested=True,
+                internal_url="",
+                external_url=url,
+                **song_fields,
+            )
+        apps.get_model("core", "CurrentSong").objects.create(
+            queue_key=1,
+            votes=0,
+            manually_requested=True,
+            internal_url="",
+            external_url=urls["youtube"],
+            **song_fields,
+        )
+
+        apps = self._migrate("0019_platform")
+        expected = {url: platform for platform, url in urls.items()}
+        for model_name, url_field in [
+            ("ArchivedSong", "url"),
+            ("PlaylistEntry", "url"),
+            ("QueuedSong", "external_url"),
+        ]:
+            self.assertEqual(
+                dict(
+                    apps.get_model("core", model_name).objects.values_list(
+                        url_field, "platform"
+                    )
+                ),
+                expected,
+                model_name,
+            )
+        self.assertEqual(
+            apps.get_model("core", "CurrentSong").objects.get().platform, "youtube"
+        )
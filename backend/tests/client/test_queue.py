@@ -1,8 +1,12 @@
 import json
 import logging
+import time
 
 from django.urls import reverse
 
+from core import redis, state_handler
+from core.models import QueuedSong
+from core.musiq import musiq, voting
 from core.settings import storage
 from tests import util
 from tests.music_test import MusicTest
@@ -105,10 +109,67 @@ class QueueTests(MusicTest):
             == [key2, key1, key4, key3]
         )
 
+    def test_reorder_exhausts_gap(self) -> None:
+        state = json.loads(self.client.get(reverse("musiq-state")).content)
+        keys = [song["id"] for song in state["musiq"]["songQueue"]]
+
+        # repeatedly move the last song directly behind the first one.
+        # This halves the space between the first two songs every time,
+        # until the queue needs to be rebalanced.
+        for _ in range(12):
+            self.client.post(
+                reverse("reorder"),
+                {"prev": str(keys[0]), "element": str(keys[-1]), "next": str(keys[1])},
+            )
+            keys = [keys[0], keys[-1], *keys[1:-1]]
+            state = self._poll_musiq_state(
+                lambda state: [song["id"] for song in state["musiq"]["songQueue"]]
+                == keys
+            )
+        self.assertEqual(
+            [song["index"] for song in state["musiq"]["songQueue"]],
+            list(range(1, len(keys) + 1)),
+        )
+
     def test_remove_all(self) -> None:
         self.client.post(reverse("remove-all"))
         self._poll_musiq_state(lambda state: len(state["musiq"]["songQueue"]) == 0)
 
+    def test_queue_delta(self) -> None:
+        state = musiq.state_dict()["musiq"]
+        songs = state["songQueue"]
+        key = songs[1]["id"]
+        self.client.post(reverse("remove"), {"key": str(key)})
+        self._poll_musiq_state(lambda state: len(state["musiq"]["songQueue"]) == 3)
+
+        delta = musiq.state_dict(queue_delta=True)["musiq"]["queueDelta"]
+        self.assertGreater(delta["revision"], state["revision"])
+        self.assertEqual(
+            delta["order"], [song["id"] for song in songs if song["id"] != key]
+        )
+        # nothing changed since the last delta
+        delta = musiq.state_dict(queue_delta=True)["musiq"]["queueDelta"]
+        self.assertEqual(delta["changed"], [])
+        self.assertEqual(delta["removed"], [])
+        # full states contain the queue of the latest delta
+        state = musiq.state_dict()["musiq"]
+        self.assertEqual(state["revision"], delta["revision"])
+        self.assertEqual([song["id"] for song in state["songQueue"]], delta["order"])
+
+        # a song whose content changed is sent again, removed songs are listed
+        entries = [{"id": 1, "votes": 0}, {"id": 2, "votes": 0}]
+        state_handler.publish_delta("test_delta", lambda: entries)
+        delta = state_handler.publish_delta(
+            "test_delta", lambda: [{"id": 2, "votes": 1}]
+        )
+        self.assertEqual(delta["order"], [2])
+        self.assertEqual(delta["changed"], [{"id": 2, "votes": 1}])
+        self.assertEqual(delta["removed"], [1])
+        self.assertEqual(
+            state_handler.snapshot("test_delta"),
+            (delta["revision"], [{"id": 2, "votes": 1}]),
+        )
+
 
 class QueueVotingTests(MusicTest):
     def setUp(self) -> None:
@@ -151,6 +212,25 @@ class QueueVotingTests(MusicTest):
             == [key3, key1, key4, key2]
         )
 
+    def test_votes_flushed(self) -> None:
+        state = json.loads(self.client.get(reverse("musiq-state")).content)
+        song = state["musiq"]["songQueue"][1]
+
+        self.client.post(reverse("vote"), {"key": str(song["id"]), "amount": 1})
+        self._poll_musiq_state(
+            lambda state: any(
+                queued["id"] == song["id"] and queued["votes"] == song["votes"] + 1
+                for queued in state["musiq"]["songQueue"]
+            )
+        )
+        # votes are counted in redis and written to the database with the next broadcast
+        for _ in range(10):
+            if QueuedSong.objects.get(id=song["id"]).votes == song["votes"] + 1:
+                break
+            time.sleep(0.1)
+        else:
+            self.fail("votes were not written to the database")
+
     def test_vote_remove(self) -> None:
         state = json.loads(self.client.get(reverse("musiq-state")).content)
         # key1 -> key2 -> key3 -> key4
@@ -164,6 +244,9 @@ class QueueVotingTests(MusicTest):
             lambda state: [song["id"] for song in state["musiq"]["songQueue"]]
             == [key1, key3, key4]
         )
+        # the votes of removed songs are not kept
+        self.assertIsNone(redis.connection.zscore(voting.TOTALS, key2))
+        self.assertFalse(redis.connection.sismember(voting.KICKED, key2))
 
     def test_vote_skip(self) -> None:
         state = json.loads(self.client.get(reverse("musiq-state")).content)
@@ -0,0 +1,86 @@
+import time
+
+from core import redis, user_manager
+from tests.raveberry_test import RaveberryTest
+
+
+class RedisTests(RaveberryTest):
+    def test_defaults(self) -> None:
+        for key, default in redis.defaults.items():
+            self.assertEqual(redis.get(key), default, key)
+        for key in redis.hashes:
+            self.assertEqual(redis.get(key), {}, key)
+
+    def test_values(self) -> None:
+        # a value of every type, the type of each key is given by its default
+        samples = {
+            bool: True,
+            int: 5,
+            float: 2.5,
+            str: "text",
+            list: ["a", "b"],
+            dict: {"a": 1, "b": [1.5, "c"]},
+            tuple: (1920, 1080),
+        }
+        for key, default in redis.defaults.items():
+            value = samples[type(default)]
+            if key == "resolutions":
+                value = [(1920, 1080), (1280, 720)]
+            redis.put(key, value)
+            self.assertEqual(redis.get(key), value, key)
+            self.assertIs(type(redis.get(key)), type(default), key)
+        # every key is decoded the same way when fetched together
+        self.assertEqual(
+            redis.get_many(redis.defaults),
+            {key: redis.get(key) for key in redis.defaults},
+        )
+
+    def test_expire(self) -> None:
+        redis.put("alarm_requested", True, expire=10)
+        self.assertTrue(0 < redis.connection.ttl("alarm_requested") <= 10)
+        redis.put("download_progress", {"1": 5}, expire=10)
+        self.assertTrue(0 < redis.connection.ttl("download_progress") <= 10)
+
+    def test_hashes(self) -> None:
+        redis.put("download_progress", {"1": 5, "2": 10})
+        self.assertEqual(redis.get("download_progress"), {"1": 5, "2": 10})
+
+        # single fields are modified without reading the others
+        redis.put_field("download_progress", "3", 50)
+        redis.put_field("download_progress", "1", 20)
+        redis.delete_fields("download_progress", ["2", "4"])
+        redis.delete_fields("download_progress", [])
+        self.assertEqual(redis.get("download_progress"), {"1": 20, "3": 50})
+
+        redis.put("bluetooth_devices", {"00:11:22:33:44:55": "speaker"})
+        self.assertEqual(
+            redis.get_many(["download_progress", "bluetooth_devices", "playing"]),
+            {
+                "download_progress": {"1": 20, "3": 50},
+                "bluetooth_devices": {"00:11:22:33:44:55": "speaker"},
+                "playing": False,
+            },
+        )
+
+        # putting a hash replaces all its fields
+        redis.put("download_progress", {"2": 1})
+        self.assertEqual(redis.get("download_progress"), {"2": 1})
+        redis.put("download_progress", {})
+        self.assertEqual(redis.get("download_progress"), {})
+
+    def test_active_users(self) -> None:
+        now = time.time()
+        redis.connection.zadd(
+            "last_requests",
+            {
+                "192.168.1.2": now - user_manager.INACTIVITY_PERIOD - 1,
+                "192.168.1.3": now - 1,
+            },
+        )
+        # inactive users are only removed a minute after the last update
+        redis.put("last_user_count_update", now)
+        self.assertEqual(user_manager.get_count(), 2)
+        redis.put("last_user_count_update", now - 60)
+        self.assertEqual(user_manager.get_count(), 1)
+        self.assertIsNone(redis.connection.zscore("last_requests", "192.168.1.2"))
+        self.assertGreaterEqual(redis.get("last_user_count_update"), now)
@@ -0,0 +1,36 @@
+import time
+from unittest.mock import patch
+
+from core import state_handler
+from tests.raveberry_test import RaveberryTest
+
+
+class StateTests(RaveberryTest):
+    def test_coalesced_broadcasts(self) -> None:
+        broadcaster = state_handler.Broadcaster(0.2)
+        builds = []
+
+        def build() -> dict:
+            builds.append(time.monotonic())
+            return {"builds": len(builds)}
+
+        with patch.object(state_handler, "send_state") as send_state:
+            # all requests within the window result in a single broadcast
+            for _ in range(5):
+                broadcaster.request("coalesced", build)
+            time.sleep(0.5)
+            send_state.assert_called_once_with({"builds": 1})
+
+            # a request after the broadcast schedules the next one
+            broadcaster.request("coalesced", build)
+            time.sleep(0.5)
+            self.assertEqual(send_state.call_count, 2)
+
+        self.assertEqual(
+            broadcaster.counters()["coalesced"], {"requested": 6, "sent": 2}
+        )
+        # the counters are shared by all processes and broadcasters
+        self.assertEqual(
+            state_handler.broadcaster.counters()["coalesced"],
+            {"requested": 6, "sent": 2},
+        )
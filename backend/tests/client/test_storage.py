@@ -0,0 +1,74 @@
+import time
+from typing import Callable
+
+from django.db import transaction
+
+from core import redis
+from core.models import Setting
+from core.settings import storage
+from tests.raveberry_test import RaveberryTest
+
+
+class StorageTests(RaveberryTest):
+    def setUp(self) -> None:
+        super().setUp()
+        # the database was reset since values were cached in earlier tests
+        storage.clear_cache()
+        storage.get("volume")
+        self._wait_for(lambda: storage._subscribed)
+        storage.get("volume")
+        self.assertIn("volume", storage.cache)
+
+    def _wait_for(self, condition: Callable[[], bool], timeout: float = 3) -> None:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("condition not met")
+            time.sleep(0.01)
+
+    def _change_in_other_process(self, value: float) -> None:
+        # another process writes the database, but this process did not evict its cache
+        Setting.objects.filter(key="volume").update(value=str(value))
+
+    def test_evicted_by_other_process(self) -> None:
+        self._change_in_other_process(0.3)
+        self.assertEqual(storage.get("volume"), 1.0)
+        redis.connection.publish(storage.CHANNEL, "volume")
+        self._wait_for(lambda: "volume" not in storage.cache)
+        self.assertEqual(storage.get("volume"), 0.3)
+
+    def test_announced_after_commit(self) -> None:
+        pubsub = redis.connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(storage.CHANNEL)
+        try:
+            with transaction.atomic():
+                storage.put("volume", 0.4)
+                # other processes would read the old value from the database
+                self.assertIsNone(pubsub.get_message(timeout=0.2))
+            message = pubsub.get_message(timeout=1)
+            self.assertIsNotNone(message)
+            self.assertEqual(message["data"], "volume")
+        finally:
+            pubsub.close()
+
+    def test_reconnected_listener(self) -> None:
+        # changes announced while the listener reconnects are missed
+        self._change_in_other_process(0.3)
+        # like a restart of redis, every process reconnects its subscriptions
+        redis.connection.client_kill_filter(_type="pubsub")
+        self._wait_for(lambda: storage.get("volume") == 0.3)
+
+    def test_disabled_without_listener(self) -> None:
+        # the listener disables the cache when it loses its connection
+        with storage._cache_lock:
+            storage._subscribed = False
+        storage.clear_cache()
+        try:
+            self._change_in_other_process(0.3)
+            self.assertEqual(storage.get("volume"), 0.3)
+            self.assertNotIn("volume", storage.cache)
+            self._change_in_other_process(0.5)
+            self.assertEqual(storage.get_many(["volume"]), {"volume": 0.5})
+        finally:
+            with storage._cache_lock:
+                storage._subscribed = True
@@ -173,6 +173,26 @@ class YoutubeTests(MusicTest):
         # make sure the remaining songs are in expected order
         self.assertEqual(actual_playlist, expected_playlist)
 
+    def test_same_song_twice(self) -> None:
+        # the second request waits for the download of the first one
+        self._post_request(
+            "request-music", "https://www.youtube.com/watch?v=piFJVwr1YYA"
+        )
+        self._post_request(
+            "request-music", "https://www.youtube.com/watch?v=piFJVwr1YYA"
+        )
+        state = self._poll_musiq_state(
+            lambda state: state["musiq"]["currentSong"]
+            and len(state["musiq"]["songQueue"]) == 1
+            and state["musiq"]["songQueue"][0]["internalUrl"],
+            timeout=30,
+        )
+        self.assertEqual(
+            state["musiq"]["currentSong"]["externalUrl"],
+            state["musiq"]["songQueue"][0]["externalUrl"],
+        )
+        self.assertIsNone(state["musiq"]["songQueue"][0]["downloadProgress"])
+
     def test_autoplay(self) -> None:
         self._post_request(
             "request-music", "https://www.youtube.com/watch?v=ZvD8QSO7NPw"
@@ -51,9 +51,9 @@ export function onReady() {
         'term': request.term,
         'playlist': playlistEnabled(),
       }).done(function(suggestions) {
+        offlineSuggestions = suggestions;
         if (firstResponse) {
           firstResponse = false;
-          offlineSuggestions = suggestions;
           suggestions = placeholders.concat(suggestions);
           suggestions.unshift(searchEntry);
           response(suggestions);
@@ -64,10 +64,12 @@ export function onReady() {
           response(suggestions);
         }
       });
-      $.get(urls['musiq']['online-suggestions'], {
-        'term': request.term,
-        'playlist': playlistEnabled(),
-      }).done(function(suggestions) {
+
+      /** Shows the given online suggestions together with the offline ones.
+       * @param {Array} suggestions the online suggestions
+       */
+      function showOnlineSuggestions(suggestions) {
+        suggestions = suggestions.slice();
         // Ensure that the suggestion contains as many entries
         // as there were placeholders.
         // This prevents content changes before user input.
@@ -83,11 +85,59 @@ export function onReady() {
           onlineSuggestions = suggestions;
           response(suggestions);
         } else {
-          suggestions = suggestions.concat(offlineSuggestions);
-          suggestions.unshift(searchEntry);
-          response(suggestions);
+          onlineSuggestions = [searchEntry].concat(suggestions);
+          response(onlineSuggestions.concat(offlineSuggestions));
         }
-      });
+      }
+
+      /** Requests the online suggestions of the given platforms.
+       * Platforms that did not answer in time are returned as placeholders,
+       * they are requested again a limited number of times.
+       * @param {Array} platforms the platforms to ask, all if empty
+       * @param {Array} previous the suggestions received so far
+       * @param {number} retries how often late platforms are requested again
+       */
+      function requestOnlineSuggestions(platforms, previous, retries) {
+        $.get(urls['musiq']['online-suggestions'], {
+          'term': request.term,
+          'playlist': playlistEnabled(),
+          'platforms': platforms.join(','),
+        }).done(function(suggestions) {
+          // replace the placeholders of the requested platforms with their results
+          let merged = suggestions;
+          if (platforms.length > 0) {
+            merged = [];
+            let inserted = false;
+            for (const suggestion of previous) {
+              const platform = suggestion.type.replace('-placeholder', '');
+              if (suggestion.type.endsWith('-placeholder') &&
+                  platforms.includes(platform)) {
+                if (!inserted) {
+                  merged = merged.concat(suggestions);
+                  inserted = true;
+                }
+              } else {
+                merged.push(suggestion);
+              }
+            }
+          }
+          showOnlineSuggestions(merged);
+
+          const late = [];
+          for (const suggestion of merged) {
+            if (suggestion.type.endsWith('-placeholder')) {
+              const platform = suggestion.type.replace('-placeholder', '');
+              if (!late.includes(platform)) {
+                late.push(platform);
+              }
+            }
+          }
+          if (late.length > 0 && retries > 0) {
+            requestOnlineSuggestions(late, merged, retries - 1);
+          }
+        });
+      }
+      requestOnlineSuggestions([], [], 3);
     },
     appendTo: '#music-input-card',
     open: function() {
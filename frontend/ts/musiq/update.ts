@@ -1,9 +1,10 @@
-import {localStorageGet, registerSpecificState} from '../base';
+import {getState, localStorageGet, registerSpecificState} from '../base';
 import {showPlayButton, showPauseButton} from './buttons';
 import {syncAudioStream} from './audio';
 
 export let state = null;
 let animationInProgress = false;
+let resyncInProgress = false;
 
 const downloadSvg = `
 <svg version="1.1" viewBox="0 0 100 100" xmlns="http://www.w3.org/2000/svg">
@@ -19,6 +20,37 @@ export function clearState() {
   state = null;
 }
 
+/** Replaces the queue delta of the given state with the resulting song queue.
+ * @param {Object} musiqState the musiq part of a state update
+ * @return {boolean} whether the delta could be applied */
+function applyQueueDelta(musiqState) {
+  const delta = musiqState.queueDelta;
+  delete musiqState.queueDelta;
+  if (state == null || state.revision != delta.base) {
+    // we missed an update or have not received the full state yet
+    if (!resyncInProgress) {
+      resyncInProgress = true;
+      getState();
+    }
+    return false;
+  }
+  const songs = new Map();
+  for (const song of state.songQueue) {
+    songs.set(song.id, song);
+  }
+  for (const id of delta.removed) {
+    songs.delete(id);
+  }
+  for (const song of delta.changed) {
+    songs.set(song.id, song);
+  }
+  musiqState.songQueue = delta.order.map((id, position) => {
+    return jQuery.extend({}, songs.get(id), {index: position + 1});
+  });
+  musiqState.revision = delta.revision;
+  return true;
+}
+
 /** Update the musiq state.
  * @param {Object} newState an object containing all state information */
 export function updateState(newState) {
@@ -26,6 +58,19 @@ export function updateState(newState) {
     // this state is not meant for a musiq update
     return;
   }
+  if ('queueDelta' in newState.musiq) {
+    if (!applyQueueDelta(newState.musiq)) {
+      return;
+    }
+  } else if ('songQueue' in newState.musiq) {
+    // a full state, every following delta is based on it
+    resyncInProgress = false;
+    if (state != null && state.revision > newState.musiq.revision) {
+      // a delta newer than this state was already applied
+      newState.musiq.songQueue = state.songQueue;
+      newState.musiq.revision = state.revision;
+    }
+  }
   // create deep copy
   let oldState = null;
   if (state != null) {
@@ -276,6 +321,15 @@ function updateInformation(entry, song) {
     downloadIcon.show();
     index.hide();
   }
+  // while the song is downloaded, the overlay shrinks with its progress
+  const overlay = downloadIcon.find('.download-overlay');
+  if (song.downloadProgress != null) {
+    overlay.addClass('download-progress');
+    overlay.css('height', (100 - song.downloadProgress) + '%');
+  } else {
+    overlay.removeClass('download-progress');
+    overlay.css('height', '');
+  }
 
   const title = entry.find('.queue-title');
   insertDisplayName(title, song);